@@ -1,26 +1,39 @@
 #!/usr/bin/env python
-
-from __future__ import division
-import sys
-#import glob
+#PAMProtoPatternGrab_full.py <spacerfile> <dbfile> [<genomefile>] [options]
+#BLASTs CRISPR spacers against a genome database and cuts the protospacer (with 3 flanking bases each side) of every hit.
+#Writes, in <dbfile>_vs_<spacerfile>.dir:
+#  .aln: the blastn-short alignments (qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue
+#    bitscore qlen slen btop)
+#  .filt.aln: the alignments kept by the filter
+#  .extra.aln: every alignment plus spacer, protospacer, protospacer identity, 5' and 3' flanks
+#  .summary.txt: alignments, PAM (CC) counts and the mean identity of partial-match extensions by extension length
+#Alignment rows are worked through in chunks by a pool of processes; chunks are written back in file order.
+from __future__ import division, print_function
+import argparse
+import binascii
 import os
-import subprocess
 import re
+import string
+import subprocess
+import sys
+from itertools import islice
+from multiprocessing import Pool
+
+import vicsin_trace
 
-spacerfile=sys.argv[1]
-dbfile=sys.argv[2]
+try:
+	import numpy
+except ImportError:
+	numpy=None
 
-alnfilename=os.path.basename(dbfile)[:]+'_vs_'+os.path.basename(spacerfile)
+try:
+	complement=string.maketrans('ACGTRYKMBVDHNSWacgtrykmbvdhnsw', 'TGCAYRMKVBHDNSWtgcayrmkvbhdnsw')
+except AttributeError:
+	complement=str.maketrans('ACGTRYKMBVDHNSWacgtrykmbvdhnsw', 'TGCAYRMKVBHDNSWtgcayrmkvbhdnsw')
 
-os.mkdir(alnfilename+'.dir')
-alnfilename1=alnfilename+'.dir/'+alnfilename+'.aln'
-subprocess.call(['blastn', '-task', 'blastn-short', '-query', spacerfile, '-db', dbfile, '-outfmt', '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen btop', '-max_target_seqs', '1000000', '-evalue', '.1', '-out', alnfilename1])
-print alnfilename1
-filteredaln=alnfilename+'.dir/'+alnfilename+'.filt.aln'
-extra=alnfilename+'.dir/'+alnfilename+'.extra.aln'
-filteredalnfile=open(filteredaln, "w")
-extraaln=open(extra, "w")
-alnfile=open(alnfilename1, "r")
+#Set in each worker by init_worker
+spacerfiledict={}
+genome={}
 
 def checkgaps(BTOP):
 	BTOParray=re.split('(\D+)', BTOP)
@@ -35,80 +48,141 @@ def checkgaps(BTOP):
 				return BTOP
 		x=x+1
 
-spacerfiledict={}
-spacers=open(spacerfile, "r")
-for line in spacers:
-	if line.startswith(">"):
-		spacerID=line[1:].strip()
-	else:
-		spacerfiledict[spacerID]=line.strip()
-#print spacerfiledict
+def readspacers(spacerfile):
+	spacers={}
+	for line in open(spacerfile, "r"):
+		if line.startswith(">"):
+			spacerID=line[1:].strip()
+		else:
+			spacers[spacerID]=line.strip()
+	return spacers
+
+#Protospacer windows are cut out of the genome in process rather than with one blastdbcmd call per hit.
+#The genome is read from genomefile if given, otherwise every hit subject is pulled from the BLAST database in one -entry_batch call.
+def readgenome(fastafile):
+	sequences={}
+	chunks=None
+	for line in open(fastafile, "r"):
+		if line.startswith(">"):
+			seqID=(line[1:].split() or [''])[0]
+			chunks=sequences.setdefault(seqID, [])
+		elif chunks is not None:
+			chunks.append(line.strip())
+	for seqID in sequences:
+		sequences[seqID]=''.join(sequences[seqID]).upper()
+	return sequences
+
+def readblastdb(alnfilename, dbfile):
+	entries=[]
+	seen=set()
+	for line in open(alnfilename, "r"):
+		linearray=line.split('\t')
+		if len(linearray)>1 and linearray[1] not in seen:
+			seen.add(linearray[1])
+			entries.append(linearray[1])
+	sequences={}
+	if len(entries)==0:
+		return sequences
+	batchfilename=alnfilename+'.entries'
+	batchfile=open(batchfilename, "w")
+	batchfile.write('\n'.join(entries)+'\n')
+	batchfile.close()
+	entry=subprocess.Popen(['blastdbcmd', '-db', dbfile, '-entry_batch', batchfilename, '-outfmt', '%s'], stdout=subprocess.PIPE, universal_newlines=True)
+	lines=entry.communicate()[0].split('\n')
+	os.remove(batchfilename)
+	if len(lines)<len(entries):
+		sys.exit('blastdbcmd returned '+str(len(lines))+' sequences for '+str(len(entries))+' hit subjects')
+	for seqID, sequence in zip(entries, lines):
+		sequences[seqID]=sequence.strip().upper()
+	return sequences
 
-def blastdbcm(linearray):
-	if int(linearray[8])<int(linearray[9]): #positive strand
-		range1=linearray[8]+'-'+linearray[9]
-		entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','plus','-range',range1], stdout=subprocess.PIPE)
-        	fastaarray=entry.communicate()[0].split('\n')
-        	protostring=fastaarray[1]
-        if int(linearray[8])>int(linearray[9]):
-                range1=linearray[9]+'-'+linearray[8] #negative strand
-                entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','minus','-range',range1], stdout=subprocess.PIPE)
-                fastaarray=entry.communicate()[0].split('\n')
-                protostring=fastaarray[1]
+def genomeentry(entry):
+	if entry in genome:
+		return genome[entry]
+	for seqID in entry.split('|'): # BLAST may report ids like ref|NC_000000|
+		if seqID in genome:
+			return genome[seqID]
+	return ''
+
+def protowindow(entry, range1, strand):
+	"""returns what blastdbcmd -entry entry -range range1 -strand strand prints, split into lines"""
+	start, end=[int(x) for x in range1.split('-')]
+	sequence=genomeentry(entry)
+	if start<1 or start>end or start>len(sequence):
+		return ['']
+	window=sequence[start-1:end]
+	if strand=='minus':
+		window=window.translate(complement)[::-1]
+	return ['>'+entry]+[window[i:i+80] for i in range(0, len(window), 80)]+[''] # blastdbcmd wraps at 80 bases
 
 def check6thpos(protostring, spacerstring):
-	proto=list(protostring)
-	spacer=list(spacerstring)
-	i=0
-	distance=0
-	if len(proto)==len(spacer):
-		while len(proto)>i:
-			if proto[i] !=spacer[i]:
-				if i % 5 ==0:
-					distance=distance
-				else:
-					distance=distance+1
-			i=i+1
-	else:
-		distance=len(spacer)
-	if distance > 0:
-		return 1
-	else:
-		return 0
+	"""1 if the sequences differ anywhere but every fifth position, or differ in length; else 0"""
+	if len(protostring)!=len(spacerstring):
+		return 1 if len(spacerstring)>0 else 0
+	return 1 if any(protostring[i]!=spacerstring[i] for i in range(len(spacerstring)) if i%5!=0) else 0
 
 def gethamming(protostring, spacerstring):
-	proto=list(protostring)
-	spacer=list(spacerstring)
-	i=0
-	distance=0
-	if len(proto)==len(spacer):
-		while len(proto)>i:
-			if proto[i]!=spacer[i]:
-				distance=distance+1	
-			i=i+1	
-	else:	
-		distance=len(spacer)
-	return distance
+	if len(protostring)!=len(spacerstring):
+		return len(spacerstring)
+	return len(spacerstring)-identities([(protostring, spacerstring)])[0]
+
+def identities(pairs):
+	"""number of identical positions of each (protospacer, spacer) pair of equal length sequences. The pairs of a
+	batch are joined and compared at once: with NumPy as byte arrays, whose running count of equal positions gives
+	each pair's count; without it in one XOR of their bytes as integers, counting the zero bytes of each pair."""
+	first=''.join(pair[0] for pair in pairs).encode('latin-1')
+	second=''.join(pair[1] for pair in pairs).encode('latin-1')
+	if len(first)==0:
+		return [0]*len(pairs)
+	if numpy is not None:
+		lengths=numpy.array([len(pair[0]) for pair in pairs])
+		ends=numpy.cumsum(lengths)
+		equal=numpy.concatenate(([0], numpy.cumsum(numpy.frombuffer(first, dtype=numpy.uint8)==numpy.frombuffer(second, dtype=numpy.uint8))))
+		return (equal[ends]-equal[ends-lengths]).tolist()
+	xor=int(binascii.hexlify(first), 16)^int(binascii.hexlify(second), 16)
+	xor=binascii.unhexlify('%0*x' % (2*len(first), xor))
+	counts=[]
+	offset=0
+	for pair in pairs:
+		counts.append(xor.count(b'\0', offset, offset+len(pair[0])))
+		offset=offset+len(pair[0])
+	return counts
+
 def getPID(protostring, spacerstring):
-        proto=list(protostring)
-        spacer=list(spacerstring)
-        i=0
-        sim=0
-        if len(proto)==len(spacer):
-                while len(proto)>i:
-                        if proto[i]==spacer[i]:
-                                sim=sim+1
-                        i=i+1
-	return float(sim)/len(spacer)
+	if len(protostring)!=len(spacerstring):
+		return 0.0
+	return identities([(protostring, spacerstring)])[0]/len(spacerstring)
+
+def pidstring(pid):
+	"""a fraction as Python 2 str() writes it, so .extra.aln is the same under Python 2 and 3"""
+	text='%.12g' % pid
+	if '.' not in text and 'e' not in text and 'n' not in text:
+		text=text+'.0'
+	return text
+
+def printline(fields):
+	"""a line as the Python 2 statement print a, '\\t', b, ... wrote it"""
+	return ' \t'.join(str(field) for field in fields)
+
+class Row(object):
+	"""what one alignment row writes; identities are counted later for the whole chunk, so the row keeps the
+	(protospacer, spacer) pairs it needs them for"""
+	def __init__(self, line, spacer):
+		self.line=line
+		self.spacer=spacer
+		self.filtered=False
+		self.extras=[] # (alignment, spacer, protospacer, pair, 5' flank, 3' flank)
+		self.extensions=[] # (extension length, pair)
+		self.stdout=[]
+		self.CCcount=0
+		self.CCcountEXT=0
 
-CCcount=0
-PIDdict={}
-newalnfilearray=[]
-CCcountEXT=0
-countlines=0
-for line in alnfile:
-	countlines=countlines+1
+	def extra(self, protostring, spacerstring):
+		self.extras.append((self.line.strip(), self.spacer, protostring[3:-3], (protostring[3:-3], spacerstring), protostring[0:3], protostring[-3:-1]))
+
+def processrow(line):
 	linearray=line.strip().split('\t')
+	row=Row(line, spacerfiledict[linearray[0]])
 	spacersize=len(spacerfiledict[linearray[0]])
 	endextlen=spacersize-int(linearray[7]) #figure out
 	startextlen=int(linearray[6])-1 #figure out
@@ -116,169 +190,84 @@ for line in alnfile:
 	BTOParray=re.split('(\D+)', BTOP)
 	slen=int(linearray[-2])
 	qlen=int(linearray[-3])
+	sstart=int(linearray[8])
+	send=int(linearray[9])
 	spacerstring=spacerfiledict[linearray[0]]
-	#print endextlen
-	#print startextlen
-        fastaarray=[]
-        protostring="DOES NOT MEET CONDITION"
+	fastaarray=[]
+	protostring="DOES NOT MEET CONDITION"
 	if spacersize == int(BTOParray[0]): # fillupfile
-		filteredalnfile.write(line)
-                #extralnline='\t'.join([line.strip(),spacerfiledict[linearray[0]], spacerfiledict[linearray[0]], '1'])
-                #extraaln.write(extralnline+'\n')
-		if int(linearray[8])<int(linearray[9]) and int(linearray[8])-startextlen-3>0 and int(linearray[9])+endextlen+3<slen: #positive strand
-                        range1=str(int(linearray[8])-startextlen-3)+'-'+str(int(linearray[9])+endextlen+3)
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','plus','-range',range1], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
-                        spacerstring=spacerfiledict[linearray[0]]
-                        if len(fastaarray)<2:
-                                protostring=fastaarray[0]
-                        else:
-                                protostring=fastaarray[1]
-                elif int(linearray[8])>int(linearray[9]) and int(linearray[9])-endextlen-3>0 and int(linearray[8])+startextlen+3<slen: #negative strand
-                        range1=str(int(linearray[9])-endextlen-3)+'-'+str(int(linearray[8])+startextlen+3) #negative strand
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','minus','-range',range1], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
-                        if len(fastaarray)<2:
-				protostring=fastaarray[0]
-			else:
-				protostring=fastaarray[1]
-			spacerstring=spacerfiledict[linearray[0]]
-		if len(fastaarray)>1 and len(spacerstring)==len(protostring[3:-3]):# and check6thpos(protostring[3:-3], spacerstring)==0:# and protostring[1:3]=='CC':
-			print linearray[1], '\t', protostring[3:-3], '\t', protostring[0:3], '\t', protostring[1:3],'\t', protostring[-3:-1], '\t', BTOP,'\t',0 
-			#print linearray[0], '\t', spacerstring, '\t', [range]
+		row.filtered=True
+		if sstart<send and sstart-startextlen-3>0 and send+endextlen+3<slen: #positive strand
+			range1=str(sstart-startextlen-3)+'-'+str(send+endextlen+3)
+			fastaarray=protowindow(linearray[1], range1, 'plus')
+		elif sstart>send and send-endextlen-3>0 and sstart+startextlen+3<slen: #negative strand
+			range1=str(send-endextlen-3)+'-'+str(sstart+startextlen+3)
+			fastaarray=protowindow(linearray[1], range1, 'minus')
+		if len(fastaarray)>0:
+			protostring=fastaarray[0] if len(fastaarray)<2 else fastaarray[1]
+		if len(fastaarray)>1 and len(spacerstring)==len(protostring[3:-3]):
+			row.stdout.append(printline([linearray[1], protostring[3:-3], protostring[0:3], protostring[1:3], protostring[-3:-1], BTOP, 0]))
 			if "CC" in protostring[1:3]:
-				CCcount=CCcount+1	
-       #         extralnline='\t'.join([line.strip(),spacerfiledict[linearray[0]], protostring[3:-3], str(getPID(protostring[3:-3],spacerstring)), protostring[0:3], protostring[-3:-1]])
-       #         extraaln.write(extralnline+'\n')
-	#if they have mismatches	
+				row.CCcount=row.CCcount+1
+	#if they have mismatches
 	elif int(linearray[3])==spacersize and '-' not in BTOP and spacersize != int(BTOParray[0]):
-	        if int(linearray[8])<int(linearray[9]) and int(linearray[8])-startextlen-3>0 and int(linearray[9])+endextlen<slen: #positive strand
-                        range1=str(int(linearray[8])-startextlen-3)+'-'+str(int(linearray[9])+endextlen+3)
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','plus','-range',range1], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
-                        spacerstring=spacerfiledict[linearray[0]]
-			if len(fastaarray)<2:
-				protostring=fastaarray[0]
-			else:
-				protostring=fastaarray[1]
-                elif int(linearray[8])>int(linearray[9]) and int(linearray[9])-endextlen-3>0 and int(linearray[8])+startextlen+3<slen: #negative strand
-                        range1=str(int(linearray[9])-endextlen-3)+'-'+str(int(linearray[8])+startextlen+3) #negative strand
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','minus','-range',range1], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
-			if len(fastaarray)<2:
-				protostring=fastaarray[0]
-			else:
-				protostring=fastaarray[1]
-			spacerstring=spacerfiledict[linearray[0]]
-		if len(fastaarray)>1 and len(spacerstring)==len(protostring[3:-3]):# and check6thpos(protostring[3:-3], spacerstring)==0:# and protostring[1:3]=='CC':
-			print linearray[1], '\t', protostring[3:-3], '\t', protostring[0:3],'\t', protostring[1:3], '\t',protostring[-3:-1], '\t', BTOP, '\t', gethamming(protostring[3:], spacerstring) 
-			#print linearray[0], '\t', spacerstring, '\t', [range]
+		if sstart<send and sstart-startextlen-3>0 and send+endextlen<slen: #positive strand
+			range1=str(sstart-startextlen-3)+'-'+str(send+endextlen+3)
+			fastaarray=protowindow(linearray[1], range1, 'plus')
+		elif sstart>send and send-endextlen-3>0 and sstart+startextlen+3<slen: #negative strand
+			range1=str(send-endextlen-3)+'-'+str(sstart+startextlen+3)
+			fastaarray=protowindow(linearray[1], range1, 'minus')
+		if len(fastaarray)>0:
+			protostring=fastaarray[0] if len(fastaarray)<2 else fastaarray[1]
+		if len(fastaarray)>1 and len(spacerstring)==len(protostring[3:-3]):
+			row.stdout.append(printline([linearray[1], protostring[3:-3], protostring[0:3], protostring[1:3], protostring[-3:-1], BTOP, gethamming(protostring[3:], spacerstring)]))
 			if "CC" in protostring[1:3]:
-				CCcount=CCcount+1
+				row.CCcount=row.CCcount+1
 		if gethamming(protostring, spacerstring)>4:
-			filteredalnfile.write(line)
-                extralnline='\t'.join([line.strip(),spacerfiledict[linearray[0]], protostring[3:-3], str(getPID(protostring[3:-3],spacerstring)), protostring[0:3], protostring[-3:-1]])
-                extraaln.write(extralnline+'\n')
+			row.filtered=True
+		row.extra(protostring, spacerstring)
 	elif int(linearray[3])<spacersize and '-' not in BTOP and float(linearray[-5])<float(.1): #partial matches and extension
-		#print endextlen
-		#print startextlen
 		qstart=int(linearray[6])
 		qend=int(linearray[7])
-		if int(linearray[8])<int(linearray[9]) and int(linearray[8])-startextlen-3>0 and int(linearray[9])+endextlen+3<slen-1: #positive strand
-                        range1=str(int(linearray[8])-startextlen-3)+'-'+str(int(linearray[9])+endextlen+3)
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','plus','-range',range1], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
-			if len(fastaarray)<2:
-				protostring=fastaarray[0]
-			if len(fastaarray)>1:
-				protostring=fastaarray[1]
-			    	if len(protostring[3:-3])==len(spacerstring):# and check6thpos(protostring[3:-3], spacerstring)==0:# and protostring[1:3]=='CC':
-					spacerstring=spacerfiledict[linearray[0]]
-					##print linearray[1], '\t', protostring[3:-3], ##'\t', protostring[0:3], '\t', protostring[1:3], '\t',protostring[-3:-1],'\t', BTOP, '\t', gethamming(protostring[3:],spacerstring)
-					##print linearray[0], '\t', spacerfiledict[linearray[0]], '\t', [range]
-					startprotoext=protostring[3:qstart+2]
-					#print startprotoext
-					startspacerext=spacerstring[0:qstart-1]
-					#print startspacerext
-					endprotoext=protostring[qend+3:-3]
-					endspacerext=spacerstring[qend:qlen]
-					if len(startprotoext)>0:# and "CC" in protostring[1:3]:
-						#print len(startprotoext)
-						startPID=getPID(startprotoext, startspacerext)
-						PIDdict.setdefault(len(startprotoext), []).append(startPID)
-						#print len(startprotoext),'\t',startPID
-					if len(endprotoext)>0:# and "CC" in protostring[1:3]:
-						#print len(endprotoext)
-#						print protostring[1:3]
-#						print protostring
-						endPID=getPID(endprotoext, endspacerext)
-						PIDdict.setdefault(len(endprotoext), []).append(endPID)
-					#	print len(endprotoext),'\t',endPID
-					if "CC" in protostring[1:3] and "CC" in protostring[1:3]:
-						CCcountEXT=CCcountEXT+1
-					#if len(startprotoext) ==11 and "CC" in protostring[1:3]: #or len(endprotoext)==5:
-					#	print protostring[3:-3]
-					#	print spacerstring
-					#	print startprotoext
-					#	#print endprotoext
-					#if len(endprotoext)==11 and "CC" in protostring[1:3]:
-					#	print protostring[3:-3]
-					#	print spacerstring
-					#	print endprotoext
-			if gethamming(protostring, spacerstring)>4:
-				filteredalnfile.write(line)
-                elif int(linearray[8])>int(linearray[9]) and int(linearray[9])-endextlen-3>0 and int(linearray[8])+startextlen+3<slen-1: #negative strand
-                        range1=str(int(linearray[9])-endextlen-3)+'-'+str(int(linearray[8])+startextlen+3) #negative strand
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','minus','-range',range1], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
-			if len(fastaarray)<2:	
-				protostring=fastaarray[0]
-			if len(fastaarray)>1:
-				protostring=fastaarray[1]
-			        if len(protostring[3:-3])==len(spacerstring):# and check6thpos(protostring[3:-3], spacerstring)==0:# and protostring[1:3]=='CC':
-					startprotoext= protostring[3:qstart+2]
-					startspacerext= spacerstring[0:qstart-1]
-					endprotoext= protostring[qend+3:-3]
-					endspacerext= spacerstring[qend:qlen]
-					spacerstring=spacerfiledict[linearray[0]]
-					#if len(startprotoext)==11 and "CC" in protostring[1:3]: #or len(endprotoext)==5:
-					#	print protostring[3:-3]
-					#	print spacerstring
-					#	print startprotoext
-					#	print endprotoext
-					if len(startprotoext)>0:# and "CC" in protostring[1:3]:
-						startPID=getPID(startprotoext, startspacerext)
-						PIDdict.setdefault(len(startprotoext),[]).append(startPID)
-					if len(endprotoext)>0:# and "CC" in protostring[1:3]:
-						endPID=getPID(endprotoext, endspacerext)
-						PIDdict.setdefault(len(endprotoext),[]).append(endPID)
-					#print linearray[1], '\n', protostring[3:-3],'\n', spacerstring ##'\t', protostring[0:3], '\t', protostring[1:3],'\t',protostring[-3:-1], '\t', BTOP, '\t', gethamming(protostring[3:], spacerstring)
-					##print linearray[0], '\t', spacerstring, '\t', [range]
-					if "CC" in protostring[1:3]:
-						CCcount=CCcount+1
+		if sstart<send and sstart-startextlen-3>0 and send+endextlen+3<slen-1: #positive strand
+			range1=str(sstart-startextlen-3)+'-'+str(send+endextlen+3)
+			fastaarray=protowindow(linearray[1], range1, 'plus')
+			strand='plus'
+		elif sstart>send and send-endextlen-3>0 and sstart+startextlen+3<slen-1: #negative strand
+			range1=str(send-endextlen-3)+'-'+str(sstart+startextlen+3)
+			fastaarray=protowindow(linearray[1], range1, 'minus')
+			strand='minus'
+		if len(fastaarray)>0:
+			protostring=fastaarray[0] if len(fastaarray)<2 else fastaarray[1]
+			if len(fastaarray)>1 and len(protostring[3:-3])==len(spacerstring):
+				startprotoext=protostring[3:qstart+2]
+				startspacerext=spacerstring[0:qstart-1]
+				endprotoext=protostring[qend+3:-3]
+				endspacerext=spacerstring[qend:qlen]
+				if len(startprotoext)>0:
+					row.extensions.append((len(startprotoext), (startprotoext, startspacerext)))
+				if len(endprotoext)>0:
+					row.extensions.append((len(endprotoext), (endprotoext, endspacerext)))
+				# PAMs of plus strand extensions have always been counted apart from the others
+				if "CC" in protostring[1:3]:
+					if strand=='plus':
+						row.CCcountEXT=row.CCcountEXT+1
+					else:
+						row.CCcount=row.CCcount+1
 			if gethamming(protostring, spacerstring)>4:
-				filteredalnfile.write(line)
-#                extralnline='\t'.join([line.strip(),spacerfiledict[linearray[0]], protostring[3:-3], str(getPID(protostring[3:-3],spacerstring)), protostring[0:3], protostring[-3:-1]])
-#                extraaln.write(extralnline+'\n')
+				row.filtered=True
 	elif '-' in BTOP:# check for gaps
-                print 'gap found'
+		row.stdout.append('gap found')
 		x=1
-		y=1
-		querygaps=0
-		subjectgaps=0
-		BTOParray= re.split('(\D+)',BTOP)
-		query=[]
-		subject=[]
-		if int(linearray[8])<int(linearray[9]) and int(linearray[8])-startextlen-3>0 and int(linearray[9])+endextlen<slen: #positive strand
-                        range=str(int(linearray[8])-startextlen-3)+'-'+str(int(linearray[9])+endextlen)
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','plus','-range',range], stdout=subprocess.PIPE)
-			fastaarray=entry.communicate()[0].split('\n')
-		elif int(linearray[8])>int(linearray[9]) and int(linearray[9])-endextlen>0 and int(linearray[8])+startextlen+3<slen:
-                        range=str(int(linearray[9])-endextlen)+'-'+str(int(linearray[8])+startextlen+3) #negative strand
-                        entry=subprocess.Popen(['blastdbcmd', '-entry', linearray[1], '-db', dbfile,'-strand','minus','-range',range], stdout=subprocess.PIPE)
-                        fastaarray=entry.communicate()[0].split('\n')
+		if sstart<send and sstart-startextlen-3>0 and send+endextlen<slen: #positive strand
+			range1=str(sstart-startextlen-3)+'-'+str(send+endextlen)
+			fastaarray=protowindow(linearray[1], range1, 'plus')
+		elif sstart>send and send-endextlen>0 and sstart+startextlen+3<slen:
+			range1=str(send-endextlen)+'-'+str(sstart+startextlen+3) #negative strand
+			fastaarray=protowindow(linearray[1], range1, 'minus')
 		charcount=0
-		protospacerchars=list(str(fastaarray[1]))
+		# a hit too close to a contig end has no window
+		protospacerchars=list(str(fastaarray[1])) if len(fastaarray)>1 else []
 		spacerchars=list(spacerfiledict[linearray[0]])
 		#add gaps and get hamming distance
 		for characters in list(BTOParray[1]):
@@ -292,32 +281,142 @@ for line in alnfile:
 					protospacerchars.insert(insertloc, "-")
 					charcount=charcount+1
 			x=x+1
-			#charcount=charcount+1
-		print protostring
-		print ''.join(protospacerchars)
-		print spacerstring
-		if len(fastaarray)>1 and len(spacerstring)==len(protostring[3:-3]):	
+		row.stdout.append(protostring)
+		row.stdout.append(''.join(protospacerchars))
+		row.stdout.append(spacerstring)
+		if len(fastaarray)>1 and len(spacerstring)==len(protostring[3:-3]):
 			protostring=''.join(protospacerchars)
-			##print linearray[1], '\t', protostring[3:],'\t', protostring[0:3], '\t', protostring[1:3], '\t', BTOP, '\t', gethamming(protostring[3:],spacerstring)
 			spacerstring=''.join(spacerchars)
-			##print linearray[0], '\t', spacerstring, '\t', [range]
 			if "CC" in protostring[1:3]:
-				CCcount=CCcount+1
+				row.CCcount=row.CCcount+1
 		distance=gethamming(protostring,spacerstring)
 		if distance>4:
-			filteredalnfile.write(line)
-	extralnline='\t'.join([line.strip(),spacerfiledict[linearray[0]], protostring[3:-3], str(getPID(protostring[3:-3],spacerstring)), protostring[0:3], protostring[-3:-1]])
-	extraaln.write(extralnline+'\n')
-        protostring="DOES NOT MEET CONDITION"
-###print "total PAM:", CCcount
-###print "total alignments:",countlines
-#print PIDdict
+			row.filtered=True
+	row.extra(protostring, spacerstring)
+	return row
+
+def init_worker(spacers, sequences):
+	global spacerfiledict, genome
+	spacerfiledict=spacers
+	genome=sequences
+
+def processchunk(lines):
+	"""returns the number of rows, .filt.aln text, .extra.aln text, stdout lines, {extension length: [identity sum,
+	count]}, CC count and extension CC count of a chunk of alignment rows"""
+	rows=[processrow(line) for line in lines]
+	pairs=[]
+	for row in rows:
+		pairs.extend(extra[3] for extra in row.extras)
+		pairs.extend(extension[1] for extension in row.extensions)
+	# pairs of unequal length have no identity (getPID is 0 for them)
+	equal=[pair for pair in pairs if len(pair[0])==len(pair[1])]
+	counts=iter(identities(equal))
+	pids=iter([next(counts)/len(pair[1]) if len(pair[0])==len(pair[1]) else 0.0 for pair in pairs])
+	filtered=[]
+	extra=[]
+	stdout=[]
+	PIDdict={}
+	CCcount=0
+	CCcountEXT=0
+	for row in rows:
+		if row.filtered:
+			filtered.append(row.line)
+		for alignment, spacer, protospacer, pair, flank5, flank3 in row.extras:
+			extra.append('\t'.join([alignment, spacer, protospacer, pidstring(next(pids)), flank5, flank3])+'\n')
+		for length, pair in row.extensions:
+			total=PIDdict.setdefault(length, [0.0, 0])
+			total[0]=total[0]+next(pids)
+			total[1]=total[1]+1
+		stdout.extend(row.stdout)
+		CCcount=CCcount+row.CCcount
+		CCcountEXT=CCcountEXT+row.CCcountEXT
+	return len(rows), ''.join(filtered), ''.join(extra), stdout, PIDdict, CCcount, CCcountEXT
 
-###totalext=0
-######PIDsum=0
-###for items in PIDdict:
-###	totalext=len(PIDdict[items])+totalext
-###	PIDsum=sum(PIDdict[items])+PIDsum
-###	print items, '\t', sum(PIDdict[items])/len(PIDdict[items]),'\t', len(PIDdict[items])
+def chunks(alnfile, chunk_size):
+	while True:
+		lines=list(islice(alnfile, chunk_size))
+		if len(lines)==0:
+			return
+		yield lines
+
+def poolresults(pool, alnfile, chunk_size, processes):
+	"""results of the pool's chunks in file order, reading no more than two chunks per process ahead"""
+	alnchunks=chunks(alnfile, chunk_size)
+	while True:
+		group=list(islice(alnchunks, 2*processes))
+		if len(group)==0:
+			return
+		for result in pool.imap(processchunk, group):
+			yield result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Cut the protospacers of CRISPR spacer hits in a genome, and filter the hits.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('spacerfile', help='FASTA of spacers, one line per sequence')
+	parser.add_argument('dbfile', help='BLAST database of the genome')
+	#protospacers are cut from the genome fasta directly when it is given
+	parser.add_argument('genomefile', nargs='?', help='FASTA the database was built from (default: read hit subjects from the database)')
+	parser.add_argument('--aln', help='use an existing alignment table (same columns as the blastn run) instead of running blastn')
+	parser.add_argument('-p', '--processes', type=int, help='processes working through the alignments', default=1)
+	parser.add_argument('-c', '--chunk_size', type=int, help='alignment rows per chunk of work', default=10000)
+	args = parser.parse_args()
+	spacerfile=args.spacerfile
+	dbfile=args.dbfile
+	genomefile=args.genomefile
+
+	alnfilename=os.path.basename(dbfile)[:]+'_vs_'+os.path.basename(spacerfile)
+	os.mkdir(alnfilename+'.dir')
+	alnfilename1=alnfilename+'.dir/'+alnfilename+'.aln'
+	if args.aln:
+		alnfilename1=args.aln
+	else:
+		blastn_span=vicsin_trace.span('blastn', context=os.path.basename(dbfile), inputs=[spacerfile])
+		subprocess.call(['blastn', '-task', 'blastn-short', '-query', spacerfile, '-db', dbfile, '-outfmt', '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen btop', '-max_target_seqs', '1000000', '-evalue', '.1', '-out', alnfilename1])
+		blastn_span.end()
+	print(alnfilename1)
+	filteredaln=alnfilename+'.dir/'+alnfilename+'.filt.aln'
+	extra=alnfilename+'.dir/'+alnfilename+'.extra.aln'
+	summary=alnfilename+'.dir/'+alnfilename+'.summary.txt'
+
+	spacers=readspacers(spacerfile)
+	genome_span=vicsin_trace.span('read_genome', context=os.path.basename(dbfile), inputs=[genomefile or alnfilename1])
+	if genomefile:
+		sequences=readgenome(genomefile)
+	else:
+		sequences=readblastdb(alnfilename1, dbfile)
+	genome_span.end()
+
+	countlines=0
+	CCcount=0
+	CCcountEXT=0
+	PIDdict={}
+	filter_span=vicsin_trace.span('filter_alignments', context=os.path.basename(dbfile), inputs=[alnfilename1], outputs=[filteredaln, extra, summary])
+	processes=max(1, args.processes)
+	with open(alnfilename1, "r") as alnfile, open(filteredaln, "w") as filteredalnfile, open(extra, "w") as extraaln:
+		if processes>1:
+			pool=Pool(processes, init_worker, (spacers, sequences))
+			results=poolresults(pool, alnfile, max(1, args.chunk_size), processes)
+		else:
+			init_worker(spacers, sequences)
+			results=(processchunk(lines) for lines in chunks(alnfile, max(1, args.chunk_size)))
+		for chunk_rows, chunk_filtered, chunk_extra, chunk_stdout, chunk_PIDdict, chunk_CCcount, chunk_CCcountEXT in results:
+			filteredalnfile.write(chunk_filtered)
+			extraaln.write(chunk_extra)
+			for line in chunk_stdout:
+				print(line)
+			for length, total in chunk_PIDdict.items():
+				PIDdict.setdefault(length, [0.0, 0])
+				PIDdict[length][0]=PIDdict[length][0]+total[0]
+				PIDdict[length][1]=PIDdict[length][1]+total[1]
+			CCcount=CCcount+chunk_CCcount
+			CCcountEXT=CCcountEXT+chunk_CCcountEXT
+			countlines=countlines+chunk_rows
+		if processes>1:
+			pool.close()
+			pool.join()
 
-###print PIDsum/totalext
+	with open(summary, "w") as summaryfile:
+		summaryfile.write('alignments\t%d\nPAM_CC\t%d\nPAM_CC_extension\t%d\n' % (countlines, CCcount, CCcountEXT))
+		summaryfile.write('extension_length\tmean_PID\tcount\n')
+		for length in sorted(PIDdict):
+			summaryfile.write('%d\t%.4f\t%d\n' % (length, PIDdict[length][0]/PIDdict[length][1], PIDdict[length][1]))
+	filter_span.end()
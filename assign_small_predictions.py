@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#assign_small_predictions.py <mcl_in.abc> <lengths.tbl> <dump.blast.mci> <dump.reformat.blast.mci> <mcl_in_small.abc> [options]
+#Adds small predictions to the large prediction cluster all of their large neighbors belong to (VH_Cluster step 6.8),
+#then writes the edges between the predictions left unclustered for the small prediction MCL run (step 6.9).
+#The edge file is read once and indexed by node, instead of rescanned for every small prediction.
+from __future__ import print_function
+import argparse
+import sys
+
+from blast_to_abc import read_lengths
+
+
+def read_dump(dump_file):
+    """reads an mcxdump cluster file; line i holds the members of cluster i"""
+    with open(dump_file, 'r') as f:
+        return [line.rstrip('\n').split('\t') if line.rstrip('\n') else [] for line in f]
+
+
+def write_dump(dump_file, reformat_file, clusters, prefix=''):
+    """writes the cluster dump and its MCLdump2clusters.pl reformatted version"""
+    with open(dump_file, 'w') as dump, open(reformat_file, 'w') as reformat:
+        for cluster, members in enumerate(clusters):
+            dump.write('\t'.join(members) + '\n')
+            for member in members:
+                reformat.write('%s%d\t%s\n' % (prefix, cluster, member))
+
+
+def large_neighbors(abc_file, lengths, size_threshold):
+    """maps each small prediction to the large predictions it shares an edge with"""
+    neighbors = {}
+    with open(abc_file, 'r') as abc:
+        for line in abc:
+            edge = line.rstrip('\n').split('\t')
+            if edge[0] not in lengths or edge[1] not in lengths:
+                continue
+            for small, large in ((edge[0], edge[1]), (edge[1], edge[0])):
+                if lengths[small] <= size_threshold and lengths[large] > size_threshold:
+                    neighbors.setdefault(small, set()).add(large)
+    return neighbors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add small predictions to existing clusters and select the edges left for clustering small predictions.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('abc', help='thresholded MCL input with every edge (mcl_in.abc)')
+    parser.add_argument('lengths', help='tab delimited prediction name and length table')
+    parser.add_argument('dump', help='MCL dump of the large prediction clusters; updated in place')
+    parser.add_argument('reformat', help='reformatted MCL dump; rewritten from the updated dump')
+    parser.add_argument('small_abc', help='output file for edges between predictions that are still unclustered')
+    parser.add_argument('-s', '--size_threshold', type=int, help='predictions longer than this are "large"', default=12000)
+    args = parser.parse_args()
+
+    lengths = read_lengths(args.lengths)
+    clusters = read_dump(args.dump)
+    cluster_of = {}
+    for cluster, members in enumerate(clusters):
+        for member in members:
+            cluster_of[member] = cluster
+
+    # A small prediction joins a cluster only if every clustered large prediction it hits is in that cluster
+    neighbors = large_neighbors(args.abc, lengths, args.size_threshold)
+    for pred in lengths:
+        if pred in neighbors:
+            candidates = set(cluster_of[large] for large in neighbors[pred] if large in cluster_of)
+            if len(candidates) == 1:
+                cluster = candidates.pop()
+                clusters[cluster].append(pred)
+                cluster_of[pred] = cluster
+    write_dump(args.dump, args.reformat, clusters)
+
+    with open(args.abc, 'r') as abc, open(args.small_abc, 'w') as small_abc:
+        for line in abc:
+            edge = line.rstrip('\n').split('\t')
+            if edge[0] in lengths and edge[0] not in cluster_of and edge[1] in lengths and edge[1] not in cluster_of:
+                small_abc.write(line)
+
+    sys.exit(0)
@@ -0,0 +1,2 @@
+#benchmarks
+#Synthetic-data benchmarks of the VICSIN Python helpers; see runner.py
@@ -0,0 +1,193 @@
+#benchmarks/generators.py
+#Seeded generators of synthetic VICSIN inputs, so every benchmark run times the same data:
+#  genome_fasta: multi-contig genomes
+#  blast_table: all-vs-all blastn -outfmt '6 std qlen' tables of clustered predictions, grouped by query as blastn writes them,
+#    and their prediction lengths table
+#  spacer_alignments: CRISPR spacers planted (with mutations) in a genome, and their blastn-short alignment table with
+#    BTOP strings, in the columns PAMProtoPatternGrab_full.py asks blastn for
+#  genome_directory: a directory of genomes and a genome_grouper.py pair cache covering every pair
+from __future__ import print_function
+import os
+import random
+
+BASES = 'ACGT'
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choice(BASES) for _ in range(length))
+
+
+def reverse_complement(sequence):
+    return ''.join(COMPLEMENT.get(base, 'N') for base in reversed(sequence))
+
+
+def write_fasta(path, records, width=60):
+    with open(path, 'w') as out:
+        for name, sequence in records:
+            out.write('>%s\n' % name)
+            for i in range(0, len(sequence), width):
+                out.write(sequence[i:i + width] + '\n')
+
+
+def genome_fasta(rng, path, contigs, length, prefix='contig'):
+    """writes a genome of the given number of contigs, with lengths spread around length / contigs; returns the records"""
+    mean = max(1, length // max(1, contigs))
+    records = [('%s_%d' % (prefix, i), random_sequence(rng, max(1, int(rng.uniform(0.5, 1.5) * mean)))) for i in range(contigs)]
+    write_fasta(path, records)
+    return records
+
+
+def cluster_sizes(rng, sequences, mean_size):
+    """splits sequences into clusters with geometrically distributed sizes (many small clusters, a few large ones)"""
+    sizes = []
+    while sum(sizes) < sequences:
+        size = 1
+        while rng.random() > 1.0 / mean_size:
+            size += 1
+        sizes.append(min(size, sequences - sum(sizes)))
+    return sizes
+
+
+def blast_table(rng, path, rows, hits_per_query=20, mean_cluster_size=8, noise=0.05, lengths_path=None):
+    """writes about rows blast hits between sequences grouped into clusters: members of a cluster hit each other at high
+    identity over much of their length, and a noise share of hits go to random other sequences at low identity.
+    With lengths_path, also writes the name and length of every sequence (the VH_Cluster lengths table).
+    Returns the clusters, as lists of sequence names."""
+    sequences = max(2, rows // hits_per_query)
+    names = ['pred_%d' % i for i in range(sequences)]
+    lengths = [rng.randint(2000, 60000) for _ in range(sequences)]
+    if lengths_path:
+        with open(lengths_path, 'w') as out:
+            for name, length in zip(names, lengths):
+                out.write('%s\t%d\n' % (name, length))
+    clusters = []
+    start = 0
+    for size in cluster_sizes(rng, sequences, mean_cluster_size):
+        clusters.append(list(range(start, start + size)))
+        start += size
+    cluster_of = {}
+    for cluster, members in enumerate(clusters):
+        for member in members:
+            cluster_of[member] = cluster
+    written = 0
+    with open(path, 'w') as out:
+        for query in range(sequences):
+            qlen = lengths[query]
+            count = rows - written if query == sequences - 1 else rng.randint(1, 2 * hits_per_query - 1)
+            count = max(1, min(count, rows - written)) if written < rows else 0
+            members = clusters[cluster_of[query]]
+            hits = [(query, 100.0, 0, qlen)]
+            for _ in range(count - 1):
+                if rng.random() < noise or len(members) == 1:
+                    subject, pident = rng.randrange(sequences), rng.uniform(70, 85)
+                else:
+                    subject, pident = rng.choice(members), rng.uniform(85, 100)
+                length = rng.randint(min(qlen, 200), qlen)
+                qstart = rng.randint(1, qlen - length + 1)
+                hits.append((subject, pident, qstart - 1, length))
+            for subject, pident, offset, length in hits:
+                slen = lengths[subject]
+                sstart = rng.randint(1, max(1, slen - length + 1))
+                send = min(slen, sstart + length - 1)
+                if rng.random() < 0.5:
+                    sstart, send = send, sstart
+                mismatch = int(length * (100 - pident) / 100)
+                out.write('%s\t%s\t%.2f\t%d\t%d\t%d\t%d\t%d\t%d\t%d\t%.2e\t%.1f\t%d\n' % (names[query], names[subject], pident, length,
+                    mismatch, rng.randint(0, 3), offset + 1, offset + length, sstart, send, 10 ** -rng.uniform(5, 180), length * 1.8, qlen))
+            written += len(hits)
+    return [[names[member] for member in members] for members in clusters]
+
+
+def btop(query, subject):
+    """BLAST trace-back operations of an ungapped alignment: runs of matches as numbers, mismatches as query, subject bases"""
+    operations = []
+    run = 0
+    for q, s in zip(query, subject):
+        if q == s:
+            run += 1
+        else:
+            if run:
+                operations.append(str(run))
+            operations.append(q + s)
+            run = 0
+    if run:
+        operations.append(str(run))
+    return ''.join(operations)
+
+
+def spacer_alignments(rng, spacer_path, genome_path, aln_path, rows, spacers=None, contigs=5, max_mismatches=6, gapped=0.05,
+        max_genome=20000000):
+    """plants mutated copies of random spacers in a genome and writes their alignment table; a gapped share of rows
+    get a gap in their BTOP, and some alignments stop short of the spacer ends, as blastn-short reports them. Past
+    max_genome bases, copies are planted over each other; every row is still computed from the final genome, and a
+    copy overwritten so far that no matching base is left to start and end its alignment on is dropped, as blastn
+    would not report it."""
+    spacers = spacers or max(10, rows // 50)
+    spacer_records = [('spacer_%d' % i, random_sequence(rng, rng.randint(30, 40))) for i in range(spacers)]
+    genome_length = min(max_genome, max(10000, rows * 60))
+    genome = [bytearray(random_sequence(rng, genome_length // contigs).encode()) for _ in range(contigs)]
+    hits = []
+    for _ in range(rows):
+        name, spacer = rng.choice(spacer_records)
+        contig = rng.randrange(contigs)
+        position = rng.randint(10, len(genome[contig]) - len(spacer) - 10)
+        copy = list(spacer)
+        for _ in range(rng.randint(0, max_mismatches)):
+            i = rng.randrange(len(copy))
+            copy[i] = rng.choice([base for base in BASES if base != copy[i]])
+        strand = rng.random() < 0.5
+        planted = ''.join(copy) if strand else reverse_complement(''.join(copy))
+        genome[contig][position:position + len(spacer)] = planted.encode()
+        hits.append((name, spacer, contig, position, strand))
+    genome = [contig.decode() for contig in genome]
+    write_fasta(spacer_path, spacer_records, width=1000)
+    write_fasta(genome_path, [('genome_%d' % i, sequence) for i, sequence in enumerate(genome)])
+    with open(aln_path, 'w') as out:
+        for name, spacer, contig, position, strand in hits:
+            window = genome[contig][position:position + len(spacer)]
+            if not strand:
+                window = reverse_complement(window)
+            qstart, qend = 1, len(spacer)
+            if rng.random() < 0.1:
+                qstart, qend = rng.randint(1, 3), len(spacer) - rng.randint(0, 2)
+            # blast alignments start and end on matching bases
+            while qstart < qend and spacer[qstart - 1] != window[qstart - 1]:
+                qstart += 1
+            while qend > qstart and spacer[qend - 1] != window[qend - 1]:
+                qend -= 1
+            if spacer[qstart - 1] != window[qstart - 1]:
+                continue
+            operations = btop(spacer[qstart - 1:qend], window[qstart - 1:qend])
+            if qend - qstart > 5 and rng.random() < gapped:
+                operations = '%d%s-%d' % (qend - qstart - 5, spacer[qend - 5], 4)
+            length = qend - qstart + 1
+            matches = sum(1 for q, s in zip(spacer[qstart - 1:qend], window[qstart - 1:qend]) if q == s)
+            if strand:
+                sstart, send = position + qstart, position + qend
+            else:
+                sstart, send = position + len(spacer) - qstart + 1, position + len(spacer) - qend + 1
+            out.write('%s\tgenome_%d\t%.3f\t%d\t%d\t0\t%d\t%d\t%d\t%d\t%.2e\t%.1f\t%d\t%d\t%s\n' % (name, contig, 100.0 * matches / length,
+                length, length - matches, qstart, qend, sstart, send, 0.01, 2.0 * matches, len(spacer), len(genome[contig]), operations))
+
+
+def genome_directory(rng, directory, cache_path, genomes, length=5000, hash_file=None):
+    """writes genomes small multi-contig genomes into directory, and a pair cache holding every pair, so
+    genome_grouper.py assembles its matrix without running spine; hash_file is genome_grouper.hash_file"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    for i in range(genomes):
+        path = os.path.join(directory, 'genome_%d.fna' % i)
+        genome_fasta(rng, path, rng.randint(1, 4), length, prefix='g%d_contig' % i)
+        paths.append(path)
+    hashes = [hash_file(path) for path in paths]
+    with open(cache_path, 'w') as out:
+        for i in range(genomes):
+            for j in range(i + 1, genomes):
+                out.write('%s\t%s\t%.4f\t%.4f\n' % (hashes[i], hashes[j], rng.random(), rng.random()))
+
+
+def seeded(seed, name, size):
+    """one generator per (benchmark, size), so adding a benchmark does not change another's data"""
+    return random.Random('%s:%s:%d' % (seed, name, size))
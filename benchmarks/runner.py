@@ -0,0 +1,178 @@
+#benchmarks/runner.py [options]
+#Times the Python hot paths of VICSIN on seeded synthetic inputs of growing size, run from the repository root as
+#  python -m benchmarks.runner --sizes 1000 10000 -o results.json [--baseline baseline.json]
+#Benchmarks (rows are the rows of the generated input):
+#  core_genome: core_genome.py over an all-vs-all blast table of clustered predictions
+#  blast_to_abc: blast_to_abc.py over the same kind of table and its lengths table, writing the MCL edge files (the
+#    step 6.4 the pipeline runs)
+#  blast_to_mcl: the legacy Blast_to_MCL.1.py over the same kind of table; the pipeline no longer runs it
+#  pamproto: PAMProtoPatternGrab_full.py over a spacer alignment table (with --aln and the genome FASTA, so neither
+#    blastn nor blastdbcmd runs)
+#  genome_grouper: genome_grouper.py matrix assembly from a pair cache holding every pair of a genome directory
+#    (rows are pairs, so no spine runs)
+#Each tool runs as its own process; the best wall time of the repeats gives the throughput (rows per second), and
+#peak memory is the largest maximum resident set size the kernel reports for the process and its children.
+#With a baseline (an earlier results file), a run slower than baseline throughput * (1 - tolerance), or larger than
+#baseline memory * (1 + tolerance), is flagged as a regression and the runner exits with status 1.
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from benchmarks import generators
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import vicsin_trace  # noqa: E402
+
+BENCHMARKS = ['core_genome', 'blast_to_abc', 'blast_to_mcl', 'pamproto', 'genome_grouper']
+
+
+def script(name):
+    return os.path.join(REPO, name)
+
+
+def prepare(benchmark, rows, data_dir, seed, args):
+    """generates the input of one benchmark (unless data_dir already has it); returns the command to time"""
+    stem = os.path.join(data_dir, '%s_%d' % (benchmark, rows))
+    done = stem + '.done'
+    rng = generators.seeded(seed, benchmark, rows)
+    if benchmark in ('core_genome', 'blast_to_abc', 'blast_to_mcl'):
+        table, lengths = stem + '.blast', stem + '.lengths'
+        if not os.path.exists(done):
+            generators.blast_table(rng, table, rows, lengths_path=lengths)
+        if benchmark == 'core_genome':
+            command = [args.python, script('core_genome.py'), table, '80', '100']
+        elif benchmark == 'blast_to_abc':
+            # with VH_Cluster's default clustering parameter, minimum and size threshold
+            command = [args.python, script('blast_to_abc.py'), table, lengths, 'mcl_in.abc', 'mcl_in_large.abc']
+        else:
+            command = [args.python, script('Blast_to_MCL.1.py'), table]
+    elif benchmark == 'pamproto':
+        spacers, genome, aln = stem + '.spacers.fna', stem + '.genome.fna', stem + '.aln'
+        if not os.path.exists(done):
+            generators.spacer_alignments(rng, spacers, genome, aln, rows)
+        command = [args.python, script('PAMProtoPatternGrab_full.py'), spacers, genome, genome, '--aln', aln, '-p', str(args.processes)]
+    else:
+        genome_dir, cache = stem + '.genomes', stem + '.cache'
+        if not os.path.exists(done):
+            # genome_grouper is Python 3 only; its hash_file names the genomes in the cache
+            from genome_grouper import hash_file
+            genomes = 2
+            while genomes * (genomes - 1) // 2 < rows:
+                genomes += 1
+            generators.genome_directory(rng, genome_dir, cache, genomes, hash_file=hash_file)
+        command = [args.python3, script('genome_grouper.py'), genome_dir, '-c', cache, '-o', stem + '.matrix', '-n', str(args.processes)]
+    open(done, 'w').close()
+    return command
+
+
+def input_bytes(command):
+    return sum(os.path.getsize(word) for word in command[2:] if os.path.isfile(word))
+
+
+def time_command(command, work_dir):
+    """runs command in work_dir with its output discarded; returns (wall seconds, user + sys seconds, max rss in kB).
+    The command is run and waited for by vicsin_trace.py run, a fresh process, because the kernel counts the peak
+    memory of the process that forks a program towards the program's own."""
+    trace = os.path.join(work_dir, 'trace.jsonl')
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen([sys.executable, script('vicsin_trace.py'), 'run', '-t', trace, '--', ' '.join(quote(word) for word in command)],
+            cwd=work_dir, stdout=devnull, stderr=subprocess.PIPE)
+        error = process.communicate()[1]
+    if process.returncode != 0:
+        sys.exit('%s failed:\n%s' % (' '.join(command), error.decode('utf-8', 'replace')))
+    record = list(vicsin_trace.read_trace(trace))[-1]
+    return record['wall'], record['user'] + record['sys'], record['max_rss_kb']
+
+
+def run_benchmark(benchmark, rows, data_dir, args):
+    command = prepare(benchmark, rows, data_dir, args.seed, args)
+    runs = []
+    for repeat in range(args.repeats):
+        # PAMProtoPatternGrab_full.py and blast_to_abc.py write their outputs under the working directory
+        work_dir = tempfile.mkdtemp(dir=data_dir)
+        try:
+            runs.append(time_command(command, work_dir))
+        finally:
+            shutil.rmtree(work_dir)
+    wall = min(run[0] for run in runs)
+    return OrderedDict([('benchmark', benchmark), ('rows', rows), ('input_mb', round(input_bytes(command) / 1048576.0, 3)),
+        ('seconds', round(wall, 4)), ('cpu_seconds', round(min(run[1] for run in runs), 4)),
+        ('rows_per_second', round(rows / wall, 1) if wall > 0 else None), ('max_rss_mb', round(max(run[2] for run in runs) / 1024.0, 1)),
+        ('repeats', args.repeats)])
+
+
+def compare(results, baseline, tolerance):
+    """returns a message for each result that is slower or larger than its baseline beyond the tolerance"""
+    previous = dict(((result['benchmark'], result['rows']), result) for result in baseline.get('results', []))
+    regressions = []
+    for result in results:
+        before = previous.get((result['benchmark'], result['rows']))
+        if before is None:
+            continue
+        if before.get('rows_per_second') and result['rows_per_second'] < before['rows_per_second'] * (1 - tolerance):
+            regressions.append('%s %d rows: %.0f rows/s, baseline %.0f rows/s' % (result['benchmark'], result['rows'],
+                result['rows_per_second'], before['rows_per_second']))
+        if before.get('max_rss_mb') and result['max_rss_mb'] > before['max_rss_mb'] * (1 + tolerance):
+            regressions.append('%s %d rows: %.1f MB peak memory, baseline %.1f MB' % (result['benchmark'], result['rows'],
+                result['max_rss_mb'], before['max_rss_mb']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the VICSIN Python helpers on synthetic inputs.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-b', '--benchmarks', nargs='+', help='benchmarks to run', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, help='input rows', default=[1000, 10000, 100000, 1000000, 10000000])
+    parser.add_argument('-r', '--repeats', type=int, help='runs of each benchmark and size; the fastest is kept', default=3)
+    parser.add_argument('-o', '--output', help='results file', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, help='share of slowdown or memory growth allowed before a regression is flagged', default=0.2)
+    parser.add_argument('--seed', help='seed of the synthetic inputs', default='vicsin')
+    parser.add_argument('--data_dir', help='directory for the generated inputs, kept between runs (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--python', help='interpreter for core_genome.py, blast_to_abc.py, Blast_to_MCL.1.py and PAMProtoPatternGrab_full.py', default=sys.executable)
+    parser.add_argument('--python3', help='Python 3 interpreter for genome_grouper.py', default='python3')
+    parser.add_argument('-n', '--processes', type=int, help='genome_grouper.py and PAMProtoPatternGrab_full.py processes', default=1)
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp()
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    results = []
+    try:
+        for benchmark in args.benchmarks:
+            for rows in sorted(args.sizes):
+                result = run_benchmark(benchmark, rows, data_dir, args)
+                results.append(result)
+                print('%s\t%d rows\t%.2f s\t%.0f rows/s\t%.1f MB' % (benchmark, rows, result['seconds'], result['rows_per_second'] or 0, result['max_rss_mb']))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    with open(args.output, 'w') as out:
+        json.dump(OrderedDict([('date', time.strftime('%Y-%m-%d %H:%M:%S')), ('host', platform.node()), ('platform', platform.platform()),
+            ('python', platform.python_version()), ('seed', args.seed), ('results', results)]), out, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against %s' % args.baseline)
+
+    sys.exit(0)
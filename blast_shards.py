@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#blast_shards.py <query_fasta> <db> <output> [options] [-- blastn options]
+#Runs blastn over a query FASTA in shards balanced by sequence length, several shards at a time, and merges the
+#tabular outputs into one file. Every query's hits stay together in the merged file.
+#Shards that finished in an earlier run (same sequences, same database, same blastn options) are not run again, and
+#a failed shard is retried on its own.
+#blastn options: passed to every blastn run, e.g. -- -outfmt '6 std qlen' -max_target_seqs 1000000
+from __future__ import print_function
+import argparse
+import glob
+import hashlib
+import heapq
+import os
+import shutil
+import subprocess
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+
+def read_lengths(fasta_file):
+    """sequence lengths of the records in fasta_file, in file order"""
+    lengths = []
+    with open(fasta_file, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                lengths.append(0)
+            elif lengths:
+                lengths[-1] += len(line.strip())
+    return lengths
+
+
+def balance(lengths, shards):
+    """assigns each record to a shard, longest first to the shard with the least sequence so far"""
+    heap = [(0, shard) for shard in range(min(shards, len(lengths)) or 1)]
+    assignment = [0] * len(lengths)
+    for record in sorted(range(len(lengths)), key=lambda record: -lengths[record]):
+        total, shard = heapq.heappop(heap)
+        assignment[record] = shard
+        heapq.heappush(heap, (total + lengths[record], shard))
+    return assignment, len(heap)
+
+
+def write_shards(fasta_file, assignment, shards, work_dir):
+    """writes each shard's records, in file order, to work_dir/shard_<n>.fasta; returns the shard file names"""
+    names = [os.path.join(work_dir, 'shard_%d.fasta' % shard) for shard in range(shards)]
+    outputs = [open(name, 'w') for name in names]
+    record = -1
+    with open(fasta_file, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                record += 1
+            if record >= 0:
+                outputs[assignment[record]].write(line)
+    for out in outputs:
+        out.close()
+    return names
+
+
+def file_digest(file_name, digest):
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+
+def database_key(db, db_fasta=None):
+    """identifies the database contents: the FASTA it was built from, or else its files' sizes and modification times"""
+    if db_fasta is not None:
+        return file_digest(db_fasta, hashlib.sha1()).hexdigest()
+    files = sorted(glob.glob(db + '.*'))
+    return hashlib.sha1(' '.join('%s:%d:%d' % (f, os.path.getsize(f), os.path.getmtime(f)) for f in files).encode()).hexdigest()
+
+
+def shard_key(shard_file, command, db_key):
+    """identifies a shard's work: its sequences, the database and the blastn command line"""
+    return file_digest(shard_file, hashlib.sha1((db_key + ' '.join(command)).encode())).hexdigest()
+
+
+def run_shard(task):
+    """runs blastn on one shard unless its done marker matches; returns (shard file, attempts, seconds, error)"""
+    shard_file, command, db_key, retries = task
+    output_file = shard_file[:-len('.fasta')] + '.aln'
+    done_file = shard_file[:-len('.fasta')] + '.done'
+    key = shard_key(shard_file, command, db_key)
+    if os.path.exists(done_file) and os.path.exists(output_file):
+        with open(done_file, 'r') as f:
+            if f.read().strip() == key:
+                return shard_file, 0, 0.0, None
+    start = time.time()
+    error = None
+    for attempt in range(1, retries + 2):
+        if os.path.exists(done_file):
+            os.remove(done_file)
+        try:
+            subprocess.check_call(command + ['-query', shard_file, '-out', output_file])
+        except (subprocess.CalledProcessError, OSError) as e:
+            error = str(e)
+            continue
+        with open(done_file, 'w') as f:
+            f.write(key + '\n')
+        return shard_file, attempt, time.time() - start, None
+    return shard_file, retries + 1, time.time() - start, error
+
+
+def merge(shard_files, output_file):
+    """concatenates the shard outputs into output_file, replacing it only once every shard is in"""
+    with open(output_file + '.tmp', 'w') as out:
+        for shard_file in shard_files:
+            with open(shard_file[:-len('.fasta')] + '.aln', 'r') as f:
+                shutil.copyfileobj(f, out)
+    os.rename(output_file + '.tmp', output_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run blastn in length-balanced query shards and merge the output.', epilog='blastn options for every shard go after --', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('query_fasta', help='query FASTA file')
+    parser.add_argument('db', help='blast database')
+    parser.add_argument('output', help='merged blastn output')
+    parser.add_argument('-c', '--cores', type=int, help='cores shared by the blastn runs', default=1)
+    parser.add_argument('-t', '--threads', type=int, help='blastn threads per shard', default=1)
+    parser.add_argument('-s', '--shards', type=int, help='number of shards (default: 4 per concurrent blastn run)')
+    parser.add_argument('-r', '--retries', type=int, help='times to retry a failed shard', default=2)
+    parser.add_argument('-w', '--work_dir', help='directory for shards and their outputs (default: <output>_shards)')
+    parser.add_argument('-f', '--db_fasta', help='FASTA the database was built from, to recognise an unchanged database after makeblastdb reruns (default: compare database file times)')
+    parser.add_argument('-b', '--blastn', help='path to blastn', default='blastn')
+    parser.add_argument('-v', '--verbose', help='report each shard', action='store_true')
+    # blastn options follow --, and are left to blastn
+    argv = sys.argv[1:]
+    split = argv.index('--') if '--' in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    blast_args = argv[split + 1:]
+
+    threads = max(1, min(args.threads, args.cores))
+    workers = max(1, args.cores // threads)
+    work_dir = args.work_dir or args.output + '_shards'
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    command = [args.blastn, '-db', args.db, '-num_threads', str(threads)] + blast_args
+
+    lengths = read_lengths(args.query_fasta)
+    if not lengths:
+        open(args.output, 'w').close()
+        sys.exit(0)
+    assignment, shards = balance(lengths, args.shards or 4 * workers)
+    shard_files = write_shards(args.query_fasta, assignment, shards, work_dir)
+
+    db_key = database_key(args.db, args.db_fasta)
+    pool = ThreadPool(workers)
+    failed = []
+    for shard_file, attempts, seconds, error in pool.imap_unordered(run_shard, [(shard_file, command, db_key, args.retries) for shard_file in shard_files]):
+        if error is not None:
+            failed.append(shard_file)
+            print('%s failed after %d attempts: %s' % (shard_file, attempts, error), file=sys.stderr)
+        elif args.verbose:
+            if attempts == 0:
+                print('%s already done' % shard_file)
+            else:
+                print('%s done in %.1f s (%d attempts)' % (shard_file, seconds, attempts))
+    pool.close()
+    pool.join()
+    if failed:
+        print('%d of %d shards failed; rerun to retry them' % (len(failed), shards), file=sys.stderr)
+        sys.exit(1)
+
+    merge(shard_files, args.output)
+    sys.exit(0)
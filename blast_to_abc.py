@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#blast_to_abc.py <blast.aln> <lengths.tbl> <mcl_in.abc> <mcl_in_large.abc> [options]
+#Turns the all-vs-all clustering blast table into thresholded MCL edge files in a single pass.
+#Does the work of Blast_to_MCL.1.py, the clustering parameter awk filter and the large prediction split at once.
+from __future__ import print_function
+import argparse
+import sys
+from collections import OrderedDict
+from itertools import groupby
+
+# Column of a Blast_to_MCL.1.py row (query, subject, PID, summation, bitscore) used by each clustering parameter
+PARAMETER_COLUMNS = {
+    'percent_length_aligned': 2,
+    'total_length_aligned': 3,
+    'total_bit_score': 4,
+}
+
+
+def query_blocks(aln):
+    """yields (query, query length, {subject: [[qstart, qend], ...]}, {subject: bitscore}) for each block of query rows"""
+    rows = (line.strip().split('\t') for line in aln if line.strip())
+    for qname, block in groupby(rows, key=lambda linearray: linearray[0]):
+        startenddict = OrderedDict()
+        subbitscore = {}
+        for linearray in block:
+            sname = linearray[1]
+            startenddict.setdefault(sname, []).append([int(linearray[6]), int(linearray[7])])
+            subbitscore[sname] = float(linearray[11])  # bit score of the last hsp, as in Blast_to_MCL.1.py
+            qlen = int(linearray[-1])
+        yield qname, qlen, startenddict, subbitscore
+
+
+def collapsed_length(intervals):
+    """total length covered by the given intervals"""
+    intervals.sort(key=lambda x: x[0])
+    total = 0
+    start, end = intervals[0]
+    for s, e in intervals[1:]:
+        if s <= end:
+            end = max(end, e)
+        else:
+            total = total + end - start + 1
+            start, end = s, e
+    return total + end - start + 1
+
+
+def mcl_rows(aln):
+    """yields the rows Blast_to_MCL.1.py prints, as lists of strings"""
+    for query, qlen, startenddict, subbitscore in query_blocks(aln):
+        for subject in startenddict:
+            if subject not in query:
+                summation = collapsed_length(startenddict[subject])
+                yield [query, subject, str(summation / float(qlen)), str(summation), str(subbitscore[subject])]
+
+
+def read_lengths(lengths_file):
+    """reads the prediction name to length table written by VH_Cluster, keeping its order"""
+    lengths = OrderedDict()
+    with open(lengths_file, 'r') as f:
+        for line in f:
+            name, length = line.rstrip('\n').split('\t')[:2]
+            lengths[name] = int(length)
+    return lengths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write thresholded MCL input (abc) files from an all-vs-all blast table with query lengths.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('blast', help="blast table, outfmt '6 std qlen'")
+    parser.add_argument('lengths', help='tab delimited prediction name and length table')
+    parser.add_argument('abc', help='output file for every edge passing the threshold')
+    parser.add_argument('large_abc', help='output file for edges between two predictions longer than the size threshold')
+    parser.add_argument('-p', '--parameter', help='clustering parameter', choices=sorted(PARAMETER_COLUMNS), default='percent_length_aligned')
+    parser.add_argument('-m', '--minimum', type=float, help='minimum value of the clustering parameter for an edge', default=0.5)
+    parser.add_argument('-s', '--size_threshold', type=int, help='predictions longer than this are "large"', default=12000)
+    parser.add_argument('-t', '--tbl', help='also write the full Blast_to_MCL.1.py table to this file', default=None)
+    args = parser.parse_args()
+
+    column = PARAMETER_COLUMNS[args.parameter]
+    lengths = read_lengths(args.lengths)
+    tbl = open(args.tbl, 'w') if args.tbl else None
+    with open(args.blast, 'r') as aln, open(args.abc, 'w') as abc, open(args.large_abc, 'w') as large_abc:
+        for row in mcl_rows(aln):
+            if tbl:
+                tbl.write('\t'.join(row) + '\n')
+            if float(row[column]) >= args.minimum:
+                edge = '\t'.join([row[0], row[1], row[column]]) + '\n'
+                abc.write(edge)
+                if row[0] in lengths and lengths[row[0]] > args.size_threshold and row[1] in lengths and lengths[row[1]] > args.size_threshold:
+                    large_abc.write(edge)
+    if tbl:
+        tbl.close()
+
+    sys.exit(0)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#cluster_cores.py <blast.aln> <dump.blast.mci> <output_dir> <percentID> <mindist> [options]
+#Writes the core genome of every cluster in the MCL dump to <output_dir>/core_<i>.txt (VH_Cluster step 7).
+#The blast table is read once and its rows are grouped by the cluster of their subject, instead of filtering
+#the whole table once per cluster; the core genomes are then computed in parallel.
+from __future__ import print_function
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+import core_genome
+import vicsin_trace
+
+
+def read_clusters(dump_file):
+    """maps every member of the MCL dump to its cluster (line) number; returns the map and the number of clusters"""
+    subject2cluster = {}
+    count = 0
+    with open(dump_file, 'r') as f:
+        for cluster, line in enumerate(f):
+            for member in line.rstrip('\n').split('\t'):
+                if member:
+                    subject2cluster[member] = cluster
+            count = cluster + 1
+    return subject2cluster, count
+
+
+def partition_hits(lines, subject2cluster, count, percentID):
+    """groups the blast rows by the cluster of their subject, as core_genome.read_hits would group each cluster's rows"""
+    clusters = [{} for _ in range(count)]
+    for line in lines:
+        col = line.strip().split('\t')
+        if len(col) < 8 or col[1] not in subject2cluster or float(col[2]) <= percentID:
+            continue
+        hits = clusters[subject2cluster[col[1]]].setdefault(col[0], [])
+        if col[1] != col[0]:
+            hits.append((int(col[6]), int(col[7])))
+    return clusters
+
+
+def cluster_core(task):
+    """core blocks of one cluster, as core_genome.py output lines"""
+    cluster, query2hits, mindist = task
+    with vicsin_trace.span('core_genome', context='cluster %d' % cluster):
+        return [query + "\t" + str(start) + "-" + str(end) for query, start, end in core_genome.core_genome(query2hits, mindist)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the core genome of every cluster in an MCL dump.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('blast', help="all-vs-all blast table of the clustered predictions, outfmt '6 std qlen'")
+    parser.add_argument('dump', help='MCL dump; line i holds the members of cluster i')
+    parser.add_argument('output_dir', help='directory for the core_<i>.txt files')
+    parser.add_argument('percent_id', type=int, help='minimum percent identity of a hit')
+    parser.add_argument('max_distance', type=int, help='core regions closer than this are joined')
+    parser.add_argument('-n', '--num_cpus', type=int, help='number of cpus to use', default=1)
+    args = parser.parse_args()
+
+    with vicsin_trace.span('partition_hits', inputs=[args.blast, args.dump]):
+        subject2cluster, count = read_clusters(args.dump)
+        with open(args.blast, 'r') as blast:
+            clusters = partition_hits(blast, subject2cluster, count, args.percent_id)
+
+    tasks = [(cluster, query2hits, args.max_distance) for cluster, query2hits in enumerate(clusters)]
+    if args.num_cpus > 1:
+        pool = Pool(args.num_cpus)
+        cores = pool.imap(cluster_core, tasks)
+    else:
+        pool = None
+        cores = (cluster_core(task) for task in tasks)
+    for i, core in enumerate(cores):
+        with open(os.path.join(args.output_dir, 'core_%d.txt' % i), 'w') as out:
+            for line in core:
+                out.write(line + '\n')
+    if pool:
+        pool.close()
+        pool.join()
+
+    sys.exit(0)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#cluster_workspace.py <store> <query_fasta> <output> <work_dir> [options]
+#Keeps the all-vs-all BLAST of clustering in a persistent SQLite store, so each run only BLASTs sequences it has not
+#seen before. Sequences are stored by a hash of their contents, with the hits between them; every stored sequence has
+#been searched against every other one.
+#New sequences are searched against the whole store (themselves included), and the stored sequences against the new
+#ones, so adding k sequences to a store of N costs O(k*N) alignments. output is then written from the stored hits as
+#the blastn -outfmt '6 std qlen' table for the sequences in query_fasta, named as in query_fasta.
+#Every search passes the same -dbsize, recorded in the store, so e-values do not depend on how many sequences were
+#stored or searched when a hit was found: the hit table stays symmetric and the same whatever order predictions were
+#added in. Stored hits keep the e-values they got when they were searched; -e only filters new searches.
+from __future__ import print_function
+import argparse
+import hashlib
+import itertools
+import os
+import sqlite3
+import subprocess
+import sys
+from collections import OrderedDict
+
+
+def read_fasta(fasta_file):
+    """yields (name, sequence) for every record; the name is the first word of the header, as BLAST reports it"""
+    name, sequence = None, []
+    with open(fasta_file, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(sequence)
+                fields = line[1:].split()
+                name, sequence = fields[0] if fields else '', []
+            elif name is not None:
+                sequence.append(line.strip())
+    if name is not None:
+        yield name, ''.join(sequence)
+
+
+def sequence_hash(sequence):
+    return hashlib.sha1(sequence.upper().encode()).hexdigest()
+
+
+def open_store(store_file):
+    connection = sqlite3.connect(store_file)
+    connection.execute('CREATE TABLE IF NOT EXISTS sequences (hash TEXT PRIMARY KEY, sequence TEXT)')
+    # hit: the tab delimited blastn columns after qseqid and sseqid
+    connection.execute('CREATE TABLE IF NOT EXISTS hits (query TEXT, subject TEXT, hit TEXT)')
+    connection.execute('CREATE INDEX IF NOT EXISTS hits_query ON hits (query)')
+    connection.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)')
+    return connection
+
+
+def check_dbsize(connection, dbsize):
+    """records the search database size in a new store; a store searched with another one is refused, as its
+    e-values would not be comparable"""
+    row = connection.execute("SELECT value FROM settings WHERE name = 'dbsize'").fetchone()
+    if row is None:
+        with connection:
+            connection.execute("INSERT INTO settings VALUES ('dbsize', ?)", (str(dbsize),))
+    elif int(row[0]) != dbsize:
+        sys.exit('cluster_workspace.py: the store was searched with -d %s, not %d' % (row[0], dbsize))
+
+
+def write_fasta(fasta_file, records):
+    with open(fasta_file, 'w') as out:
+        for name, sequence in records:
+            out.write('>%s\n%s\n' % (name, sequence))
+
+
+def blast(query_fasta, db_fasta, output, options):
+    """searches query_fasta against a database of db_fasta through blast_shards.py"""
+    db = os.path.splitext(db_fasta)[0] + '_db'
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([options.makeblastdb, '-in', db_fasta, '-parse_seqids', '-dbtype', 'nucl', '-out', db], stdout=devnull)
+    subprocess.check_call([options.blast_shards, query_fasta, db, output, '-c', str(options.cores), '-f', db_fasta,
+        '-b', options.blastn, '-w', output + '_shards', '--',
+        '-outfmt', '6 std qlen', '-max_target_seqs', '1000000', '-evalue', str(options.evalue), '-dbsize', str(options.dbsize)])
+
+
+def read_hits(hits_file):
+    with open(hits_file, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) > 2:
+                yield row[0], row[1], '\t'.join(row[2:])
+
+
+def add_sequences(connection, new, work_dir, options):
+    """searches the new sequences (hash => sequence) against the store and the stored ones against them, then saves
+    the sequences and hits together. Both searches use the store's -dbsize, although their databases differ in size,
+    so a pair of sequences passes the e-value threshold alike in either direction."""
+    stored = connection.execute('SELECT COUNT(*) FROM sequences').fetchone()[0]
+    new_fasta = os.path.join(work_dir, 'new.fasta')
+    all_fasta = os.path.join(work_dir, 'all.fasta')
+    stored_fasta = os.path.join(work_dir, 'stored.fasta')
+    new_hits = os.path.join(work_dir, 'new.aln')
+    stored_hits = os.path.join(work_dir, 'stored.aln')
+    write_fasta(new_fasta, new.items())
+    write_fasta(all_fasta, itertools.chain(connection.execute('SELECT hash, sequence FROM sequences'), new.items()))
+    blast(new_fasta, all_fasta, new_hits, options)
+    if stored:
+        write_fasta(stored_fasta, connection.execute('SELECT hash, sequence FROM sequences'))
+        blast(stored_fasta, new_fasta, stored_hits, options)
+    with connection:
+        connection.executemany('INSERT INTO sequences VALUES (?, ?)', new.items())
+        connection.executemany('INSERT INTO hits VALUES (?, ?, ?)', read_hits(new_hits))
+        if stored:
+            connection.executemany('INSERT INTO hits VALUES (?, ?, ?)', read_hits(stored_hits))
+
+
+def export(connection, names, output):
+    """writes the stored hits between the given (name, hash) records, one block of rows per query name"""
+    by_hash = OrderedDict()
+    for name, sequence_id in names:
+        by_hash.setdefault(sequence_id, []).append(name)
+    with open(output + '.tmp', 'w') as out:
+        for query_name, query_id in names:
+            for subject_id, hit in connection.execute('SELECT subject, hit FROM hits WHERE query = ? ORDER BY rowid', (query_id,)):
+                for subject_name in by_hash.get(subject_id, []):
+                    out.write('%s\t%s\t%s\n' % (query_name, subject_name, hit))
+    os.rename(output + '.tmp', output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BLAST only new sequences against a persistent all-vs-all hit store.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('store', help='SQLite store of sequences and hits (created if missing)')
+    parser.add_argument('query_fasta', help='sequences of this run')
+    parser.add_argument('output', help="blastn -outfmt '6 std qlen' table between the sequences of this run")
+    parser.add_argument('work_dir', help='directory for the new searches')
+    parser.add_argument('-c', '--cores', type=int, help='cores shared by the blastn runs', default=1)
+    parser.add_argument('-e', '--evalue', type=float, help='blastn e-value threshold for new searches', default=0.0001)
+    parser.add_argument('-d', '--dbsize', type=int, help='effective database length of every search; fixed when the store is created', default=100000000)
+    parser.add_argument('-b', '--blastn', help='path to blastn', default='blastn')
+    parser.add_argument('-m', '--makeblastdb', help='path to makeblastdb', default='makeblastdb')
+    parser.add_argument('-s', '--blast_shards', help='path to blast_shards.py', default='blast_shards.py')
+    parser.add_argument('-v', '--verbose', help='report how many sequences were new', action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+    connection = open_store(args.store)
+    check_dbsize(connection, args.dbsize)
+    known = set(row[0] for row in connection.execute('SELECT hash FROM sequences'))
+    names = []
+    new = OrderedDict()
+    for name, sequence in read_fasta(args.query_fasta):
+        sequence_id = sequence_hash(sequence)
+        names.append((name, sequence_id))
+        if sequence_id not in known and sequence_id not in new:
+            new[sequence_id] = sequence
+    if args.verbose:
+        print('%d of %d sequences are new; %d already stored' % (len(new), len(names), len(known)))
+    if new:
+        add_sequences(connection, new, args.work_dir, args)
+    export(connection, names, args.output)
+    connection.close()
+
+    sys.exit(0)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#consensus.py <prefix> <predictions> <output> <updates> [options]
+#Merges the predictions of every method on one genome and bins them by how many methods agree (VICSIN step 4).
+#predictions: '#method' lines (tab delimited key, abbreviation, bin, extends) in VICSIN method order, then tab delimited
+#  method key, sequence, index, start, end, 1 if masked (else 0), in each method's array order
+#output: tab delimited bin, name, sequence, methods, start, end, provenance (key:index,index;key:index...)
+#updates: tab delimited method key, sequence, index, start, end of every method prediction moved by merging or
+#  trimming; indexes past the end of a method's array are overhang fragments to append
+#Predictions of the extending methods are merged with a sweep over each sequence's start-sorted predictions, and the
+#non-extending predictions are matched through start-sorted arrays, so each prediction is only compared with its
+#neighbours. Names, method order and provenance follow the original merge and overlap rules exactly.
+from __future__ import print_function
+import argparse
+import bisect
+import sys
+from collections import OrderedDict
+
+
+class Method(object):
+    def __init__(self, key, abbr, bin, extend):
+        self.key = key
+        self.abbr = abbr
+        self.bin = int(bin)
+        self.extend = int(extend) == 1
+
+
+class Prediction(object):
+    """one method prediction; start and end are updated in place as the Perl hashes were"""
+
+    def __init__(self, method, index, start, end, masked=False, fragment=False):
+        self.method = method
+        self.index = index
+        self.start = start
+        self.end = end
+        self.masked = masked
+        self.used = False
+        self.methods = [method.abbr]
+        # overhang fragments are new predictions, and carry no provenance
+        self.original = None if fragment else (start, end)
+        self.provenance = {} if fragment else {method.key: [index]}
+
+    def take_provenance(self, other, methods):
+        for method in methods:
+            if method.key in other.provenance:
+                self.provenance.setdefault(method.key, []).extend(other.provenance[method.key])
+
+
+class MethodPredictions(object):
+    """the predictions of one non-extending method on one sequence: the array in its original order, plus the
+    start-sorted (start, index) pairs of those still free to match"""
+
+    def __init__(self, predictions):
+        self.predictions = predictions
+        self.free = sorted((p.start, p.index) for p in predictions if not p.masked)
+        # fragments are cut from their parent, so no free prediction is ever longer than this
+        self.longest = max([p.end - p.start for p in predictions if not p.masked] or [0])
+
+    def overlapping(self, start, end):
+        """indexes, in array order, of the free predictions sharing a position with [start, end]"""
+        low = bisect.bisect_left(self.free, (start - self.longest, -1))
+        high = bisect.bisect_right(self.free, (end, len(self.predictions)))
+        return sorted(index for p_start, index in self.free[low:high] if self.predictions[index].end >= start)
+
+    def take(self, index):
+        prediction = self.predictions[index]
+        prediction.used = True
+        del self.free[bisect.bisect_left(self.free, (prediction.start, index))]
+
+    def append(self, prediction):
+        self.predictions.append(prediction)
+        bisect.insort(self.free, (prediction.start, prediction.index))
+
+
+def merge_groups(predictions, threshold):
+    """indexes of the unmasked predictions that merge together, by a sweep over their starts; each group is in array
+    order and the groups are ordered by their first index, which is where the merged prediction ends up"""
+    groups = []
+    group_end = None
+    for i in sorted((i for i, p in enumerate(predictions) if not p.masked), key=lambda i: predictions[i].start):
+        if groups and predictions[i].start <= group_end + threshold:
+            groups[-1].append(i)
+            group_end = max(group_end, predictions[i].end)
+        else:
+            groups.append([i])
+            group_end = predictions[i].end
+    return sorted(sorted(group) for group in groups)
+
+
+def merge_group(items, threshold, methods):
+    """the original first-fit merge rounds, run on one group only; predictions in other groups never come within
+    threshold of it, so this keeps the original method order, provenance order and coordinate changes"""
+    while True:
+        merged = []
+        found_merges = False
+        for item in items:
+            for target in merged:
+                if item.start <= target.end + threshold and target.start <= item.end + threshold:
+                    found_merges = True
+                    target.start = min(target.start, item.start)
+                    target.end = max(target.end, item.end)
+                    target.methods.extend(abbr for abbr in item.methods if abbr not in target.methods)
+                    target.take_provenance(item, methods)
+                    break
+            else:
+                merged.append(item)
+        items = merged
+        if not found_merges:
+            return items[0]
+
+
+def overlap_exists(a, method_predictions, overhang_threshold, methods):
+    """marks the free predictions overlapping a as used, trimming overhangs of at least overhang_threshold into new
+    fragments; returns whether any overlapped"""
+    if a.used or a.masked:
+        return False
+    found_overlap = False
+    fragments = []
+    for index in method_predictions.overlapping(a.start, a.end):
+        prediction = method_predictions.predictions[index]
+        method_predictions.take(index)
+        found_overlap = True
+        if a.start <= prediction.start and a.end >= prediction.end:
+            pass
+        elif a.start <= prediction.start and a.end >= prediction.start:
+            if prediction.end - a.end >= overhang_threshold:
+                fragments.append((a.end + 1, prediction.end))
+                prediction.end = a.end
+        elif a.start <= prediction.end and a.end >= prediction.end:
+            if a.start - prediction.start >= overhang_threshold:
+                fragments.append((prediction.start, a.start - 1))
+                prediction.start = a.start
+        else:
+            if a.start - prediction.start >= overhang_threshold:
+                fragments.append((prediction.start, a.start - 1))
+                prediction.start = a.start
+            if prediction.end - a.end >= overhang_threshold:
+                fragments.append((a.end + 1, prediction.end))
+                prediction.end = a.end
+        a.take_provenance(prediction, methods)
+    method = method_predictions.predictions[0].method
+    for start, end in fragments:
+        method_predictions.append(Prediction(method, len(method_predictions.predictions), start, end, fragment=True))
+    return found_overlap
+
+
+def consensus(prefix, methods, predictions, merge_threshold, overhang_threshold):
+    """bins the predictions of one genome; predictions is sequence => method key => array of Prediction.
+    Returns the five bins of (name, sequence, methods, start, end, provenance)."""
+    bins = [[], [], [], [], []]
+    by_abbr = dict((method.abbr, method) for method in methods)
+    by_key = dict((method.key, method) for method in methods)
+    pred_count = {}
+    matching = {}
+    for sequence in predictions:
+        matching[sequence] = OrderedDict((method.key, MethodPredictions(predictions[sequence][method.key]))
+            for method in methods if not method.extend and method.key in predictions[sequence])
+
+    def final(prediction, sequence, used_methods, bin):
+        name = '%s-%s-%d' % (prefix, sequence, pred_count[sequence])
+        pred_count[sequence] += 1
+        provenance = [(method.key, prediction.provenance[method.key]) for method in methods if method.key in prediction.provenance]
+        bins[bin].append((name, sequence, used_methods, prediction.start, prediction.end, provenance))
+
+    # First pass: merge the extending predictions, then compare them with the non-extending ones
+    for sequence in predictions:
+        mergeable = [p for method in methods if method.extend for p in predictions[sequence].get(method.key, [])]
+        if not mergeable:
+            continue
+        pred_count[sequence] = 0
+        for group in merge_groups(mergeable, merge_threshold):
+            merged = merge_group([mergeable[i] for i in group], merge_threshold, methods)
+            for key in matching[sequence]:
+                if overlap_exists(merged, matching[sequence][key], overhang_threshold, methods):
+                    merged.methods.append(by_key[key].abbr)
+            if len(merged.methods) > 2 or ','.join(merged.methods) == 'A,C':
+                bin = 0
+            elif len(merged.methods) == 2:
+                bin = 1
+            else:
+                bin = by_abbr[merged.methods[0]].bin
+            final(merged, sequence, ','.join(merged.methods), bin)
+
+    # Second pass: compare the leftover non-extending predictions amongst themselves
+    for i, method in enumerate(methods):
+        if method.extend:
+            continue
+        for sequence in predictions:
+            if method.key not in matching[sequence]:
+                continue
+            pred_count.setdefault(sequence, 0)
+            for prediction in matching[sequence][method.key].predictions:
+                if prediction.used or prediction.start <= 0 or prediction.end <= 0:
+                    continue
+                used_methods = [method.abbr]
+                for later in methods[i + 1:]:
+                    if not later.extend and later.key in matching[sequence]:
+                        if overlap_exists(prediction, matching[sequence][later.key], overhang_threshold, methods):
+                            used_methods.append(later.abbr)
+                if len(used_methods) > 2:
+                    bin = 0
+                elif len(used_methods) == 2:
+                    bin = 1
+                else:
+                    bin = method.bin
+                final(prediction, sequence, ','.join(used_methods), bin)
+    return bins
+
+
+def read_predictions(predictions_file):
+    """reads the method table and predictions; returns methods, sequence => method key => array of Prediction"""
+    methods = []
+    predictions = OrderedDict()
+    with open(predictions_file, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if row[0] == '#method':
+                methods.append(Method(*row[1:5]))
+            elif line.strip():
+                key, sequence, index, start, end, masked = row[:6]
+                method = [m for m in methods if m.key == key][0]
+                array = predictions.setdefault(sequence, OrderedDict()).setdefault(key, [])
+                array.append(Prediction(method, int(index), int(start), int(end), masked=(masked == '1')))
+    return methods, predictions
+
+
+def write_updates(updates_file, methods, predictions):
+    with open(updates_file, 'w') as out:
+        for method in methods:
+            for sequence in predictions:
+                for prediction in predictions[sequence].get(method.key, []):
+                    if (prediction.start, prediction.end) != prediction.original:
+                        out.write('%s\t%s\t%d\t%d\t%d\n' % (method.key, sequence, prediction.index, prediction.start, prediction.end))
+
+
+def format_bins(bins):
+    """lines in the layout VICSIN saves to Pre_Reblast_Output_Files: name, sequence, methods, start, end"""
+    return ['%s\t%s\t%s\t%d\t%d' % row[:5] for bin in bins for row in bin]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge and bin the predictions of one genome.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('prefix', help='genome prefix used in prediction names')
+    parser.add_argument('predictions', help='method table and per-method predictions')
+    parser.add_argument('output', help='tab delimited bin, name, sequence, methods, start, end, provenance')
+    parser.add_argument('updates', help='tab delimited method key, sequence, index, start, end of moved or added method predictions')
+    parser.add_argument('-m', '--merge_threshold', type=int, help='predictions this close together are merged', default=1500)
+    parser.add_argument('-o', '--overhang_threshold', type=int, help='overhangs at least this long are split off', default=100)
+    parser.add_argument('-c', '--compare', help='saved consensus output (Pre_Reblast_Output_Files/<prefix>.txt) to check the result against')
+    args = parser.parse_args()
+
+    methods, predictions = read_predictions(args.predictions)
+    bins = consensus(args.prefix, methods, predictions, args.merge_threshold, args.overhang_threshold)
+    with open(args.output, 'w') as out:
+        for bin, rows in enumerate(bins):
+            for name, sequence, used_methods, start, end, provenance in rows:
+                out.write('%d\t%s\t%s\t%s\t%d\t%d\t%s\n' % (bin, name, sequence, used_methods, start, end,
+                    ';'.join('%s:%s' % (key, ','.join(str(i) for i in indexes)) for key, indexes in provenance)))
+    write_updates(args.updates, methods, predictions)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            expected = sorted(line.rstrip('\n') for line in f if line.strip())
+        got = sorted(format_bins(bins))
+        if got != expected:
+            for line in sorted(set(expected) - set(got)):
+                print('missing\t' + line)
+            for line in sorted(set(got) - set(expected)):
+                print('extra\t' + line)
+            sys.exit(1)
+
+    sys.exit(0)
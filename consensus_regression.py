@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+#consensus_regression.py [options]
+#Compares consensus.py against the original pairwise merge_predictions / overlap_exists / bin_predictions rules, on
+#synthetic predictions and on the prediction tables VICSIN saves in <output_path>/Pre_Reblast_Output_Files.
+from __future__ import print_function
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+
+import consensus
+
+
+def legacy_overlap_exists(a, b, overhang_threshold, methods):
+    """the original VICSIN::overlap_exists; a is a prediction hash, b an array of them"""
+    found_overlap = False
+    predictions_to_add = []
+    if 'used' not in a and 'masked' not in a:
+        for prediction in b:
+            hit = False
+            if not prediction.get('used') and 'masked' not in prediction:
+                if a['start'] <= prediction['start'] and a['end'] >= prediction['end']:
+                    hit = True
+                elif a['start'] <= prediction['start'] and a['end'] >= prediction['start']:
+                    hit = True
+                    if prediction['end'] - a['end'] >= overhang_threshold:
+                        predictions_to_add.append({'start': a['end'] + 1, 'end': prediction['end']})
+                        prediction['end'] = a['end']
+                elif a['start'] <= prediction['end'] and a['end'] >= prediction['end']:
+                    hit = True
+                    if a['start'] - prediction['start'] >= overhang_threshold:
+                        predictions_to_add.append({'start': prediction['start'], 'end': a['start'] - 1})
+                        prediction['start'] = a['start']
+                elif a['start'] > prediction['start'] and a['end'] < prediction['end']:
+                    hit = True
+                    if a['start'] - prediction['start'] >= overhang_threshold:
+                        predictions_to_add.append({'start': prediction['start'], 'end': a['start'] - 1})
+                        prediction['start'] = a['start']
+                    if prediction['end'] - a['end'] >= overhang_threshold:
+                        predictions_to_add.append({'start': a['end'] + 1, 'end': prediction['end']})
+                        prediction['end'] = a['end']
+                if hit:
+                    prediction['used'] = 1
+                    found_overlap = True
+            if hit:
+                for method in methods:
+                    if method.key in prediction:
+                        a.setdefault(method.key, []).extend(prediction[method.key])
+        b.extend(predictions_to_add)
+    return found_overlap
+
+
+def legacy_merge_predictions(mergeable, merge_threshold, methods):
+    """the original VICSIN::merge_predictions for one sequence: first-fit merge rounds until nothing merges"""
+    while True:
+        merged = []
+        found_merges = False
+        for item in mergeable:
+            if item.get('masked'):
+                continue
+            for target in merged:
+                if not target.get('masked') and item['start'] <= target['end'] + merge_threshold and target['start'] <= item['end'] + merge_threshold:
+                    found_merges = True
+                    target['start'] = min(target['start'], item['start'])
+                    target['end'] = max(target['end'], item['end'])
+                    target['methods'].extend(abbr for abbr in item['methods'] if abbr not in target['methods'])
+                    for method in methods:
+                        if method.key in item:
+                            target.setdefault(method.key, []).extend(item[method.key])
+                    break
+            else:
+                merged.append(item)
+        mergeable = merged
+        if not found_merges:
+            return merged
+
+
+def legacy_consensus(prefix, methods, predictions, merge_threshold, overhang_threshold):
+    """the original consensus step; predictions is sequence => method key => array of prediction hashes"""
+    bins = [[], [], [], [], []]
+    pred_count = {}
+
+    def final(prediction, sequence, used_methods, bin):
+        name = '%s-%s-%d' % (prefix, sequence, pred_count[sequence])
+        pred_count[sequence] += 1
+        bins[bin].append((name, sequence, used_methods, prediction['start'], prediction['end'],
+            [(method.key, prediction[method.key]) for method in methods if method.key in prediction]))
+
+    for sequence in predictions:
+        mergeable = []
+        for method in methods:
+            if method.extend:
+                for prediction in predictions[sequence].get(method.key, []):
+                    prediction['methods'] = [method.abbr]
+                    mergeable.append(prediction)
+        if not mergeable:
+            continue
+        pred_count[sequence] = 0
+        for merged in legacy_merge_predictions(mergeable, merge_threshold, methods):
+            for method in methods:
+                if not method.extend and method.key in predictions[sequence]:
+                    if legacy_overlap_exists(merged, predictions[sequence][method.key], overhang_threshold, methods):
+                        merged['methods'].append(method.abbr)
+            if len(merged['methods']) > 2 or ','.join(merged['methods']) == 'A,C':
+                bin = 0
+            elif len(merged['methods']) == 2:
+                bin = 1
+            else:
+                bin = [method.bin for method in methods if method.abbr == merged['methods'][0]][-1]
+            final(merged, sequence, ','.join(merged['methods']), bin)
+
+    for i, method in enumerate(methods):
+        if method.extend:
+            continue
+        for sequence in predictions:
+            if method.key not in predictions[sequence]:
+                continue
+            pred_count.setdefault(sequence, 0)
+            for prediction in predictions[sequence][method.key]:
+                if 'used' not in prediction and prediction['start'] > 0 and prediction['end'] > 0:
+                    used_methods = [method.abbr]
+                    for later in methods[i + 1:]:
+                        if not later.extend and later.key in predictions[sequence]:
+                            if legacy_overlap_exists(prediction, predictions[sequence][later.key], overhang_threshold, methods):
+                                used_methods.append(later.abbr)
+                    bin = 0 if len(used_methods) > 2 else 1 if len(used_methods) == 2 else method.bin
+                    final(prediction, sequence, ','.join(used_methods), bin)
+    return bins
+
+
+def as_hashes(predictions):
+    """copies consensus.py predictions into the prediction hashes the legacy rules work on"""
+    hashes = {}
+    for sequence in predictions:
+        for key in predictions[sequence]:
+            for p in predictions[sequence][key]:
+                prediction = {'start': p.start, 'end': p.end, key: [p.index]}
+                if p.masked:
+                    prediction['masked'] = 1
+                hashes.setdefault(sequence, {}).setdefault(key, []).append(prediction)
+    return hashes
+
+
+def method_coordinates(methods, predictions, legacy):
+    """sorted (key, sequence, index, start, end) of every method prediction after the consensus step"""
+    rows = []
+    for sequence in predictions:
+        for method in methods:
+            for index, p in enumerate(predictions[sequence].get(method.key, [])):
+                rows.append((method.key, sequence, index) + ((p['start'], p['end']) if legacy else (p.start, p.end)))
+    return sorted(rows)
+
+
+def compare(prefix, predictions_file, merge_threshold, overhang_threshold):
+    """runs both implementations on a predictions table; returns a list of differences"""
+    methods, predictions = consensus.read_predictions(predictions_file)
+    hashes = as_hashes(predictions)
+    expected = legacy_consensus(prefix, methods, hashes, merge_threshold, overhang_threshold)
+    got = consensus.consensus(prefix, methods, predictions, merge_threshold, overhang_threshold)
+    differences = []
+    for bin in range(len(expected)):
+        if sorted(expected[bin]) != sorted(got[bin]):
+            differences.append('bin %d: expected %d predictions, got %d' % (bin, len(expected[bin]), len(got[bin])))
+    if method_coordinates(methods, hashes, True) != method_coordinates(methods, predictions, False):
+        differences.append('method predictions were trimmed differently')
+    return got, differences
+
+
+def synthetic_predictions(rng, path, methods, sequences, length):
+    """writes a consensus.py predictions table of random, sometimes masked, predictions"""
+    with open(path, 'w') as f:
+        for method in methods:
+            f.write('#method\t%s\t%s\t%d\t%d\n' % (method.key, method.abbr, method.bin, 1 if method.extend else 0))
+        for method in methods:
+            if method.key == 'reblast':
+                continue
+            for sequence in range(sequences):
+                for index in range(rng.randint(0, 12)):
+                    if rng.random() < 0.1:
+                        start, end, masked = -1, -1, 1
+                    else:
+                        start = rng.randint(1, length)
+                        end, masked = min(length, start + rng.randint(0, length // 6)), 0
+                    f.write('%s\tseq%d\t%d\t%d\t%d\t%d\n' % (method.key, sequence, index, start, end, masked))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check consensus.py against the original consensus rules.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-t', '--trials', type=int, help='number of synthetic genomes to compare', default=200)
+    parser.add_argument('-s', '--seed', type=int, help='random seed', default=1)
+    parser.add_argument('-r', '--run', help='VICSIN output_path of a recorded run to check as well')
+    parser.add_argument('-m', '--merge_threshold', type=int, help='merge_threshold the recorded run used', default=1500)
+    parser.add_argument('-o', '--overhang_threshold', type=int, help='overhang_threshold the recorded run used', default=100)
+    args = parser.parse_args()
+
+    # Same order as @VICSIN::methods
+    methods = [consensus.Method('agent', 'A', 3, 1), consensus.Method('virsorter', 'V', 2, 1), consensus.Method('phispy', 'P', 3, 0),
+        consensus.Method('blast', 'B', 2, 1), consensus.Method('crispr', 'C', 4, 0), consensus.Method('reblast', 'R', 2, 0)]
+    rng = random.Random(args.seed)
+    failures = 0
+    handle, path = tempfile.mkstemp(suffix='.tbl')
+    os.close(handle)
+    for trial in range(args.trials):
+        synthetic_predictions(rng, path, methods, rng.randint(1, 3), rng.choice([5000, 30000, 200000]))
+        merge_threshold, overhang_threshold = rng.choice([0, 100, 1500]), rng.choice([1, 100, 1000])
+        got, differences = compare('genome', path, merge_threshold, overhang_threshold)
+        for difference in differences:
+            print('Trial %d (merge %d, overhang %d): %s' % (trial, merge_threshold, overhang_threshold, difference))
+        if differences:
+            failures += 1
+    os.remove(path)
+    print('%d/%d synthetic genomes matched' % (args.trials - failures, args.trials))
+
+    if args.run:
+        recorded = sorted(glob.glob(os.path.join(args.run, 'Pre_Reblast_Output_Files', '*.predictions.tbl')))
+        for predictions_file in recorded:
+            prefix = os.path.basename(predictions_file)[:-len('.predictions.tbl')]
+            got, differences = compare(prefix, predictions_file, args.merge_threshold, args.overhang_threshold)
+            with open(os.path.join(args.run, 'Pre_Reblast_Output_Files', prefix + '.txt'), 'r') as f:
+                if sorted(consensus.format_bins(got)) != sorted(line.rstrip('\n') for line in f if line.strip()):
+                    differences.append('does not match the saved %s.txt' % prefix)
+            for difference in differences:
+                print('%s: %s' % (prefix, difference))
+            if differences:
+                failures += 1
+        print('%d recorded genomes checked' % len(recorded))
+
+    sys.exit(1 if failures else 0)
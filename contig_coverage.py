@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#contig_coverage.py <hits> <contigs> <output> [-g]
+#Reports how many bases of each contig are covered by at least one hit.
+#hits: tab delimited [genome,] contig, start, end (further columns are ignored)
+#contigs: tab delimited [genome,] contig, length
+#output: tab delimited [genome,] contig, covered bases, length, covered fraction
+#Coverage is the length of the union of the hit intervals, found by sorting and merging them.
+from __future__ import print_function
+import argparse
+import sys
+from collections import OrderedDict
+
+
+def covered_length(intervals):
+    """number of integer positions inside at least one of the closed [start, end] intervals"""
+    total = 0
+    current_start, current_end = None, None
+    for start, end in sorted((min(s, e), max(s, e)) for s, e in intervals):
+        if current_end is not None and start <= current_end + 1:
+            current_end = max(current_end, end)
+        else:
+            if current_end is not None:
+                total += current_end - current_start + 1
+            current_start, current_end = start, end
+    if current_end is not None:
+        total += current_end - current_start + 1
+    return total
+
+
+def group_hits(rows, key_columns=1):
+    """groups (key..., start, end) rows by key; the key is the contig, or (genome, contig)"""
+    groups = {}
+    for row in rows:
+        key = row[0] if key_columns == 1 else tuple(row[:key_columns])
+        groups.setdefault(key, []).append((int(row[key_columns]), int(row[key_columns + 1])))
+    return groups
+
+
+def contig_coverage(rows, lengths, key_columns=1):
+    """yields (key, covered bases, length) for every contig in lengths, in its order"""
+    groups = group_hits(rows, key_columns)
+    for key in lengths:
+        yield key, covered_length(groups.get(key, [])), lengths[key]
+
+
+def read_table(file_name):
+    with open(file_name, 'r') as f:
+        return [line.rstrip('\n').split('\t') for line in f if line.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the hit coverage of every contig.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('hits', help='tab delimited [genome,] contig, start, end')
+    parser.add_argument('contigs', help='tab delimited [genome,] contig, length')
+    parser.add_argument('output', help='tab delimited [genome,] contig, covered bases, length, covered fraction')
+    parser.add_argument('-g', '--genome', help='the first column of every file is the genome', action='store_true')
+    args = parser.parse_args()
+
+    key_columns = 2 if args.genome else 1
+    lengths = OrderedDict()
+    for row in read_table(args.contigs):
+        lengths[row[0] if key_columns == 1 else tuple(row[:2])] = int(row[key_columns])
+    with open(args.output, 'w') as out:
+        for key, covered, length in contig_coverage(read_table(args.hits), lengths, key_columns):
+            names = [key] if key_columns == 1 else list(key)
+            out.write('\t'.join(names + [str(covered), str(length), str(float(covered) / length if length else 0.0)]) + '\n')
+
+    sys.exit(0)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#convert_inputs.py <jobs> <output_dir> [options]
+#Converts every input genome in one pool of worker processes, reading each input file once.
+#jobs: tab delimited prefix, format (genbank, fasta/gff or fasta), input file; one genome per line
+#For each prefix, output_dir gets:
+#  <prefix>.fna: the genome as FASTA (GenBank records are written as genbank_to_fasta.py -s whole -a accessions does)
+#  <prefix>.fna.fai: samtools faidx compatible index, as fasta_index.py index writes it
+#  <prefix>.contigs.tsv: tab delimited contig (full definition line), start, end, length; positions run on across contigs
+#  <prefix>.json: genome metadata (name, format, version, definition, accession, keywords, organism, strain, length,
+#    genes, scaffolds); GenBank values come from the first record, as VICSIN read them before
+#GenBank jobs also get their SEED directory, _SEED_<prefix>, from genbank_to_seed.py unless it already exists.
+#Genomes whose outputs are newer than their input are not converted again.
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+from multiprocessing import Pool
+
+FASTA_LINE = 60
+
+
+class Outputs(object):
+    """writes <prefix>.fna while keeping the contig table and .fai entries of what has been written"""
+
+    def __init__(self, fna_file):
+        self.fna = open(fna_file + '.tmp', 'wb')
+        self.fna_file = fna_file
+        self.offset = 0
+        self.contigs = []
+        self.fai = []
+        self.total = 0
+
+    def header(self, line):
+        """line: the definition line, without '>' or line ending"""
+        raw = ('>' + line + '\n').encode()
+        self.fna.write(raw)
+        self.offset += len(raw)
+        fields = line.split()
+        self.contigs.append([line, self.total + 1, self.total, 0])
+        self.fai.append([fields[0] if fields else '', 0, self.offset, 0, 0])
+
+    def sequence_line(self, raw):
+        """raw: one sequence line as bytes, line ending included"""
+        bases = len(raw.rstrip(b'\r\n'))
+        self.fna.write(raw)
+        self.offset += len(raw)
+        if self.fai:
+            entry = self.fai[-1]
+            if entry[3] == 0:
+                entry[3] = bases
+                entry[4] = len(raw)
+            entry[1] += bases
+            self.contigs[-1][2] += bases
+            self.contigs[-1][3] += bases
+        self.total += bases
+
+    def close(self):
+        self.fna.close()
+        os.rename(self.fna_file + '.tmp', self.fna_file)
+        with open(self.fna_file + '.fai', 'w') as fai:
+            for entry in self.fai:
+                fai.write('\t'.join(str(field) for field in entry) + '\n')
+
+
+def convert_fasta(input_file, outputs):
+    """copies a FASTA file as it is"""
+    with open(input_file, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                outputs.header(line[1:].rstrip(b'\n').decode())
+            elif outputs.contigs:
+                outputs.sequence_line(line if line.endswith(b'\n') else line + b'\n')
+    return {}
+
+
+def convert_genbank(input_file, outputs):
+    """writes each record's whole sequence, named by its accessions; returns the first record's metadata"""
+    from Bio import SeqIO
+    metadata = {}
+    with open(input_file, 'r') as f:
+        for record in SeqIO.parse(f, 'genbank'):
+            accessions = record.annotations.get('accessions')
+            if accessions:
+                header = ' : '.join(accessions) if isinstance(accessions, list) else accessions
+                header = header.replace('\n', ' ')
+            else:
+                header = 'missing_accessions_annotation'
+            outputs.header(header)
+            sequence = str(record.seq)
+            for i in range(0, len(sequence), FASTA_LINE):
+                outputs.sequence_line((sequence[i:i + FASTA_LINE] + '\n').encode())
+            if not metadata:
+                source = [feature for feature in record.features if feature.type == 'source']
+                qualifiers = source[0].qualifiers if source else {}
+                keywords = record.annotations.get('keywords', [])
+                metadata = {
+                    'version': record.annotations.get('sequence_version', ''),
+                    'definition': record.description,
+                    'accession': accessions[0] if accessions else '',
+                    'keywords': '; '.join(keywords) if isinstance(keywords, list) else keywords,
+                    'organism': qualifiers.get('organism', [None])[0],
+                    'strain': qualifiers.get('strain', [None])[0],
+                    'length': len(sequence),
+                    'genes': sum(1 for feature in record.features if feature.type == 'gene'),
+                }
+    return metadata
+
+
+def up_to_date(input_file, outputs):
+    return all(os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(input_file) for output in outputs)
+
+
+def convert(job):
+    """converts one genome; returns (prefix, whether it was converted, error)"""
+    prefix, input_format, input_file, output_dir, genbank_to_seed = job
+    stem = os.path.join(output_dir, prefix)
+    try:
+        if input_format == 'genbank' and not os.path.isdir(os.path.join(output_dir, '_SEED_' + prefix)):
+            subprocess.check_call(['python', genbank_to_seed, input_file, os.path.join(output_dir, '_SEED_' + prefix)])
+        if up_to_date(input_file, [stem + '.fna', stem + '.fna.fai', stem + '.contigs.tsv', stem + '.json']):
+            return prefix, False, None
+        outputs = Outputs(stem + '.fna')
+        metadata = convert_genbank(input_file, outputs) if input_format == 'genbank' else convert_fasta(input_file, outputs)
+        outputs.close()
+        with open(stem + '.contigs.tsv', 'w') as out:
+            for contig in outputs.contigs:
+                out.write('%s\t%d\t%d\t%d\n' % tuple(contig))
+        genome = {'name': prefix, 'format': input_format, 'version': '', 'genes': 0, 'length': outputs.total}
+        genome.update(metadata)
+        genome['scaffolds'] = len(set(contig[0] for contig in outputs.contigs))
+        with open(stem + '.json', 'w') as out:
+            json.dump(genome, out, indent=1, sort_keys=True)
+        return prefix, True, None
+    except Exception as e:
+        return prefix, False, '%s: %s' % (type(e).__name__, e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert input genomes to FASTA, contig tables, FASTA indexes and metadata in one pass each.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('jobs', help='tab delimited prefix, format, input file')
+    parser.add_argument('output_dir', help='directory for the converted files')
+    parser.add_argument('-p', '--processes', type=int, help='genomes converted at a time', default=1)
+    parser.add_argument('-s', '--genbank_to_seed', help='path to genbank_to_seed.py', default='genbank_to_seed.py')
+    parser.add_argument('-v', '--verbose', help='report each genome', action='store_true')
+    args = parser.parse_args()
+
+    jobs = []
+    with open(args.jobs, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) >= 3:
+                jobs.append((row[0], row[1], row[2], args.output_dir, args.genbank_to_seed))
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    failed = 0
+    pool = Pool(max(1, min(args.processes, len(jobs))))
+    for prefix, converted, error in pool.imap_unordered(convert, jobs):
+        if error is not None:
+            failed += 1
+            # a half written genome must not look converted
+            for suffix in ('.json', '.contigs.tsv'):
+                if os.path.exists(os.path.join(args.output_dir, prefix + suffix)):
+                    os.remove(os.path.join(args.output_dir, prefix + suffix))
+            print('%s could not be converted: %s' % (prefix, error), file=sys.stderr)
+        elif args.verbose:
+            print('%s %s' % (prefix, 'converted' if converted else 'already converted'))
+    pool.close()
+    pool.join()
+
+    sys.exit(1 if failed else 0)
@@ -1,61 +1,87 @@
 #!/usr/bin/env python
+#core_genome.py <blastfile> <percentID> <mindist>
+#Prints the core regions (query\tstart-end) shared by every member of a cluster.
+#Coverage is computed over hit intervals with a sweep line instead of expanding every hit into single bases.
+from __future__ import print_function
+import os
 import sys
 
-blastfile=sys.argv[1]
-percentID=int(sys.argv[2])
-mindist=int(sys.argv[3])
-
-query2line={}
-querylist=[]
-with open(blastfile) as blast:
-    filteredarray=[line.strip() for line in blast if float(line.strip().split('\t')[2]) > percentID]
-    queryarray=set([array.split('\t')[0] for array in filteredarray])
-    for array in filteredarray:
-        query2line.setdefault(array.split('\t')[0],[]).append(array)
-        querylist.append(array.split('\t')[0])
-        #print array
-
-querycount=len(set(querylist))
-# print querycount
-# print "\n"
-minimum=1
-#print query2line
-for query in query2line:
-    subjectcoord={}
-    totlocarray=[]
-    dictcount={}
-    for qline in query2line[query]: # run through subjects
-        col=qline.split('\t')
-        startendarray=[]
-        if col[1] !=query:
-            startendarray.append(int(col[6]))
-            startendarray.append(int(col[7]))
-            startendarray=range(int(col[6]), int(col[7])+1)
-            #print startendarray
-            subjectcoord.setdefault(col[1], []).append(startendarray)
-            totlocarray=totlocarray+startendarray
-            for item in startendarray:
-                dictcount.setdefault(item,[]).append(1)
-    subjecttotal=len(subjectcoord)
-    totlocarray.sort()
-    final=[]
-    # print dictcount
-    # print "\n"
-    if len(dictcount)>0:
-        for item in dictcount:
-            if float(len(dictcount[item])+1)/querycount>=minimum:    
-                final.append(item)
-    final.sort()
-    if len(final)>0:
-        start=final[0]
-#        print final
-        for i in range(len(final)-1):
-            if final[i+1] -final[i]> mindist: 
-                end=final[i]
-                print query+"\t"+str(start)+"-"+str(end)
-                start=final[i+1]
-            if i == len(final)-2:
-                end=final[i+1]
-                print query+"\t"+str(start)+"-"+str(end)
-#    print query
-                
+import vicsin_trace
+
+
+def read_hits(lines, percentID):
+    """groups the non-self hits above percentID by query; queries with only self hits are kept (they count as members)"""
+    query2hits={}
+    for line in lines:
+        col=line.strip().split('\t')
+        if len(col)<8 or float(col[2]) <= percentID:
+            continue
+        hits=query2hits.setdefault(col[0], [])
+        if col[1] != col[0]:
+            hits.append((int(col[6]), int(col[7])))
+    return query2hits
+
+
+def covered_segments(hits, mincount):
+    """returns the sorted, disjoint [start, end] segments covered by at least mincount hits"""
+    events=[]
+    for start, end in hits:
+        if start <= end:
+            events.append((start, 1))
+            events.append((end+1, -1))
+    events.sort()
+    segments=[]
+    depth=0
+    segstart=None
+    i=0
+    while i < len(events):
+        pos=events[i][0]
+        while i < len(events) and events[i][0] == pos:
+            depth=depth+events[i][1]
+            i=i+1
+        if depth >= mincount and segstart is None:
+            segstart=pos
+        elif depth < mincount and segstart is not None:
+            segments.append([segstart, pos-1])
+            segstart=None
+    return segments
+
+
+def core_blocks(segments, mindist):
+    """joins covered segments separated by no more than mindist bases"""
+    if sum(end-start+1 for start, end in segments) < 2:
+        # a single core base was never reported
+        return []
+    blocks=[]
+    for start, end in segments:
+        if mindist < 1:
+            # consecutive bases are already further apart than mindist
+            blocks.extend([pos, pos] for pos in range(start, end+1))
+        elif blocks and start-blocks[-1][1] <= mindist:
+            blocks[-1][1]=end
+        else:
+            blocks.append([start, end])
+    return blocks
+
+
+def core_genome(query2hits, mindist, minimum=1):
+    """yields (query, start, end) for every core block of every query"""
+    querycount=len(query2hits)
+    # a base is core when it is hit by (at least) every other member of the cluster
+    mincount=max(1, minimum*querycount-1)
+    for query in query2hits:
+        for start, end in core_blocks(covered_segments(query2hits[query], mincount), mindist):
+            yield query, start, end
+
+
+if __name__ == '__main__':
+    blastfile=sys.argv[1]
+    percentID=int(sys.argv[2])
+    mindist=int(sys.argv[3])
+
+    # the cluster is named by its blast file, e.g. core_3.aln
+    with vicsin_trace.span('core_genome', context=os.path.splitext(os.path.basename(blastfile))[0], inputs=[blastfile]):
+        with open(blastfile) as blast:
+            query2hits=read_hits(blast, percentID)
+        for query, start, end in core_genome(query2hits, mindist):
+            print(query+"\t"+str(start)+"-"+str(end))
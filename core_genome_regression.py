@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#core_genome_regression.py [options]
+#Compares the interval-based core_genome.py against the original per-base implementation on synthetic BLAST tables.
+from __future__ import print_function
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+import core_genome
+
+
+def legacy_core_genome(lines, percentID, mindist):
+    """the original per-base core genome calculation, kept as the reference implementation"""
+    output=[]
+    query2line={}
+    querylist=[]
+    filteredarray=[line.strip() for line in lines if float(line.strip().split('\t')[2]) > percentID]
+    for array in filteredarray:
+        query2line.setdefault(array.split('\t')[0],[]).append(array)
+        querylist.append(array.split('\t')[0])
+    querycount=len(set(querylist))
+    minimum=1
+    for query in query2line:
+        dictcount={}
+        for qline in query2line[query]:
+            col=qline.split('\t')
+            if col[1] !=query:
+                for item in range(int(col[6]), int(col[7])+1):
+                    dictcount.setdefault(item,[]).append(1)
+        final=[]
+        for item in dictcount:
+            if float(len(dictcount[item])+1)/querycount>=minimum:
+                final.append(item)
+        final.sort()
+        if len(final)>0:
+            start=final[0]
+            for i in range(len(final)-1):
+                if final[i+1] -final[i]> mindist:
+                    end=final[i]
+                    output.append(query+"\t"+str(start)+"-"+str(end))
+                    start=final[i+1]
+                if i == len(final)-2:
+                    end=final[i+1]
+                    output.append(query+"\t"+str(start)+"-"+str(end))
+    return output
+
+
+def synthetic_blast(rng, members, length, hits):
+    """builds an outfmt '6 std qlen' table for one cluster of members sharing a randomly placed core"""
+    names=['pred-%d' % i for i in range(members)]
+    core_start=rng.randint(1, length//2)
+    core_end=rng.randint(core_start, length)
+    lines=[]
+    for query in names:
+        for subject in names:
+            for _ in range(rng.randint(1, hits)):
+                if rng.random() < 0.7:
+                    # hit inside (or around) the shared core
+                    qstart=max(1, core_start+rng.randint(-50, 50))
+                    qend=min(length, core_end+rng.randint(-50, 50))
+                else:
+                    qstart=rng.randint(1, length)
+                    qend=rng.randint(qstart, min(length, qstart+rng.randint(0, length//4)))
+                pident=rng.uniform(70, 100)
+                sstart, send=rng.randint(1, length), rng.randint(1, length)
+                lines.append('\t'.join([query, subject, '%.3f' % pident, str(qend-qstart+1), '0', '0',
+                    str(qstart), str(qend), str(sstart), str(send), '1e-50', '100', str(length)])+'\n')
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check core_genome.py against the original per-base implementation.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-t', '--trials', type=int, help='number of synthetic clusters to compare', default=200)
+    parser.add_argument('-s', '--seed', type=int, help='random seed', default=1)
+    parser.add_argument('-m', '--max_members', type=int, help='maximum number of predictions per cluster', default=6)
+    parser.add_argument('-l', '--max_length', type=int, help='maximum prediction length', default=3000)
+    parser.add_argument('-p', '--percent_id', type=int, help='percent id threshold passed to core_genome.py', default=85)
+    parser.add_argument('-d', '--max_distance', type=int, help='distance threshold passed to core_genome.py', default=10)
+    parser.add_argument('-c', '--cli', help='also run core_genome.py as a script on every table', action='store_true')
+    args = parser.parse_args()
+
+    rng=random.Random(args.seed)
+    script=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'core_genome.py')
+    failures=0
+    for trial in range(args.trials):
+        matched=True
+        lines=synthetic_blast(rng, rng.randint(1, args.max_members), rng.randint(20, args.max_length), 3)
+        mindist=rng.choice([0, 1, args.max_distance, 200])
+        expected=legacy_core_genome(lines, args.percent_id, mindist)
+        got=['%s\t%d-%d' % block for block in core_genome.core_genome(core_genome.read_hits(lines, args.percent_id), mindist)]
+        if args.cli:
+            handle, path=tempfile.mkstemp(suffix='.aln')
+            with os.fdopen(handle, 'w') as f:
+                f.writelines(lines)
+            output=subprocess.check_output([sys.executable, script, path, str(args.percent_id), str(mindist)])
+            os.remove(path)
+            if output.decode().splitlines() != got:
+                print('Trial %d: script output differs from library output' % trial)
+                matched=False
+        if got != expected:
+            print('Trial %d (mindist %d): expected %d core blocks, got %d' % (trial, mindist, len(expected), len(got)))
+            matched=False
+        if not matched:
+            failures=failures+1
+
+    print('%d/%d synthetic clusters matched' % (args.trials-failures, args.trials))
+    sys.exit(1 if failures else 0)
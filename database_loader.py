@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#database_loader.py <table_dir> <database> [options]
+#Loads the tables VH_Database exports into the VICSIN database, one genome per transaction, with multi-row INSERTs.
+#table_dir: tab delimited files, '\N' for NULL:
+#  run.tsv: the columns of RUN_COLUMNS after date
+#  genomes.tsv: prefix, then the columns of genomes after run_id
+#  scaffolds.tsv: prefix, name
+#  virsorter/phispy/agent/crispr/homology/rescreen.tsv: prefix, key (sequence:index), then the columns after genome_id
+#  mge.tsv: prefix, key (bin:index), then the columns after genome_id
+#  mge_links.tsv: prefix, mge key, hit table, hit key
+#  clusters.tsv: cluster_id
+#  cluster_core.tsv: cluster_id, prefix, mge key, start, stop
+#database: the SQLite file to load into (created with the VICSIN schema if needed), or the MySQL database name
+#The ids of one multi-row INSERT are evenly spaced (by 1 in SQLite, by @@auto_increment_increment in MySQL, unless
+#innodb_autoinc_lock_mode is 2 and other clients insert into the same tables at the same time), so the rows of a batch
+#are matched to their ids without a round trip per row.
+from __future__ import print_function
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+
+RUN_COLUMNS = ['date', 'phispy_windowsize', 'phispy_threshold', 'spine_percent_input', 'spine_max_distance', 'spine_agent_min_perc_id',
+    'spine_agent_min_size_core', 'spine_core_file', 'spacer_fasta_file', 'known_viral_types', 'virsorter_database', 'clustering_parameter',
+    'reblast_min_perc_id', 'reblast_min_perc_length', 'reblast_distance', 'reblast_edge_distance', 'cluster_core_congruence', 'user']
+GENOME_COLUMNS = ['run_id', 'genome', 'length', 'scaffolds', 'genes', 'input_format', 'version', 'definition', 'accession', 'dblink',
+    'keywords', 'organism', 'strain']
+BLAST_COLUMNS = ['genome_id', 'query', 'subject', 'percent_id', 'gap', 'mismatch', 'query_start', 'query_stop', 'subject_start',
+    'subject_stop', 'bit', 'evalue']
+# Hit tables, in load order
+HIT_COLUMNS = OrderedDict([
+    ('virsorter', ['genome_id', 'scaffold', 'start', 'stop', 'category', 'genes_predicted', 'viral_hallmark_genes', 'viral_gene_enrich',
+        'noncaudovirales_gene_enrich', 'pfam_depletion', 'uncharacterized_gene_enrichment', 'strand_switch_depletion', 'short_gene_enrichment']),
+    ('phispy', ['genome_id', 'scaffold', 'start', 'stop']),
+    ('agent', ['genome_id', 'scaffold', 'start', 'stop', 'gc_perc']),
+    ('crispr', BLAST_COLUMNS),
+    ('homology', BLAST_COLUMNS),
+    ('rescreen', BLAST_COLUMNS),
+])
+MGE_COLUMNS = ['genome_id', 'scaffold', 'type', 'start', 'stop']
+
+SQLITE_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, %s)' % ', '.join(RUN_COLUMNS),
+    'CREATE TABLE IF NOT EXISTS genomes (id INTEGER PRIMARY KEY, %s)' % ', '.join(GENOME_COLUMNS),
+    'CREATE TABLE IF NOT EXISTS scaffolds (id INTEGER PRIMARY KEY, genome_id, name)',
+    'CREATE TABLE IF NOT EXISTS mge (id INTEGER PRIMARY KEY, %s)' % ', '.join(MGE_COLUMNS),
+    'CREATE TABLE IF NOT EXISTS clusters (run_id, cluster_id)',
+    'CREATE TABLE IF NOT EXISTS cluster_core (run_id, cluster_id, mge_id, start, stop)',
+] + ['CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, %s)' % (table, ', '.join(columns)) for table, columns in HIT_COLUMNS.items()
+] + ['CREATE TABLE IF NOT EXISTS mge_%s (mge_id, %s_id, PRIMARY KEY (mge_id, %s_id))' % (table, table, table) for table in HIT_COLUMNS]
+
+
+class SQLite(object):
+    placeholder = '?'
+    insert_ignore = 'INSERT OR IGNORE'
+    # SQLite builds before 3.32 allow 999 bound values per statement
+    max_values = 999
+    id_step = 1
+
+    def __init__(self, database, args):
+        self.connection = sqlite3.connect(database)
+        for statement in SQLITE_SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def first_id(self, cursor, rows):
+        # lastrowid is the id of the last row of the statement
+        return cursor.lastrowid - rows + 1
+
+
+class MySQL(object):
+    placeholder = '%s'
+    insert_ignore = 'INSERT IGNORE'
+    max_values = None
+
+    def __init__(self, database, args):
+        try:
+            import MySQLdb as driver
+        except ImportError:
+            try:
+                import pymysql as driver
+            except ImportError:
+                sys.exit('Loading into MySQL needs the MySQLdb (mysqlclient) or pymysql module')
+        self.connection = driver.connect(host=args.host, port=args.port, user=args.user,
+            passwd=os.environ.get('VICSIN_DATABASE_PASS', ''), db=database)
+        # replication setups (e.g. Galera) space auto-increment ids more than 1 apart
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT @@auto_increment_increment')
+        self.id_step = int(cursor.fetchone()[0])
+        cursor.close()
+
+    def first_id(self, cursor, rows):
+        # LAST_INSERT_ID() is the id of the first row of the statement
+        return cursor.lastrowid
+
+
+class Loader(object):
+    def __init__(self, backend, batch):
+        self.backend = backend
+        self.batch = batch
+        self.cursor = backend.connection.cursor()
+        self.rows = OrderedDict()
+
+    def insert(self, table, columns, rows, ignore=False):
+        """inserts rows in multi-row statements; returns the id of each row"""
+        rows = list(rows)
+        batch = self.batch
+        if self.backend.max_values is not None:
+            batch = max(1, min(batch, self.backend.max_values // len(columns)))
+        row_values = '(%s)' % ', '.join([self.backend.placeholder] * len(columns))
+        ids = []
+        for i in range(0, len(rows), batch):
+            chunk = rows[i:i + batch]
+            self.cursor.execute('%s INTO %s (%s) VALUES %s' % (self.backend.insert_ignore if ignore else 'INSERT', table, ', '.join(columns),
+                ', '.join([row_values] * len(chunk))), [value for row in chunk for value in row])
+            if not ignore:
+                first = self.backend.first_id(self.cursor, len(chunk))
+                ids.extend(range(first, first + len(chunk) * self.backend.id_step, self.backend.id_step))
+        self.rows[table] = self.rows.get(table, 0) + len(rows)
+        return ids
+
+    def commit(self):
+        self.backend.connection.commit()
+
+
+def read_table(table_dir, name):
+    """rows of table_dir/name.tsv as lists, None for '\\N'; no rows if the file is missing"""
+    path = os.path.join(table_dir, name + '.tsv')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [[None if value == '\\N' else value for value in line.rstrip('\n').split('\t')] for line in f if line.strip()]
+
+
+def by_prefix(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[0], []).append(row[1:])
+    return grouped
+
+
+def load_genome(loader, run_id, genome, scaffolds, hits, mges, links):
+    """inserts one genome and everything found on it; hits is table => rows. Returns mge key => mge id"""
+    genome_id = loader.insert('genomes', GENOME_COLUMNS, [[run_id] + genome])[0]
+    loader.insert('scaffolds', ['genome_id', 'name'], [[genome_id] + row for row in scaffolds])
+    hit_ids = {}
+    for table, columns in HIT_COLUMNS.items():
+        rows = hits[table]
+        hit_ids[table] = dict(zip([row[0] for row in rows], loader.insert(table, columns, [[genome_id] + row[1:] for row in rows])))
+    mge_ids = dict(zip([row[0] for row in mges], loader.insert('mge', MGE_COLUMNS, [[genome_id] + row[1:] for row in mges])))
+    for table in HIT_COLUMNS:
+        rows = [(mge_ids[mge_key], hit_ids[table][hit_key]) for mge_key, link_table, hit_key in links
+            if link_table == table and mge_key in mge_ids and hit_key in hit_ids[table]]
+        if rows:
+            loader.insert('mge_' + table, ['mge_id', table + '_id'], rows, ignore=True)
+    return mge_ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the tables VH_Database exports into the VICSIN database in batches.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('table_dir', help='directory of exported .tsv tables')
+    parser.add_argument('database', help='SQLite file, or MySQL database name')
+    parser.add_argument('-d', '--backend', help='sqlite or mysql', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('-b', '--batch', type=int, help='rows per INSERT statement', default=1000)
+    parser.add_argument('--host', help='MySQL host', default='localhost')
+    parser.add_argument('--port', type=int, help='MySQL port', default=3306)
+    parser.add_argument('--user', help='MySQL user (the password is read from $VICSIN_DATABASE_PASS)', default='')
+    args = parser.parse_args()
+
+    start = time.time()
+    backend = (SQLite if args.backend == 'sqlite' else MySQL)(args.database, args)
+    loader = Loader(backend, max(1, args.batch))
+
+    run_id = loader.insert('runs', RUN_COLUMNS, [[time.strftime('%Y-%m-%d %H:%M:%S')] + row for row in read_table(args.table_dir, 'run')])[0]
+    loader.commit()
+    scaffolds = by_prefix(read_table(args.table_dir, 'scaffolds'))
+    hits = dict((table, by_prefix(read_table(args.table_dir, table))) for table in HIT_COLUMNS)
+    mges = by_prefix(read_table(args.table_dir, 'mge'))
+    links = by_prefix(read_table(args.table_dir, 'mge_links'))
+    mge_ids = {}
+    for row in read_table(args.table_dir, 'genomes'):
+        prefix = row[0]
+        try:
+            mge_ids[prefix] = load_genome(loader, run_id, row[1:], scaffolds.get(prefix, []),
+                dict((table, hits[table].get(prefix, [])) for table in HIT_COLUMNS), mges.get(prefix, []), links.get(prefix, []))
+            loader.commit()
+        except Exception:
+            backend.connection.rollback()
+            raise
+
+    loader.insert('clusters', ['run_id', 'cluster_id'], [[run_id] + row for row in read_table(args.table_dir, 'clusters')])
+    loader.insert('cluster_core', ['run_id', 'cluster_id', 'mge_id', 'start', 'stop'],
+        [[run_id, cluster_id, mge_ids[prefix][mge_key], core_start, core_stop] for cluster_id, prefix, mge_key, core_start, core_stop
+            in read_table(args.table_dir, 'cluster_core') if mge_key in mge_ids.get(prefix, {})])
+    loader.commit()
+    backend.connection.close()
+
+    seconds = time.time() - start
+    total = sum(loader.rows.values())
+    for table, rows in loader.rows.items():
+        print('%s\t%d' % (table, rows))
+    print('Loaded %d rows in %.2f s (%.0f rows/s) as run %d' % (total, seconds, total / seconds if seconds > 0 else 0, run_id))
+
+    sys.exit(0)
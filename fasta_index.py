@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#fasta_index.py index <fasta> [<fasta> ...]
+#fasta_index.py extract <regions> <output_fasta> [-g]
+#Builds samtools faidx compatible .fai indexes and extracts regions from indexed FASTA files through mmap,
+#so predictions can be cut out of a genome without reading whole contigs into memory.
+#regions is a tab delimited file of: fasta file, contig, start, end, name (1-based, inclusive coordinates).
+from __future__ import print_function
+import argparse
+import mmap
+import os
+import sys
+from collections import OrderedDict
+
+
+def build_index(fasta_file):
+    """writes <fasta_file>.fai; each line holds name, length, offset, bases per line and bytes per line of a sequence"""
+    entries = []
+    with open(fasta_file, 'rb') as f:
+        offset = 0
+        entry = None
+        for line in f:
+            if line.startswith(b'>'):
+                fields = line[1:].split()
+                entry = [fields[0].decode() if fields else '', 0, offset + len(line), 0, 0]
+                entries.append(entry)
+            elif entry is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if entry[3] == 0:
+                    entry[3] = bases
+                    entry[4] = len(line)
+                entry[1] += bases
+            offset += len(line)
+    with open(fasta_file + '.fai', 'w') as fai:
+        for entry in entries:
+            fai.write('\t'.join(str(field) for field in entry) + '\n')
+
+
+def read_index(fasta_file):
+    """reads <fasta_file>.fai, (re)building it first if it is missing or older than the FASTA file"""
+    fai_file = fasta_file + '.fai'
+    if not os.path.exists(fai_file) or os.path.getmtime(fai_file) < os.path.getmtime(fasta_file):
+        build_index(fasta_file)
+    index = OrderedDict()
+    with open(fai_file, 'r') as fai:
+        for line in fai:
+            name, length, offset, linebases, linewidth = line.rstrip('\n').split('\t')[:5]
+            index[name] = (int(length), int(offset), int(linebases), int(linewidth))
+    return index
+
+
+def lookup(index, contig):
+    """finds a contig by its name, or by the first word of a full FASTA definition line"""
+    if contig in index:
+        return contig
+    fields = contig.split()
+    if fields and fields[0] in index:
+        return fields[0]
+    return None
+
+
+def fetch(fasta_map, entry, start, end):
+    """returns bases start..end (1-based, inclusive, clipped to the sequence) of an index entry"""
+    length, offset, linebases, linewidth = entry
+    start = max(start, 1)
+    end = min(end, length)
+    if end < start:
+        return ''
+    first = offset + (start - 1) // linebases * linewidth + (start - 1) % linebases
+    last = offset + (end - 1) // linebases * linewidth + (end - 1) % linebases
+    region = fasta_map[first:last + 1]
+    return region.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+
+def extract(regions, out, genome_order=False):
+    """writes every (fasta, contig, start, end, name) region that is found to out as FASTA, one sequence line each"""
+    by_fasta = OrderedDict()
+    for region in regions:
+        by_fasta.setdefault(region[0], []).append(region)
+    for fasta_file in by_fasta:
+        index = read_index(fasta_file)
+        found = []
+        for fasta, contig, start, end, name in by_fasta[fasta_file]:
+            contig = lookup(index, contig)
+            if contig is not None:
+                found.append((contig, start, end, name))
+        if genome_order:
+            # the order the regions were read in before, contig by contig through the genome
+            found.sort(key=lambda region: index[region[0]][1])
+        if not found:
+            continue
+        with open(fasta_file, 'rb') as f:
+            fasta_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for contig, start, end, name in found:
+                out.write('>' + name + '\n' + fetch(fasta_map, index[contig], start, end) + '\n')
+            fasta_map.close()
+
+
+def read_regions(regions_file):
+    regions = []
+    with open(regions_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                fasta, contig, start, end, name = line.rstrip('\n').split('\t')[:5]
+                regions.append((fasta, contig, int(start), int(end), name))
+    return regions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index FASTA files and extract regions from them.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    index_parser = subparsers.add_parser('index', help='write a .fai index next to each FASTA file', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    index_parser.add_argument('fasta', nargs='+', help='FASTA files to index')
+    extract_parser = subparsers.add_parser('extract', help='write regions of indexed FASTA files to a FASTA file', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    extract_parser.add_argument('regions', help='tab delimited fasta file, contig, start, end, name')
+    extract_parser.add_argument('output', help='output FASTA file')
+    extract_parser.add_argument('-g', '--genome_order', help='write the regions of each FASTA file in contig order rather than input order', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        for fasta_file in args.fasta:
+            build_index(fasta_file)
+    elif args.command == 'extract':
+        with open(args.output, 'w') as out:
+            extract(read_regions(args.regions), out, args.genome_order)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    sys.exit(0)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#genome_db.py build <genomes> <combined_fasta> <map> [-l lengths]
+#genome_db.py split <hits> <map> <query_map> <output_dir> [-s suffix] [-d] [-l lengths -z dbsize [-e max_evalue]]
+#Combines several genomes into one FASTA file for a single BLAST database, and splits a BLAST table against that
+#database back into one table per genome, as if each genome had been searched on its own.
+#genomes: tab delimited genome, fasta file
+#map: written by build; tab delimited sequence id, genome, original sequence id
+#query_map: tab delimited query name, genome it was taken from; hits of a query against its own genome are dropped
+#lengths: written by build; tab delimited genome, total sequence length
+#E-values scale with the database size, so a search of the combined database run with -dbsize dbsize gives each hit
+#its genome's e-value once multiplied by genome length / dbsize; split does that with -l and -z, and -e then applies
+#the e-value cutoff of a search of the genome alone.
+from __future__ import print_function
+import argparse
+import os
+import sys
+from collections import OrderedDict
+
+
+def build(genomes, combined_fasta, map_file, lengths_file=None):
+    """writes every genome's sequences to combined_fasta under short unique ids, saving the ids to map_file and each
+    genome's total length to lengths_file"""
+    count = 0
+    lengths = OrderedDict()
+    with open(combined_fasta, 'w') as out, open(map_file, 'w') as seqmap:
+        for genome, fasta_file in genomes:
+            lengths.setdefault(genome, 0)
+            with open(fasta_file, 'r') as fasta:
+                for line in fasta:
+                    if line.startswith('>'):
+                        fields = line[1:].split()
+                        count += 1
+                        seqid = 'vg%d' % count
+                        seqmap.write('%s\t%s\t%s\n' % (seqid, genome, fields[0] if fields else ''))
+                        out.write('>%s\n' % seqid)
+                    elif line.strip():
+                        out.write(line if line.endswith('\n') else line + '\n')
+                        lengths[genome] += len(line.strip())
+    if lengths_file:
+        with open(lengths_file, 'w') as out:
+            for genome, length in lengths.items():
+                out.write('%s\t%d\n' % (genome, length))
+
+
+def read_map(map_file):
+    """reads a build map: sequence id => (genome, original sequence id)"""
+    seqmap = {}
+    with open(map_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                seqid, genome, original = line.rstrip('\n').split('\t')[:3]
+                seqmap[seqid] = (genome, original)
+    return seqmap
+
+
+def read_lengths(lengths_file):
+    """reads a build lengths table: genome => total sequence length"""
+    lengths = {}
+    with open(lengths_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                genome, length = line.rstrip('\n').split('\t')[:2]
+                lengths[genome] = int(length)
+    return lengths
+
+
+def split(hits, seqmap, query_genomes, output_dir, suffix, genome_dirs=False, lengths=None, dbsize=None, max_evalue=None):
+    """writes each hit to <output_dir>/<genome><suffix> (<output_dir>/<genome>/<genome><suffix> with genome_dirs) of
+    its subject genome, with the original subject id. With lengths and dbsize, the e-value (column 11) is rescaled to
+    the subject genome's length, and hits above max_evalue are dropped."""
+    outputs = OrderedDict()
+    for genome, original in seqmap.values():
+        if genome not in outputs:
+            genome_dir = os.path.join(output_dir, genome) if genome_dirs else output_dir
+            if not os.path.isdir(genome_dir):
+                os.makedirs(genome_dir)
+            outputs[genome] = open(os.path.join(genome_dir, genome + suffix), 'w')
+    for line in hits:
+        row = line.rstrip('\n').split('\t')
+        if len(row) > 1 and row[1].startswith('lcl|'):
+            row[1] = row[1][4:]
+        if len(row) < 2 or row[1] not in seqmap:
+            continue
+        genome, original = seqmap[row[1]]
+        if query_genomes.get(row[0]) == genome:
+            continue
+        row[1] = original
+        if lengths and dbsize:
+            evalue = float(row[10]) * lengths[genome] / dbsize
+            if max_evalue is not None and evalue > max_evalue:
+                continue
+            row[10] = '%.3g' % evalue
+        outputs[genome].write('\t'.join(row) + '\n')
+    for out in outputs.values():
+        out.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a combined multi-genome FASTA and split BLAST hits against it by genome.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='write the combined FASTA and its sequence map', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    build_parser.add_argument('genomes', help='tab delimited genome, fasta file')
+    build_parser.add_argument('combined_fasta', help='output FASTA with every genome')
+    build_parser.add_argument('map', help='output sequence map')
+    build_parser.add_argument('-l', '--lengths', help='output table of genome lengths')
+    split_parser = subparsers.add_parser('split', help='split a BLAST table against the combined database by subject genome', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    split_parser.add_argument('hits', help='tabular BLAST output against the combined database')
+    split_parser.add_argument('map', help='sequence map written by build')
+    split_parser.add_argument('query_map', help='tab delimited query name, genome it was taken from')
+    split_parser.add_argument('output_dir', help='directory for the per-genome tables')
+    split_parser.add_argument('-s', '--suffix', help='file name suffix of the per-genome tables', default='.br')
+    split_parser.add_argument('-d', '--genome_dirs', help='write each table to a directory named after its genome', action='store_true')
+    split_parser.add_argument('-l', '--lengths', help='genome lengths table written by build, to rescale e-values with')
+    split_parser.add_argument('-z', '--dbsize', type=float, help='-dbsize the hits were searched with, to rescale e-values with')
+    split_parser.add_argument('-e', '--max_evalue', type=float, help='drop hits whose rescaled e-value is above this')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        with open(args.genomes, 'r') as f:
+            genomes = [line.rstrip('\n').split('\t')[:2] for line in f if line.strip()]
+        build(genomes, args.combined_fasta, args.map, args.lengths)
+    elif args.command == 'split':
+        query_genomes = {}
+        with open(args.query_map, 'r') as f:
+            for line in f:
+                if line.strip():
+                    query, genome = line.rstrip('\n').split('\t')[:2]
+                    query_genomes[query] = genome
+        with open(args.hits, 'r') as hits:
+            split(hits, read_map(args.map), query_genomes, args.output_dir, args.suffix, args.genome_dirs,
+                read_lengths(args.lengths) if args.lengths else None, args.dbsize, args.max_evalue)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    sys.exit(0)
@@ -1,25 +1,155 @@
 #! /usr/bin/python3 -E
 
 import argparse
+import hashlib
+import heapq
 import os
+import re
 import shutil
 import subprocess
 import sys
 import time
 
+from array import array
 from multiprocessing import Pool
 
+import vicsin_trace
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 TEMPOUT = 'tempspineout'
 TEMPIN = 'tempspinein'
+# k-mers are hashed as integers of 2 bits per base, ordered like the bases they encode
+BASE_CODES = str.maketrans('ACGT', '\x00\x01\x02\x03')
+MASK64 = (1 << 64) - 1
+
+def hash_file(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def read_cache(cache_path):
+    # each line holds the content hashes of two genomes and the PLA of each against the other
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == 4:
+                    hash1, hash2, val1, val2 = fields
+                    cache[(hash1, hash2)] = val1
+                    cache[(hash2, hash1)] = val2
+    return cache
+
+def mix64(value):
+    # splitmix64 finalizer, a bijection on 64 bit ints, so distinct k-mers never share a hash
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & MASK64
+    return value ^ (value >> 31)
+
+def mix64_array(values):
+    # mix64 of every element of a numpy uint64 array; products wrap around at 64 bits as in mix64
+    values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+    return values ^ (values >> numpy.uint64(31))
+
+def kmer_hashes(seq, kmer):
+    # hashes of the canonical k-mers of a sequence of only ACGT, built for all positions at once
+    codes = numpy.frombuffer(seq.translate(BASE_CODES).encode(), dtype=numpy.uint8).astype(numpy.uint64)
+    count = len(seq) - kmer + 1
+    forward = numpy.zeros(count, dtype=numpy.uint64)
+    reverse = numpy.zeros(count, dtype=numpy.uint64)
+    for offset in range(kmer):
+        window = codes[offset:offset + count]
+        forward |= window << numpy.uint64(2 * (kmer - 1 - offset))
+        reverse |= (numpy.uint64(3) - window) << numpy.uint64(2 * offset)
+    return mix64_array(numpy.minimum(forward, reverse))
+
+def sketch_genome(task):
+    # bottom-k MinHash sketch of the canonical k-mers of a FASTA file, saved as an array of unsigned 64 bit ints:
+    # the number of k-mers in the genome followed by the sorted sketch hashes
+    fasta_path, sketch_path, kmer, sketch_size = task
+    if os.path.exists(sketch_path):
+        return
+    with open(fasta_path, 'r') as f:
+        contigs = ''.join(line.strip() if line[0] != '>' else '|' for line in f).upper()
+    seqs = [seq for seq in re.split('[^ACGT]+', contigs) if len(seq) >= kmer]
+    kmer_count = sum(len(seq) - kmer + 1 for seq in seqs)
+    if numpy is not None:
+        values = numpy.concatenate([kmer_hashes(seq, kmer) for seq in seqs] or [numpy.zeros(0, dtype=numpy.uint64)])
+        # the distinct hashes below a partition cut, with the cut raised until there are enough of them
+        cut = sketch_size
+        while True:
+            if cut >= len(values):
+                smallest = numpy.unique(values)
+                break
+            smallest = numpy.unique(values[values < numpy.partition(values, cut)[cut]])
+            if len(smallest) >= sketch_size:
+                break
+            cut *= 2
+        sketch = array('Q', [kmer_count] + smallest[:sketch_size].tolist())
+    else:
+        heap, seen = [], set()
+        kmer_mask, top_shift = (1 << 2 * kmer) - 1, 2 * (kmer - 1)
+        for seq in seqs:
+            forward, reverse = 0, 0
+            for pos, code in enumerate(seq.translate(BASE_CODES).encode()):
+                forward = ((forward << 2) | code) & kmer_mask
+                reverse = (reverse >> 2) | ((3 - code) << top_shift)
+                if pos < kmer - 1:
+                    continue
+                value = mix64(min(forward, reverse))
+                if value in seen:
+                    continue
+                if len(heap) < sketch_size:
+                    heapq.heappush(heap, -value)
+                    seen.add(value)
+                elif value < -heap[0]:
+                    seen.discard(-heapq.heappushpop(heap, -value))
+                    seen.add(value)
+        sketch = array('Q', [kmer_count] + sorted(-value for value in heap))
+    with open(sketch_path + '.tmp', 'wb') as f:
+        sketch.tofile(f)
+    os.rename(sketch_path + '.tmp', sketch_path)
+
+def read_sketch(sketch_path):
+    sketch = array('Q')
+    with open(sketch_path, 'rb') as f:
+        sketch.frombytes(f.read())
+    return sketch[0], set(sketch[1:])
+
+def estimate_pla(sketch1, sketch2, sketch_size):
+    # estimates the fraction of each genome shared with the other from the Jaccard index of their bottom-k sketches
+    count1, hashes1 = sketch1
+    count2, hashes2 = sketch2
+    if not hashes1 or not hashes2:
+        return 0.0, 0.0
+    # the smallest hashes of the union are in a genome's sketch exactly when their k-mer is in the genome
+    union = sorted(hashes1 | hashes2)[:sketch_size]
+    jaccard = float(len([h for h in union if h in hashes1 and h in hashes2])) / len(union)
+    shared = jaccard * (count1 + count2) / (1 + jaccard)
+    return min(1.0, shared / count1), min(1.0, shared / count2)
 
 def run_spine(ij):
+    i, j = ij
+    with vicsin_trace.span('spine_pair', context='%s-%s' % (input_files[i], input_files[j])):
+        return spine_pair(i, j)
+
+def spine_pair(i, j):
     global input_files
     global input_dir
     global verbose
     global spine_path
 
-    i, j = ij
     tempdir = '%s-%s' % (i, j)
+    if os.path.exists(tempdir):
+        # left behind by an interrupted run
+        shutil.rmtree(tempdir)
     os.mkdir(tempdir)
     os.chdir(tempdir)
 
@@ -53,7 +183,7 @@ def run_spine(ij):
     os.chdir('..')
     shutil.rmtree(tempdir)
 
-    return '%s-%s:%s\n%s-%s:%s' % (genome[0], genome[1], str(data1), genome[1], genome[0], str(data2))
+    return genome[0], genome[1], str(data1), str(data2)
 
 if __name__ == '__main__':
     # track how long program takes to run
@@ -66,6 +196,12 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--spine_path', help='spine binary path', default='spine')
     parser.add_argument('-n', '--num_cpus', type=int, help='number of cpus to use', default=1)
     parser.add_argument('-o', '--output', help='output path', default='genome_grouper_output.txt')
+    parser.add_argument('-c', '--cache', help='pair cache path; pairs already in the cache are not rerun', default='genome_grouper_cache.txt')
+    parser.add_argument('-p', '--prescreen', help='estimate PLA from MinHash sketches and only run spine on similar pairs', action='store_true')
+    parser.add_argument('-t', '--prescreen_threshold', type=float, help='run spine on a pair if either estimated PLA is at least this', default=0.1)
+    parser.add_argument('-k', '--kmer', type=int, help='prescreen k-mer size, at most 32', default=21)
+    parser.add_argument('--sketch_size', type=int, help='number of hashes kept in each prescreen sketch', default=1000)
+    parser.add_argument('--sketch_dir', help='directory for the prescreen sketches', default='genome_grouper_sketches')
     args = parser.parse_args()
 
     # perform some input validation
@@ -81,6 +217,10 @@ if __name__ == '__main__':
         print('ERROR: Must specify at least one CPU.')
         sys.exit(1)
 
+    if args.prescreen and not 1 <= args.kmer <= 32:
+        print('ERROR: Prescreen k-mer size must be from 1 to 32.')
+        sys.exit(1)
+
     # setup variables that will be needed from within run_spine
     global input_files
     global input_dir
@@ -105,26 +245,62 @@ if __name__ == '__main__':
         index_to_name.append(f)
         name_to_index[f] = len(index_to_name) - 1
 
-    # create a list of all pairs of input files, without repeats
+    # identify genomes by content, so cached pairs survive renames and additions to the input directory
+    with vicsin_trace.span('hash_genomes'), Pool(processes=args.num_cpus) as pool:
+        hashes = pool.map(hash_file, [os.path.join(input_dir, f) for f in input_files])
+    cache = read_cache(args.cache)
+
+    # sketch every genome and estimate the PLA of each pair not in the cache
+    estimates = {}
+    if args.prescreen:
+        if not os.path.isdir(args.sketch_dir):
+            os.makedirs(args.sketch_dir)
+        # named by the k-mer hash too, so sketches of an earlier hash are not compared with these
+        sketch_paths = [os.path.join(args.sketch_dir, '%s.k%d.s%d.m64.sketch' % (h, args.kmer, args.sketch_size)) for h in hashes]
+        with vicsin_trace.span('sketch_genomes'), Pool(processes=args.num_cpus) as pool:
+            pool.map(sketch_genome, [(os.path.join(input_dir, f), sketch_path, args.kmer, args.sketch_size) for f, sketch_path in zip(input_files, sketch_paths)])
+        sketches = [read_sketch(sketch_path) for sketch_path in sketch_paths]
+        for i in range(len(input_files)):
+            for j in range(i + 1, len(input_files)):
+                if (hashes[i], hashes[j]) not in cache:
+                    estimates[(i, j)] = estimate_pla(sketches[i], sketches[j], args.sketch_size)
+
+    # create a list of all pairs of input files not in the cache, without repeats
     inputs = []
     for i in range(len(input_files)):
         for j in range(i + 1, len(input_files)):
-            inputs.append((i, j))
+            if (hashes[i], hashes[j]) not in cache:
+                if (i, j) not in estimates or max(estimates[(i, j)]) >= args.prescreen_threshold:
+                    inputs.append((i, j))
+
+    if verbose:
+        total = len(input_files) * (len(input_files) - 1) // 2
+        print('%d of %d pairs found in cache' % (total - len(estimates if args.prescreen else inputs), total))
+        if args.prescreen:
+            print('%d pairs estimated from sketches' % (len(estimates) - len(inputs)))
 
     # use multiprocessing to run multiple instances of spine on the input pairs depending
-    # on the number of cpus
-    with Pool(processes=args.num_cpus) as pool:
-        processed_list = pool.map(run_spine, inputs)
-
-    # extract spine data into data matrix
-    for entry in processed_list:
-        pair1, pair2 = entry.split('\n')
-        key1, val1 = pair1.split(':')
-        key2, val2 = pair2.split(':')
-        genome1, genome2 = key1.split('-')
-        data[name_to_index[genome1]][name_to_index[genome2]] = val1
-        data[name_to_index[genome2]][name_to_index[genome1]] = val2
-    
+    # on the number of cpus, saving each pair to the cache as soon as it finishes
+    with Pool(processes=args.num_cpus) as pool, open(args.cache, 'a') as cache_file:
+        for genome1, genome2, val1, val2 in pool.imap_unordered(run_spine, inputs):
+            hash1 = hashes[name_to_index[genome1]]
+            hash2 = hashes[name_to_index[genome2]]
+            cache[(hash1, hash2)] = val1
+            cache[(hash2, hash1)] = val2
+            cache_file.write('%s\t%s\t%s\t%s\n' % (hash1, hash2, val1, val2))
+            cache_file.flush()
+
+    # extract spine data into data matrix, falling back on the prescreen estimate for pairs spine was not run on
+    flags = [['exact'] * len(input_files) for _ in range(len(input_files))]
+    for i in range(len(input_files)):
+        for j in range(len(input_files)):
+            if i != j:
+                if (hashes[i], hashes[j]) in cache:
+                    data[i][j] = cache[(hashes[i], hashes[j])]
+                else:
+                    data[i][j] = str(estimates[(min(i, j), max(i, j))][0 if i < j else 1])
+                    flags[i][j] = 'estimated'
+
     # output the data matrix to a file
     with open(args.output, 'w') as f:
         f.write('\t')
@@ -137,6 +313,20 @@ if __name__ == '__main__':
             for el in row:
                 f.write('%s\t' % el)
             f.write('\n')
+
+    # mark which entries of the data matrix are spine results and which are prescreen estimates
+    if args.prescreen:
+        with open(args.output + '.flags', 'w') as f:
+            f.write('\t')
+            for genome in index_to_name:
+                f.write('%s\t' % genome)
+            f.write('\n')
+
+            for i, row in enumerate(flags):
+                f.write('%s\t' % index_to_name[i])
+                for el in row:
+                    f.write('%s\t' % el)
+                f.write('\n')
     
     if verbose:
         print('Program ran for %s seconds' % (time.time() - start_time))
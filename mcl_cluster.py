@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#mcl_cluster.py <abc> <dump> <reformat> [options]
+#Markov clustering of an abc edge list (label, label, weight), in place of the mcxload / mcl / mcxdump /
+#MCLdump2clusters.pl chain.
+#dump: one cluster per line, tab delimited labels, largest cluster first (as mcxdump -icl writes it)
+#reformat: tab delimited <prefix><cluster number>, label (as MCLdump2clusters.pl writes it)
+#The graph is kept as a SciPy sparse matrix of columns. Edges are mirrored (keeping the larger weight of a pair), every
+#node gets a loop weighted as its heaviest edge, and then expansion (a sparse matrix product), inflation and pruning
+#are repeated until the matrix settles.
+#SciPy is optional: without it the graph is clustered by mcxload, mcl and mcxdump, and only the files are written here.
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+def read_abc(abc_file):
+    """reads the graph as a mirrored sparse matrix without loops; node indexes follow first appearance, as in mcxload"""
+    index = OrderedDict()
+    rows, cols, weights = [], [], []
+    with open(abc_file, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) < 3:
+                continue
+            nodes = []
+            for label in row[:2]:
+                if label not in index:
+                    index[label] = len(index)
+                nodes.append(index[label])
+            weight = float(row[2])
+            if weight > 0 and nodes[0] != nodes[1]:
+                rows.append(nodes[0])
+                cols.append(nodes[1])
+                weights.append(weight)
+    size = len(index)
+    rows, cols = numpy.array(rows + cols, dtype=numpy.int64), numpy.array(cols + rows, dtype=numpy.int64)
+    weights = numpy.array(weights * 2, dtype=float)
+    # keep the largest weight of each pair: sort by row, column and falling weight, then take the first of each run
+    order = numpy.lexsort((-weights, cols, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    first = numpy.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    matrix = sparse.csc_matrix((weights[first], (rows[first], cols[first])), shape=(size, size))
+    return list(index), matrix
+
+
+def column_of_entries(matrix):
+    """the column of every stored entry of a CSC matrix"""
+    return numpy.repeat(numpy.arange(matrix.shape[1]), numpy.diff(matrix.indptr))
+
+
+def normalize(matrix):
+    """rescales every column to sum to 1, in place"""
+    sums = numpy.asarray(matrix.sum(axis=0)).ravel()
+    sums[sums == 0] = 1.0
+    matrix.data /= numpy.repeat(sums, numpy.diff(matrix.indptr))
+    return matrix
+
+
+def prune(matrix, threshold, select):
+    """drops entries below threshold (unless that empties the column) and keeps the select largest of each column, then
+    rescales the columns to sum to 1"""
+    matrix = matrix.tocsc()
+    matrix.sort_indices()
+    size = matrix.shape[1]
+    columns = column_of_entries(matrix)
+    keep = matrix.data >= threshold
+    keep |= (numpy.bincount(columns[keep], minlength=size) == 0)[columns]
+    for column in numpy.flatnonzero(numpy.bincount(columns[keep], minlength=size) > select):
+        start = matrix.indptr[column]
+        kept = numpy.flatnonzero(keep[start:matrix.indptr[column + 1]]) + start
+        keep[kept[numpy.argsort(-matrix.data[kept], kind='mergesort')[select:]]] = False
+    matrix.data[~keep] = 0.0
+    matrix.eliminate_zeros()
+    return normalize(matrix)
+
+
+def chaos(matrix):
+    """how far the columns are from idempotent (0 when every column is spread evenly over its rows)"""
+    starts = matrix.indptr[:-1][numpy.diff(matrix.indptr) > 0]
+    if not len(starts):
+        return 0.0
+    largest = numpy.maximum.reduceat(matrix.data, starts)
+    squares = numpy.add.reduceat(matrix.data * matrix.data, starts)
+    return float(numpy.max(largest / squares - 1.0))
+
+
+def mcl(matrix, inflation=2.0, threshold=1e-4, select=1100, tolerance=1e-4, max_iterations=100):
+    """runs MCL on a mirrored graph; returns the converged columns as {row: value} dicts"""
+    loops = numpy.asarray(matrix.max(axis=0).todense()).ravel()
+    loops[loops <= 0] = 1.0
+    matrix = normalize((matrix + sparse.diags(loops)).tocsc())
+    for iteration in range(max_iterations):
+        # expansion
+        matrix = prune(matrix.dot(matrix), threshold, select)
+        # inflation
+        matrix.data **= inflation
+        matrix = prune(normalize(matrix), threshold, select)
+        if chaos(matrix) < tolerance:
+            break
+    indptr, indices, data = matrix.indptr.tolist(), matrix.indices.tolist(), matrix.data.tolist()
+    return [dict(zip(indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]])) for i in range(matrix.shape[1])]
+
+
+def interpret(columns):
+    """groups nodes into clusters: attractors that attract each other form one cluster, and every other node joins the
+    cluster of its strongest attractor. Clusters are ordered largest first, then by first node."""
+    attractors = set(node for node, column in enumerate(columns) if column.get(node, 0.0) > 0)
+    parent = dict((node, node) for node in attractors)
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for node in sorted(attractors):
+        for row in columns[node]:
+            if row in attractors:
+                parent[find(row)] = find(node)
+    clusters = {}
+    for node, column in enumerate(columns):
+        if node in attractors:
+            root = find(node)
+        else:
+            # ties go to the first attractor; a column that has not settled on any attractor stays on its own
+            strongest = [(value, -row) for row, value in column.items() if row in attractors]
+            root = find(-max(strongest)[1]) if strongest else node
+        clusters.setdefault(root, []).append(node)
+    return sorted(clusters.values(), key=lambda cluster: (-len(cluster), cluster[0]))
+
+
+def write_clusters(clusters, dump_file, reformat_file, prefix='', mode='w'):
+    """writes clusters (lists of labels) as the dump and reformatted dump files; mode 'a' appends to them"""
+    with open(dump_file, mode) as dump, open(reformat_file, mode) as reformat:
+        for number, cluster in enumerate(clusters):
+            dump.write('\t'.join(cluster) + '\n')
+            for label in cluster:
+                reformat.write('%s%d\t%s\n' % (prefix, number, label))
+
+
+def read_dump(dump_file):
+    with open(dump_file, 'r') as f:
+        return [line.rstrip('\n').split('\t') for line in f if line.strip()]
+
+
+def has_edges(abc_file):
+    with open(abc_file, 'r') as f:
+        return any(len(line.rstrip('\n').split('\t')) >= 3 for line in f)
+
+
+def external_mcl(abc_file, inflation, options):
+    """clusters an abc file with mcxload, mcl and mcxdump; returns the clusters as lists of labels"""
+    work_dir = tempfile.mkdtemp()
+    try:
+        mci, tab, out, dump = [os.path.join(work_dir, name) for name in ('graph.mci', 'graph.tab', 'out.mci', 'dump.mci')]
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([options.mcxload, '-abc', abc_file, '--stream-mirror', '-o', mci, '-write-tab', tab], stdout=devnull, stderr=devnull)
+            subprocess.check_call([options.mcl, mci, '-I', str(inflation), '-o', out, '-q', 'x', '-V', 'all'], stdout=devnull, stderr=devnull)
+            subprocess.check_call([options.mcxdump, '-icl', out, '-tabr', tab, '-o', dump], stdout=devnull, stderr=devnull)
+        return read_dump(dump)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def agreement(clusters, other):
+    """share of node pairs that both clusterings put together or both keep apart (the Rand index)"""
+    mine, theirs = {}, {}
+    for number, cluster in enumerate(clusters):
+        for label in cluster:
+            mine[label] = number
+    for number, cluster in enumerate(other):
+        for label in cluster:
+            theirs[label] = number
+    labels = sorted(set(mine) & set(theirs))
+    pairs = agree = 0
+    for i in range(len(labels)):
+        for j in range(i + 1, len(labels)):
+            pairs += 1
+            agree += (mine[labels[i]] == mine[labels[j]]) == (theirs[labels[i]] == theirs[labels[j]])
+    return float(agree) / pairs if pairs else 1.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Markov-cluster an abc edge list into MCL dump and reformatted dump files.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('abc', help='tab delimited label, label, weight')
+    parser.add_argument('dump', help='output: one cluster of labels per line')
+    parser.add_argument('reformat', help='output: tab delimited cluster name, label')
+    parser.add_argument('-I', '--inflation', type=float, help='MCL inflation', default=2.0)
+    parser.add_argument('-p', '--prefix', help='prefix of the cluster names in the reformatted dump', default='')
+    parser.add_argument('-P', '--prune', type=float, help='entries below 1/P are pruned after each step', default=10000)
+    parser.add_argument('-S', '--select', type=int, help='entries kept per column after pruning', default=1100)
+    parser.add_argument('-a', '--append', nargs=2, metavar=('DUMP', 'REFORMAT'), help='also append the clusters to these dump and reformatted dump files')
+    parser.add_argument('-b', '--benchmark', help='also cluster the graph with mcxload, mcl and mcxdump, and report both run times and how well the clusterings agree', action='store_true')
+    parser.add_argument('--mcxload', help='path to mcxload, used without SciPy and for --benchmark', default='mcxload')
+    parser.add_argument('--mcl', help='path to mcl, used without SciPy and for --benchmark', default='mcl')
+    parser.add_argument('--mcxdump', help='path to mcxdump, used without SciPy and for --benchmark', default='mcxdump')
+    args = parser.parse_args()
+
+    start = time.time()
+    # no edges (e.g. every small prediction already joined a cluster) gives no clusters, and empty output files
+    clusters = []
+    if sparse is None:
+        if has_edges(args.abc):
+            print('mcl_cluster.py: SciPy not found; clustering with %s' % args.mcl, file=sys.stderr)
+            clusters = external_mcl(args.abc, args.inflation, args)
+    else:
+        labels, matrix = read_abc(args.abc)
+        if labels:
+            clusters = [[labels[node] for node in cluster] for cluster in interpret(mcl(matrix, args.inflation, 1.0 / args.prune, args.select))]
+    write_clusters(clusters, args.dump, args.reformat, args.prefix)
+    if args.append:
+        write_clusters(clusters, args.append[0], args.append[1], args.prefix, 'a')
+    seconds = time.time() - start
+
+    if args.benchmark:
+        start = time.time()
+        other = external_mcl(args.abc, args.inflation, args)
+        external_seconds = time.time() - start
+        identical = len(set(tuple(sorted(cluster)) for cluster in clusters) & set(tuple(sorted(cluster)) for cluster in other))
+        print('nodes\t%d\nclusters\t%d\nexternal_clusters\t%d\nidentical_clusters\t%d\nrand_index\t%.4f\nseconds\t%.2f\nexternal_seconds\t%.2f' % (
+            sum(len(cluster) for cluster in clusters), len(clusters), len(other), identical, agreement(clusters, other), seconds, external_seconds))
+
+    sys.exit(0)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#mcl_cluster_regression.py [options]
+#Checks mcl_cluster.py on edge files the cluster step can hand it: an empty one (the small prediction pass when every
+#small prediction already joined a cluster) must give exit status 0 and empty dump files, and leave the files named
+#with -a as they were; graphs of planted clusters joined by weak noise edges must give back the planted clusters.
+from __future__ import print_function
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcl_cluster.py')
+
+
+def run(work_dir, abc, *options):
+    """runs mcl_cluster.py on abc; returns its exit status and the dump and reformat file contents"""
+    dump, reformat = os.path.join(work_dir, 'dump'), os.path.join(work_dir, 'reformat')
+    status = subprocess.call([sys.executable, SCRIPT, abc, dump, reformat] + list(options))
+    contents = []
+    for path in (dump, reformat):
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                contents.append(f.read())
+        else:
+            contents.append(None)
+    return status, contents[0], contents[1]
+
+
+def planted_graph(rng, abc, clusters, size, density):
+    """writes clusters of size nodes, each pair joined with probability density at a high weight, plus weak edges
+    between clusters; returns the planted clusters as sets of labels"""
+    planted = [set('c%d_n%d' % (c, i) for i in range(size)) for c in range(clusters)]
+    with open(abc, 'w') as out:
+        for c in range(clusters):
+            for i in range(size):
+                for j in range(i + 1, size):
+                    if rng.random() < density or j == i + 1:
+                        out.write('c%d_n%d\tc%d_n%d\t%.3f\n' % (c, i, c, j, rng.uniform(0.7, 1.0)))
+        for _ in range(clusters * size // 5):
+            a, b = rng.randrange(clusters), rng.randrange(clusters)
+            out.write('c%d_n%d\tc%d_n%d\t%.3f\n' % (a, rng.randrange(size), b, rng.randrange(size), rng.uniform(0.5, 0.55)))
+    return planted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check mcl_cluster.py on empty and planted-cluster edge files.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-t', '--trials', type=int, help='number of planted-cluster graphs', default=20)
+    parser.add_argument('-s', '--seed', type=int, help='random seed', default=1)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    failures = 0
+    try:
+        abc = os.path.join(work_dir, 'graph.abc')
+        open(abc, 'w').close()
+        append_dump, append_reformat = os.path.join(work_dir, 'append_dump'), os.path.join(work_dir, 'append_reformat')
+        for path in (append_dump, append_reformat):
+            with open(path, 'w') as f:
+                f.write('a\tb\n')
+        status, dump, reformat = run(work_dir, abc, '-p', 'S', '-a', append_dump, append_reformat)
+        with open(append_dump, 'r') as f, open(append_reformat, 'r') as g:
+            appended = (f.read(), g.read())
+        if status != 0 or dump != '' or reformat != '' or appended != ('a\tb\n', 'a\tb\n'):
+            print('Empty edge file: exit status %d, dump %r, reformat %r, appended files %r' % (status, dump, reformat, appended))
+            failures += 1
+        else:
+            print('Empty edge file: exit status 0 and empty outputs')
+
+        rng = random.Random(args.seed)
+        matched = 0
+        for trial in range(args.trials):
+            planted = planted_graph(rng, abc, rng.randint(2, 8), rng.randint(5, 40), rng.uniform(0.4, 0.9))
+            status, dump, reformat = run(work_dir, abc)
+            found = [set(line.split('\t')) for line in dump.splitlines()] if status == 0 else []
+            if sorted(map(sorted, found)) == sorted(map(sorted, planted)):
+                matched += 1
+            else:
+                print('Trial %d: exit status %d, %d planted clusters, %d found' % (trial, status, len(planted), len(found)))
+                failures += 1
+        print('%d/%d planted-cluster graphs matched' % (matched, args.trials))
+    finally:
+        shutil.rmtree(work_dir)
+
+    sys.exit(1 if failures else 0)
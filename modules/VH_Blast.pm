@@ -9,6 +9,7 @@ package VH_Blast;
 use File::Path qw(make_path);
 use VICSIN;
 use VH_helpers;
+use VH_Cache;
 
 no define CONVERTED_INPUT_DIR =>;
 use constant KNOWN_TYPES_DIR => "Known_Type_Runs";
@@ -17,30 +18,46 @@ sub run {
 	my $prefixes = shift;
 
 	VH_helpers::log("Starting blastn against known viral types...");
-	make_path(VICSIN::param("output_path")."/".KNOWN_TYPES_DIR);
 	foreach(@$prefixes){
-		my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna";
-		my $output_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/$_.br";
-		my $log_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/$_-log.txt";
-		my $lock_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/${_}_lock";
-		if( -f $output_file_name and not -f $lock_file_name){
-			VH_helpers::log("\t$_ homology blast already completed. Skipping.");
-		} else {
-			VH_helpers::log("\tRunning homology blast for $_... ",1);
-			# Create a lockfile to signify that the blastn run is in progress
-			open(my $lockfh, '>', $lock_file_name);
-			say $lockfh "$$";
-			close $lockfh;
-			
-			# Run blastn
-			VH_helpers::run_cmd(VICSIN::param('blastn')." -query ".VICSIN::param('known_viral_types')." -subject $fasta_file_name -outfmt 6 -out $output_file_name 2>&1 >$log_file_name");
-			
-			unlink $lock_file_name;
-		}
+		run_one($_);
 	}
 	print "\n";
 }
 
+# Blasts the known viral types against a single genome
+sub run_one {
+	local $_ = shift;
+
+	make_path(VICSIN::param("output_path")."/".KNOWN_TYPES_DIR);
+	my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna";
+	my $output_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/$_.br";
+	my $log_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/$_-log.txt";
+	my $lock_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/${_}_lock";
+	my $key_file_name = VICSIN::param("output_path")."/".KNOWN_TYPES_DIR."/${_}_key";
+
+	my $key = VH_Cache::key('blast',[$fasta_file_name,VICSIN::param('known_viral_types')],[VICSIN::param('blastn')],{});
+	my $prefix = $_;
+	my $result = VH_Cache::run('blast',$prefix,$key,{'br'=>$output_file_name},$key_file_name,sub {
+		VH_helpers::log("\tRunning homology blast for $prefix... ",1);
+		# Create a lockfile to signify that the blastn run is in progress
+		open(my $lockfh, '>', $lock_file_name);
+		say $lockfh "$$";
+		close $lockfh;
+		
+		# Run blastn
+		VH_helpers::run_cmd(VICSIN::param('blastn')." -query ".VICSIN::param('known_viral_types')." -subject $fasta_file_name -outfmt 6 -out $output_file_name 2>&1 >$log_file_name");
+		my $status = $?;
+		
+		unlink $lock_file_name;
+		return $status == 0;
+	});
+	if($result eq 'current'){
+		VH_helpers::log("\t$_ homology blast already completed. Skipping.");
+	} elsif($result eq 'hit'){
+		VH_helpers::log("\t$_ homology blast results found in cache.",1);
+	}
+}
+
 sub get_predictions {
 	my $prefix = shift;
 
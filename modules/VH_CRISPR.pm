@@ -10,6 +10,7 @@ use File::Path qw(make_path);
 use File::Basename qw(basename);
 use VICSIN;
 use VH_helpers;
+use VH_Cache;
 
 no define CONVERTED_INPUT_DIR =>;
 use constant CRISPR_DIR => "CRISPR_Runs";
@@ -20,43 +21,129 @@ sub run {
 	VH_helpers::log("Starting CRISPR runs...");
 
 	foreach(@$prefixes) {
-		my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna";
-		my $wdir = VICSIN::param('output_path').'/'.CRISPR_DIR."/${_}";
-		my $crispr_file_name = $wdir."/${_}_CRISPR.aln";
-		my $log_file_name = $wdir."/${_}-log.txt";
-		my $lock_file_name = $wdir."/${_}_CRISPR_lock";
-		my $db_file_name = $wdir."/${_}_db";
-		my $db_name = "${_}_db";
-		my $spacer_fasta_file = File::Spec->rel2abs(VICSIN::param('spacer_fasta_file'));
-		my $pamproto_name = $db_name."_vs_".basename($spacer_fasta_file);
-		my $pamproto_out = $wdir."/$pamproto_name.dir/$pamproto_name.extra.aln";
-		
-		make_path($wdir);
+		run_one($_);
+	}
+	print "\n";
+}
 
-		# If the crispr file exists but not the lock file, the CRISPR run was already complete
-		if (-f $crispr_file_name and not -f $lock_file_name){
-			VH_helpers::log("\t$_ CRISPR already completed. Skipping.",1);
-		} else {
-			VH_helpers::log("\tRunning CRISPR blast for $_...",1);
-			# Create a lockfile to signify that the CRISPR run is in progress
-			open(my $lockfh, '>', $lock_file_name);
-			say $lockfh "$$";
-			close $lockfh;
+# Cache key, outputs and key file of a genome's CRISPR results; with database_mode, those of the database mode
+sub cache_entry {
+	my $prefix = shift;
+	my $database_mode = shift;
+
+	my $wdir = VICSIN::param('output_path').'/'.CRISPR_DIR."/${prefix}";
+	my %params = ('crispr_match_threshold'=>VICSIN::param('crispr_match_threshold'));
+	# Rescaled E-values are written with fewer digits than blastn's own
+	$params{'crispr_mode'} = 'database' if $database_mode;
+	my $key = VH_Cache::key('crispr',[VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$prefix.fna",
+		File::Spec->rel2abs(VICSIN::param('spacer_fasta_file'))],
+		[VICSIN::param('makeblastdb'),VICSIN::param('pamprotopatterngrab'),VICSIN::param('blastn')],\%params);
+	return ($key,{'CRISPR.aln'=>$wdir."/${prefix}_CRISPR.aln"},$wdir."/${prefix}_CRISPR_key");
+}
 
+# Matches the CRISPR spacers against a single genome. In database mode, the blastn-short hits were already routed
+#  to the genome by run_search, and only PAMProtoPatternGrab_full runs here.
+sub run_one {
+	local $_ = shift;
+	my $database_mode = shift;
+
+	my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna";
+	my $wdir = VICSIN::param('output_path').'/'.CRISPR_DIR."/${_}";
+	my $crispr_file_name = $wdir."/${_}_CRISPR.aln";
+	my $log_file_name = $wdir."/${_}-log.txt";
+	my $lock_file_name = $wdir."/${_}_CRISPR_lock";
+	my $db_file_name = $wdir."/${_}_db";
+	my $db_name = "${_}_db";
+	my $search_file_name = $wdir."/${_}_search.aln";
+	my $spacer_fasta_file = File::Spec->rel2abs(VICSIN::param('spacer_fasta_file'));
+	my $pamproto_name = $db_name."_vs_".basename($spacer_fasta_file);
+	my $pamproto_out = $wdir."/$pamproto_name.dir/$pamproto_name.extra.aln";
+	
+	make_path($wdir);
+
+	my ($key, $outputs, $key_file_name) = cache_entry($_,$database_mode);
+	my $prefix = $_;
+	my $result = VH_Cache::run('crispr',$prefix,$key,$outputs,$key_file_name,sub {
+		VH_helpers::log("\tRunning CRISPR blast for $prefix...",1);
+		# Create a lockfile to signify that the CRISPR run is in progress
+		open(my $lockfh, '>', $lock_file_name);
+		say $lockfh "$$";
+		close $lockfh;
+
+		# Run PAMProtoPatternGrab_full; protospacers are cut straight from the genome fasta
+		File::Path::rmtree(glob($wdir."/$pamproto_name.dir"));
+		my $genome_file_name = File::Spec->rel2abs($fasta_file_name);
+		if($database_mode){
+			# The database is only used to name the outputs when the alignments are given
+			VH_helpers::run_cmd("cd $wdir; ".VICSIN::param('pamprotopatterngrab')." $spacer_fasta_file $db_name $genome_file_name --aln ".File::Spec->rel2abs($search_file_name)." 2>&1; cd -");
+		} else {
 			# Create a blast database from a single genome
 			VH_helpers::run_cmd(VICSIN::param('makeblastdb')." -in $fasta_file_name -dbtype nucl -parse_seqids -out $db_file_name 2>&1");
+			VH_helpers::run_cmd("cd $wdir; ".VICSIN::param('pamprotopatterngrab')." $spacer_fasta_file $db_name $genome_file_name 2>&1; cd -");
+		}
 
-			# Run PAMProtoPatternGrab_full
-			File::Path::rmtree(glob($wdir."/$pamproto_name.dir"));
-			VH_helpers::run_cmd("cd $wdir; ".VICSIN::param('pamprotopatterngrab')." $spacer_fasta_file $db_name 2>&1; cd -");
+		# Filter ...extra.aln with awk
+		VH_helpers::run_cmd("awk '{if (\$18>=".VICSIN::param('crispr_match_threshold').") print}' $pamproto_out > $crispr_file_name");
+		my $status = $?;
+		
+		unlink $lock_file_name;
+		return $status == 0;
+	});
+	if($result eq 'current'){
+		VH_helpers::log("\t$_ CRISPR already completed. Skipping.",1);
+	} elsif($result eq 'hit'){
+		VH_helpers::log("\t$_ CRISPR results found in cache.",1);
+	}
+	unlink $search_file_name;
+}
 
-			# Filter ...extra.aln with awk
-			VH_helpers::run_cmd("awk '{if (\$18>=".VICSIN::param('crispr_match_threshold').") print}' $pamproto_out > $crispr_file_name");
-			
-			unlink $lock_file_name;
-		}
+# Database mode: blasts the spacers once, on num_threads cores, against a single database of every genome whose
+#  results are neither current nor cached, and routes the hits to <prefix>/<prefix>_search.aln for run_one.
+# The search runs with the combined length as -dbsize and an E-value cutoff loosened for the smallest genome; each hit's
+#  E-value is then rescaled to its own genome's length and cut at .1, as a search of that genome alone gives them.
+sub run_search {
+	my $prefixes = shift;
+
+	my $wdir = VICSIN::param("output_path")."/".CRISPR_DIR;
+	my $spacer_fasta_file = File::Spec->rel2abs(VICSIN::param('spacer_fasta_file'));
+	my $genomes_file_name = "$wdir/all-genomes.tbl";
+	my $combined_fasta_file_name = "$wdir/all-genomes.fna";
+	my $genome_map_file_name = "$wdir/all-genomes.map";
+	my $lengths_file_name = "$wdir/all-genomes.lengths";
+	my $query_map_file_name = "$wdir/all-spacers.map";
+	my $db_name = "$wdir/all-genomes_db";
+	my $search_file_name = "$wdir/all_search.aln";
+	my $max_evalue = 0.1;
+
+	my @search_prefixes = grep { not VH_Cache::available('crispr',cache_entry($_,1)) } @$prefixes;
+	if(not @search_prefixes){
+		VH_helpers::log("\tCRISPR results of every genome are current or cached. Skipping the spacer search.",1);
+		return;
 	}
-	print "\n";
+	make_path($wdir);
+
+	VH_helpers::log("\tGenerating CRISPR database of ".scalar(@search_prefixes)." genomes...",1);
+	open(my $genomesfh, '>', $genomes_file_name);
+	foreach my $prefix (@search_prefixes){
+		print $genomesfh "$prefix\t".VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$prefix.fna\n";
+	}
+	close($genomesfh);
+	# Spacers belong to no genome, so no hit is left out when splitting
+	open(my $querymapfh, '>', $query_map_file_name);
+	close($querymapfh);
+	VH_helpers::run_cmd(VICSIN::param('genome_db')." build $genomes_file_name $combined_fasta_file_name $genome_map_file_name -l $lengths_file_name");
+	VH_helpers::run_cmd(VICSIN::param('makeblastdb')." -in $combined_fasta_file_name -parse_seqids -dbtype nucl -out $db_name");
+
+	my ($database_size, $smallest) = VH_helpers::genome_db_sizes($lengths_file_name);
+
+	VH_helpers::log("\tRunning CRISPR blast against all genomes...",1);
+	# The columns and options of PAMProtoPatternGrab_full's own blastn-short run
+	VH_helpers::run_cmd(VICSIN::param('blast_shards')." $spacer_fasta_file $db_name $search_file_name -c ".VICSIN::param('num_threads')." -f $combined_fasta_file_name -b ".VICSIN::param('blastn').
+		" -- -task blastn-short -outfmt '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen btop' -max_target_seqs 1000000".
+		" -evalue ".($max_evalue*$database_size/$smallest)." -dbsize $database_size");
+	VH_helpers::run_cmd(VICSIN::param('genome_db')." split $search_file_name $genome_map_file_name $query_map_file_name $wdir -s _search.aln -d -l $lengths_file_name -z $database_size -e $max_evalue");
+
+	unlink($combined_fasta_file_name, $genomes_file_name, $lengths_file_name, $query_map_file_name, $search_file_name);
 }
 
 sub get_predictions {
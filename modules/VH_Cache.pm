@@ -0,0 +1,295 @@
+#!/usr/bin/perl
+
+# Result cache for VICSIN Pipeline
+# Copyright 2017 University of Illinois at Urbana-Champaign
+# Author: Joe Leigh <jleigh@illinois.edu>
+
+package VH_Cache;
+
+# Stage outputs are keyed by a SHA-256 of the stage's input files (content, not names), the programs it runs
+#  (their file content, standing in for the tool version) and its parameters.
+# Each run records the key its outputs were made with in a key file, so a stage is only skipped when its outputs
+#  were made from the same inputs and parameters.
+# With cache_dir set, outputs are also kept in cache_dir/<tool>/<key>/ and hard linked (copied across file systems)
+#  into the output tree of any run, of any project, that asks for the same key. Entries are evicted least recently
+#  used first once the cache outgrows cache_max_size GB.
+
+use strict;
+use Digest::SHA;
+use File::Copy qw(copy);
+use File::Find;
+use File::Path qw(make_path rmtree);
+use File::Spec;
+use Fcntl qw(:flock);
+use VICSIN;
+use VH_helpers;
+
+use constant REPORT_FILE => "cache_report.txt";
+# Bump to invalidate every cached entry when the key recipe changes
+use constant KEY_VERSION => 1;
+
+my %digests;
+
+sub enabled {
+	return VICSIN::param('cache_dir') ne '';
+}
+
+# Adds a file, or every file under a directory in name order, to a digest
+sub add_path {
+	my $sha = shift;
+	my $path = shift;
+
+	if(-d $path){
+		my @files;
+		find({'wanted'=>sub { push @files, $File::Find::name if -f $_; },'no_chdir'=>1}, $path);
+		foreach my $file (sort @files){
+			$sha->add(File::Spec->abs2rel($file,$path)."\0");
+			add_path($sha,$file);
+		}
+	} elsif(-f $path){
+		$sha->add(file_digest($path));
+	} else {
+		$sha->add("missing\0");
+	}
+}
+
+sub file_digest {
+	my $path = shift;
+	my @stat = stat($path);
+	my $id = join(':',File::Spec->rel2abs($path),$stat[7],$stat[9]);
+	if(not exists $digests{$id}){
+		$digests{$id} = Digest::SHA->new(256)->addfile($path,'b')->hexdigest;
+	}
+	return $digests{$id};
+}
+
+# The file a program name runs: the name itself if it is a path, otherwise its first match in PATH
+sub program_file {
+	my $program = shift;
+	return $program if $program =~ m/\//;
+	foreach my $dir (File::Spec->path()){
+		return "$dir/$program" if -f "$dir/$program";
+	}
+	return;
+}
+
+# Cache key of a tool run.
+#  inputs: input files or directories
+#  programs: program names or paths the run uses
+#  params: hash of any other values the outputs depend on
+sub key {
+	my $tool = shift;
+	my $inputs = shift;
+	my $programs = shift;
+	my $params = shift;
+
+	my $sha = Digest::SHA->new(256);
+	$sha->add(join("\0",'vicsin-cache',KEY_VERSION,$tool)."\0");
+	foreach my $input (@$inputs){
+		add_path($sha,$input);
+	}
+	foreach my $program (@$programs){
+		my $file = program_file($program);
+		$sha->add(defined $file ? file_digest($file) : "$program\0");
+	}
+	foreach my $k (sort keys %$params){
+		$sha->add("$k=$params->{$k}\0");
+	}
+	return $sha->hexdigest;
+}
+
+# Gives outputs (name => path) for key, recording the key in key_file_name:
+#  'current': the outputs are already there and were made with this key
+#  'hit': the outputs were linked in from the cache
+#  'miss': make_outputs was run; it returns true on success, and its outputs are then added to the cache
+sub run {
+	my $tool = shift;
+	my $prefix = shift;
+	my $key = shift;
+	my $outputs = shift;
+	my $key_file_name = shift;
+	my $make_outputs = shift;
+
+	my $result;
+	if(current($key,$outputs,$key_file_name)){
+		$result = 'current';
+	} else {
+		# Outputs are only valid once their key is written
+		unlink $key_file_name;
+		if(enabled() and fetch($tool,$key,$outputs)){
+			$result = 'hit';
+		} else {
+			$result = 'miss';
+			# A rerun must not write through a hard link into the cache
+			unlink values %$outputs;
+			if($make_outputs->() and not grep { not -f $_ } values %$outputs){
+				store($tool,$key,$outputs) if enabled();
+			} else {
+				report($tool,$prefix,'failed',$key,$outputs);
+				return 'failed';
+			}
+		}
+		open(my $key_fh, '>', $key_file_name);
+		print $key_fh "$key\n";
+		close $key_fh;
+	}
+	report($tool,$prefix,$result,$key,$outputs);
+	return $result;
+}
+
+# Whether the outputs are there and were made with key
+sub current {
+	my $key = shift;
+	my $outputs = shift;
+	my $key_file_name = shift;
+	return (read_key($key_file_name) eq $key and not grep { not -f $_ } values %$outputs);
+}
+
+# Whether run would give the outputs without making them (they are current, or cached), touching nothing
+sub available {
+	my $tool = shift;
+	my $key = shift;
+	my $outputs = shift;
+	my $key_file_name = shift;
+	return (current($key,$outputs,$key_file_name) or (enabled() and -d entry_dir($tool,$key)));
+}
+
+sub read_key {
+	my $key_file_name = shift;
+	open(my $key_fh, '<', $key_file_name) or return '';
+	my $key = <$key_fh>;
+	close $key_fh;
+	chomp $key if defined $key;
+	return defined $key ? $key : '';
+}
+
+sub entry_dir {
+	my $tool = shift;
+	my $key = shift;
+	return VICSIN::param('cache_dir')."/$tool/$key";
+}
+
+# Links a file into place, copying it if the link fails (e.g. across file systems)
+sub link_file {
+	my $source = shift;
+	my $destination = shift;
+	unlink $destination;
+	return link($source,$destination) || copy($source,$destination);
+}
+
+sub fetch {
+	my $tool = shift;
+	my $key = shift;
+	my $outputs = shift;
+
+	my $entry = entry_dir($tool,$key);
+	return 0 if not -d $entry;
+	foreach my $name (keys %$outputs){
+		# The entry may be evicted by another run meanwhile
+		return 0 if not link_file("$entry/$name",$outputs->{$name});
+	}
+	# Mark the entry as recently used
+	utime(undef,undef,$entry);
+	return 1;
+}
+
+sub store {
+	my $tool = shift;
+	my $key = shift;
+	my $outputs = shift;
+
+	my $entry = entry_dir($tool,$key);
+	return if -d $entry;
+	# Build the entry under a temporary name, so other runs never see it half written
+	my $temp = "$entry.tmp.$$";
+	make_path($temp);
+	foreach my $name (keys %$outputs){
+		if(not link_file($outputs->{$name},"$temp/$name")){
+			rmtree($temp);
+			return;
+		}
+	}
+	# Another run may have stored the same key first
+	rmtree($temp) if not rename($temp,$entry);
+	evict();
+}
+
+# Removes least recently used entries until the cache fits in cache_max_size GB (0 for no limit)
+sub evict {
+	my $max_bytes = VICSIN::param('cache_max_size') * 1024 * 1024 * 1024;
+	return if $max_bytes <= 0;
+	my $cache_dir = VICSIN::param('cache_dir');
+	open(my $lock_fh, '>>', "$cache_dir/.evict_lock") or return;
+	flock($lock_fh, LOCK_EX);
+
+	my %entries;
+	my $total = 0;
+	opendir(my $cache_dh, $cache_dir);
+	foreach my $tool (grep { !/^\./ and -d "$cache_dir/$_" } readdir($cache_dh)){
+		opendir(my $tool_dh, "$cache_dir/$tool");
+		foreach my $key (grep { !/^\./ and !/\.tmp\./ } readdir($tool_dh)){
+			my $entry = "$cache_dir/$tool/$key";
+			my $size = 0;
+			opendir(my $entry_dh, $entry) or next;
+			foreach my $name (grep { -f "$entry/$_" } readdir($entry_dh)){
+				$size += -s "$entry/$name";
+			}
+			closedir($entry_dh);
+			$entries{$entry} = [(stat($entry))[9],$size];
+			$total += $size;
+		}
+		closedir($tool_dh);
+	}
+	closedir($cache_dh);
+
+	foreach my $entry (sort { $entries{$a}[0] <=> $entries{$b}[0] } keys %entries){
+		last if $total <= $max_bytes;
+		rmtree($entry);
+		$total -= $entries{$entry}[1];
+		VH_helpers::log("\tEvicted $entry from the cache",2);
+	}
+	flock($lock_fh, LOCK_UN);
+	close($lock_fh);
+}
+
+# Starts a new hit/miss report for this run
+sub start_report {
+	unlink VICSIN::param('output_path')."/".REPORT_FILE;
+}
+
+# Appends one line per stage output set: tool, genome, result, key, bytes; tasks append from forked processes
+sub report {
+	my $tool = shift;
+	my $prefix = shift;
+	my $result = shift;
+	my $key = shift;
+	my $outputs = shift;
+
+	my $bytes = 0;
+	foreach my $output (values %$outputs){
+		$bytes += -s $output if -f $output;
+	}
+	open(my $report_fh, '>>', VICSIN::param('output_path')."/".REPORT_FILE) or return;
+	print $report_fh join("\t",$tool,$prefix,$result,$key,$bytes)."\n";
+	close($report_fh);
+}
+
+# Logs the hits and misses of each tool in this run's report
+sub log_report {
+	my %counts;
+	open(my $report_fh, '<', VICSIN::param('output_path')."/".REPORT_FILE) or return;
+	while(my $row = <$report_fh>){
+		chomp $row;
+		my ($tool, $prefix, $result, $key, $bytes) = split("\t",$row);
+		$counts{$tool}{$result}++;
+		$counts{$tool}{'hit_bytes'} += $bytes if $result eq 'hit';
+	}
+	close($report_fh);
+	foreach my $tool (sort keys %counts){
+		my $c = $counts{$tool};
+		VH_helpers::log(sprintf("\t%s: %d from cache (%.1f MB), %d run, %d already current, %d failed",$tool,
+			$c->{'hit'} || 0,($c->{'hit_bytes'} || 0)/1048576,$c->{'miss'} || 0,$c->{'current'} || 0,$c->{'failed'} || 0));
+	}
+}
+
+1;
@@ -1,17 +1,29 @@
 #!/usr/bin/perl
 
-# MySQL Database interface module for VICSIN Pipeline
+# Database interface module for VICSIN Pipeline
 # Copyright 2017 University of Illinois at Urbana-Champaign
 # Author: Joe Leigh <jleigh@illinois.edu>
 
 package VH_Database;
 
 use strict;
-use DBI;
+use File::Path qw(make_path);
 use VICSIN;
 use VH_helpers;
 use Data::Dumper;
 
+use constant TABLE_DIR => "Database_Tables";
+
+# Hit tables, with the prediction method each is filled from
+my @hit_tables = (['virsorter','virsorter'],['phispy','phispy'],['agent','agent'],['crispr','crispr'],['homology','blast']);
+
+# One tab delimited row; undefined values are written as \N and tabs/newlines inside values as spaces
+sub tsv_row {
+	return join("\t",map {my $value = $_; defined $value ? do {$value =~ s/[\t\r\n]/ /g; $value} : '\N'} @_)."\n";
+}
+
+# Writes the run, genomes, predictions, merged predictions and clusters as tables for database_loader.py, which loads
+#  them with multi-row INSERTs, one transaction per genome
 sub insert {
 	my $prefixes = shift;
 	my $genomes = shift;
@@ -20,132 +32,87 @@ sub insert {
 	my $binned_predictions = shift;
 	my $clusters = shift;
 
-	my $dbh = DBI->connect("DBI:mysql:database=".VICSIN::param('database_name').";host=".VICSIN::param('database_host').";port=".VICSIN::param('database_port'), VICSIN::param('database_user'), VICSIN::param('database_pass'));
-
 	my $login = getpwuid($<) || "unknown";
 
 	VH_helpers::log("Inserting into database... ");
+	my $table_dir = VICSIN::param('output_path')."/".TABLE_DIR;
+	make_path($table_dir);
+	my %fh;
+	foreach my $table ('run','genomes','scaffolds',(map {$_->[0]} @hit_tables),'rescreen','mge','mge_links','clusters','cluster_core'){
+		open($fh{$table}, '>', "$table_dir/$table.tsv") or die "Could not write $table_dir/$table.tsv";
+	}
+
+	# Run
+	print {$fh{'run'}} tsv_row(VICSIN::param('phispy_windowsize'), VICSIN::param('phispy_threshold'), VICSIN::param('spine_percent_input'), VICSIN::param('spine_max_distance'), VICSIN::param('spine_agent_min_perc_id'), VICSIN::param('spine_agent_min_size_core'), VICSIN::param('spine_core_file'), VICSIN::param('spacer_fasta_file'), VICSIN::param('known_viral_types'), VICSIN::param('virsorter_database'), VICSIN::param('clustering_parameter'), VICSIN::param('reblast_min_perc_id'), VICSIN::param('reblast_min_perc_length'), VICSIN::param('reblast_distance'), VICSIN::param('reblast_edge_distance'), VICSIN::param('cluster_core_congruence'), $login);
 
-	# Insert run
-	my $run_stmt = $dbh->prepare('INSERT INTO runs (date, phispy_windowsize, phispy_threshold, spine_percent_input, spine_max_distance, spine_agent_min_perc_id, spine_agent_min_size_core, spine_core_file, spacer_fasta_file, known_viral_types, virsorter_database, clustering_parameter, reblast_min_perc_id, reblast_min_perc_length, reblast_distance, reblast_edge_distance, cluster_core_congruence, user) values (NOW(),?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)');
-	$run_stmt->execute(VICSIN::param('phispy_windowsize'), VICSIN::param('phispy_threshold'), VICSIN::param('spine_percent_input'), VICSIN::param('spine_max_distance'), VICSIN::param('spine_agent_min_perc_id'), VICSIN::param('spine_agent_min_size_core'), VICSIN::param('spine_core_file'), VICSIN::param('spacer_fasta_file'), VICSIN::param('known_viral_types'), VICSIN::param('virsorter_database'), VICSIN::param('clustering_parameter'), VICSIN::param('reblast_min_perc_id'), VICSIN::param('reblast_min_perc_length'), VICSIN::param('reblast_distance'), VICSIN::param('reblast_edge_distance'), VICSIN::param('cluster_core_congruence'), $login);
-	my $run_id = $run_stmt->{'mysql_insertid'};
-
-	my $genome_stmt = $dbh->prepare('INSERT INTO genomes (run_id,genome,length,scaffolds,genes,input_format,version,definition,accession,dblink,keywords, organism, strain) values (?,?,?,?,?,?,?,?,?,?,?,?,?)');
-	my $scaffold_stmt = $dbh->prepare('INSERT INTO scaffolds (genome_id, name) values (?,?)');
-	my $virsorter_stmt = $dbh->prepare('INSERT INTO virsorter (genome_id,scaffold,start,stop,category,genes_predicted,viral_hallmark_genes,viral_gene_enrich,noncaudovirales_gene_enrich,pfam_depletion,uncharacterized_gene_enrichment,strand_switch_depletion,short_gene_enrichment) values (?,?,?,?,?,?,?,?,?,?,?,?,?)');
-	my $phispy_stmt = $dbh->prepare('INSERT INTO phispy (genome_id,scaffold,start,stop) values (?,?,?,?)');
-	my $agent_stmt = $dbh->prepare('INSERT INTO agent (genome_id, scaffold, start, stop, gc_perc) values (?,?,?,?,?)');
-	my $crispr_stmt = $dbh->prepare('INSERT INTO crispr (genome_id, query, subject, percent_id, gap, mismatch, query_start, query_stop, subject_start, subject_stop, bit, evalue) values (?,?,?,?,?,?,?,?,?,?,?,?)');
-	my $blast_stmt = $dbh->prepare('INSERT INTO homology (genome_id, query, subject, percent_id, gap, mismatch, query_start, query_stop, subject_start, subject_stop, bit, evalue) values (?,?,?,?,?,?,?,?,?,?,?,?)');
-	my $reblast_stmt = $dbh->prepare('INSERT INTO rescreen (genome_id, query, subject, percent_id, gap, mismatch, query_start, query_stop, subject_start, subject_stop, bit, evalue) values (?,?,?,?,?,?,?,?,?,?,?,?)');
-	my $mge_stmt = $dbh->prepare('INSERT INTO mge (genome_id, scaffold, type, start, stop) values (?,?,?,?,?)');
-	my $mge_virsorter_stmt = $dbh->prepare('INSERT IGNORE INTO mge_virsorter (mge_id,virsorter_id) values (?,?)'); 
-	my $mge_phispy_stmt = $dbh->prepare('INSERT IGNORE INTO mge_phispy (mge_id,phispy_id) values (?,?)'); 
-	my $mge_agent_stmt = $dbh->prepare('INSERT IGNORE INTO mge_agent (mge_id,agent_id) values (?,?)');
-	my $mge_crispr_stmt = $dbh->prepare('INSERT IGNORE INTO mge_crispr (mge_id,crispr_id) values (?,?)'); 
-	my $mge_homology_stmt = $dbh->prepare('INSERT IGNORE INTO mge_homology (mge_id,homology_id) values (?,?)'); 
-	my $mge_rescreen_stmt = $dbh->prepare('INSERT IGNORE INTO mge_rescreen (mge_id,rescreen_id) values (?,?)'); 
-	my $cluster_stmt = $dbh->prepare('INSERT INTO clusters (run_id, cluster_id) values (?,?)');
-	my $cluster_core_stmt = $dbh->prepare('INSERT INTO cluster_core (run_id, cluster_id, mge_id, start, stop) values (?,?,?,?,?)');
 	foreach my $prefix (@{$prefixes}){
-		VH_helpers::log("\t".$prefix."... ",1);
-		# Insert genomes
+		# Genomes
 		 # TODO what is `genes`?
-		$genome_stmt->execute($run_id, $genomes->{$prefix}{'name'}, $genomes->{$prefix}{'length'}, $genomes->{$prefix}{'scaffolds'}, $genomes->{$prefix}{'genes'}, $genomes->{$prefix}{'format'}, $genomes->{$prefix}{'version'}, $genomes->{$prefix}{'definition'}, $genomes->{$prefix}{'accession'}, $genomes->{$prefix}{'dblink'}, $genomes->{$prefix}{'keywords'}, $genomes->{$prefix}{'organism'}, $genomes->{$prefix}{'strain'}) or die "execution failed: ".$dbh->errstr();
-		my $genome_id = $genome_stmt->{'mysql_insertid'};
-	
+		print {$fh{'genomes'}} tsv_row($prefix, $genomes->{$prefix}{'name'}, $genomes->{$prefix}{'length'}, $genomes->{$prefix}{'scaffolds'}, $genomes->{$prefix}{'genes'}, $genomes->{$prefix}{'format'}, $genomes->{$prefix}{'version'}, $genomes->{$prefix}{'definition'}, $genomes->{$prefix}{'accession'}, $genomes->{$prefix}{'dblink'}, $genomes->{$prefix}{'keywords'}, $genomes->{$prefix}{'organism'}, $genomes->{$prefix}{'strain'});
+
 		foreach my $sequence (keys %{$sequences->{$prefix}}){
-			# Insert scaffolds
-			$scaffold_stmt->execute($genome_id,$sequence);
+			# Scaffolds
+			print {$fh{'scaffolds'}} tsv_row($prefix, $sequence);
 
 			# TODO Insert masks
 
-			# Insert virsorter hits
-			foreach my $virsorter (@{$predictions->{$prefix}{'virsorter'}{$sequence}}){
-				$virsorter_stmt->execute($genome_id, $sequence, $virsorter->{'start'}, $virsorter->{'end'}, $virsorter->{'category'}, $virsorter->{'genes_predicted'}, $virsorter->{'viral_hallmark_genes'}eq''?0:$virsorter->{'viral_hallmark_genes'}, $virsorter->{'viral_gene_enrich'}, $virsorter->{'noncaudovirales_gene_enrich'}, $virsorter->{'pfam_depletion'}, $virsorter->{'uncharacterized_gene_enrichment'}, $virsorter->{'strand_switch_depletion'}, $virsorter->{'short_gene_enrichment'});
-				$virsorter->{'id'} = $virsorter_stmt->{'mysql_insertid'};
+			# Hits are keyed by sequence:index, the way merged predictions refer to them
+			for(my $i=0; $i<scalar(@{$predictions->{$prefix}{'virsorter'}{$sequence} // []}); $i++){
+				my $virsorter = $predictions->{$prefix}{'virsorter'}{$sequence}[$i];
+				print {$fh{'virsorter'}} tsv_row($prefix, "$sequence:$i", $sequence, $virsorter->{'start'}, $virsorter->{'end'}, $virsorter->{'category'}, $virsorter->{'genes_predicted'}, $virsorter->{'viral_hallmark_genes'}eq''?0:$virsorter->{'viral_hallmark_genes'}, $virsorter->{'viral_gene_enrich'}, $virsorter->{'noncaudovirales_gene_enrich'}, $virsorter->{'pfam_depletion'}, $virsorter->{'uncharacterized_gene_enrichment'}, $virsorter->{'strand_switch_depletion'}, $virsorter->{'short_gene_enrichment'});
 			}
-
-			# Insert phispy hits
-			foreach my $phispy (@{$predictions->{$prefix}{'phispy'}{$sequence}}){
-				$phispy_stmt->execute($genome_id, $sequence, $phispy->{'start'}, $phispy->{'end'});
-				$phispy->{'id'} = $phispy_stmt->{'mysql_insertid'};
-			}
-
-			# Insert agent hits
-			foreach my $agent (@{$predictions->{$prefix}{'agent'}{$sequence}}){
-				$agent_stmt->execute($genome_id, $sequence, $agent->{'start'}, $agent->{'end'}, $agent->{'gc'});
-				$agent->{'id'} = $agent_stmt->{'mysql_insertid'};
+			for(my $i=0; $i<scalar(@{$predictions->{$prefix}{'phispy'}{$sequence} // []}); $i++){
+				my $phispy = $predictions->{$prefix}{'phispy'}{$sequence}[$i];
+				print {$fh{'phispy'}} tsv_row($prefix, "$sequence:$i", $sequence, $phispy->{'start'}, $phispy->{'end'});
 			}
-
-			# Insert crispr hits
-			foreach my $crispr (@{$predictions->{$prefix}{'crispr'}{$sequence}}){
-				$crispr_stmt->execute($genome_id, $crispr->{'query'}, $sequence, $crispr->{'perc_id'}, $crispr->{'gap'}, $crispr->{'mismatch'}, $crispr->{'query_start'}, $crispr->{'query_stop'}, $crispr->{'start'}, $crispr->{'end'}, $crispr->{'bit'}, $crispr->{'evalue'});
-				$crispr->{'id'} = $crispr_stmt->{'mysql_insertid'};
+			for(my $i=0; $i<scalar(@{$predictions->{$prefix}{'agent'}{$sequence} // []}); $i++){
+				my $agent = $predictions->{$prefix}{'agent'}{$sequence}[$i];
+				print {$fh{'agent'}} tsv_row($prefix, "$sequence:$i", $sequence, $agent->{'start'}, $agent->{'end'}, $agent->{'gc'});
 			}
-
-			# Insert blast hits
-			foreach my $blast (@{$predictions->{$prefix}{'blast'}{$sequence}}){
-				$blast_stmt->execute($genome_id, $blast->{'query'}, $sequence, $blast->{'perc_id'}, $blast->{'gap'}, $blast->{'mismatch'}, $blast->{'query_start'}, $blast->{'query_stop'}, $blast->{'start'}, $blast->{'end'}, $blast->{'bit'}, $blast->{'evalue'}) or die "execution failed: ".$dbh->errstr();
-				$blast->{'id'} = $blast_stmt->{'mysql_insertid'};
+			foreach my $table (['crispr','crispr'],['homology','blast']){
+				my ($table_name, $method) = @{$table};
+				for(my $i=0; $i<scalar(@{$predictions->{$prefix}{$method}{$sequence} // []}); $i++){
+					my $hit = $predictions->{$prefix}{$method}{$sequence}[$i];
+					print {$fh{$table_name}} tsv_row($prefix, "$sequence:$i", $hit->{'query'}, $sequence, $hit->{'perc_id'}, $hit->{'gap'}, $hit->{'mismatch'}, $hit->{'query_start'}, $hit->{'query_stop'}, $hit->{'start'}, $hit->{'end'}, $hit->{'bit'}, $hit->{'evalue'});
+				}
 			}
 		}
-		# TODO fix reblast predictions insertion
-		# # Insert reblast hits
-		# foreach my $reblast (@{$reblast_predictions->{$prefix}}){
-		# 	$reblast_stmt->execute($genome_id, $reblast->{'query_seq'}, $reblast->{'sequence'}, $reblast->{'perc_identity'}, $reblast->{'gap'}, $reblast->{'mismatch'}, $reblast->{'query_start'}, $reblast->{'query_stop'}, $reblast->{'start'}, $reblast->{'end'}, $reblast->{'bit'}, $reblast->{'evalue'}) or die "database insert failed: ".$dbh->errstr()."\n".Dumper($reblast);
-		# 	$reblast->{'id'} = $reblast_stmt->{'mysql_insertid'};
-		# }
-
-		# Insert merged predictions
+		# TODO fix reblast predictions insertion (rescreen.tsv is left empty)
+
+		# Merged predictions, keyed by bin:index, and the hits they were merged from
 		for (my $bin=0; $bin<4; $bin++){
-			foreach my $prediction (@{$binned_predictions->{$prefix}[$bin]}){
+			for(my $i=0; $i<scalar(@{$binned_predictions->{$prefix}[$bin]}); $i++){
+				my $prediction = $binned_predictions->{$prefix}[$bin][$i];
 				if(not exists $prediction->{'masked'}){
-					$mge_stmt->execute($genome_id,$prediction->{'sequence'},$bin+1,$prediction->{'start'},$prediction->{'end'}) or die "database insert failed: ".$dbh->errstr()."\nOffending entry: \n".Dumper($prediction);
-					my $mge_id = $mge_stmt->{'mysql_insertid'};
-					$prediction->{'id'} = $mge_id;
-					foreach my $virsorter_index (@{$prediction->{'virsorter'}}){
-						$mge_virsorter_stmt->execute($mge_id,$predictions->{$prefix}{'virsorter'}{$prediction->{'sequence'}}[$virsorter_index]{'id'});
-					}
-					foreach my $phispy_index (@{$prediction->{'phispy'}}){
-						$mge_phispy_stmt->execute($mge_id,$predictions->{$prefix}{'phispy'}{$prediction->{'sequence'}}[$phispy_index]{'id'});
-					}
-					foreach my $agent_index (@{$prediction->{'agent'}}){
-						$mge_agent_stmt->execute($mge_id,$predictions->{$prefix}{'agent'}{$prediction->{'sequence'}}[$agent_index]{'id'});
+					print {$fh{'mge'}} tsv_row($prefix, "$bin:$i", $prediction->{'sequence'}, $bin+1, $prediction->{'start'}, $prediction->{'end'});
+					foreach my $hit_table (@hit_tables){
+						my ($table_name, $method) = @{$hit_table};
+						foreach my $index (@{$prediction->{$method}}){
+							print {$fh{'mge_links'}} tsv_row($prefix, "$bin:$i", $table_name, $prediction->{'sequence'}.":$index");
+						}
 					}
-					foreach my $crispr_index (@{$prediction->{'crispr'}}){
-						$mge_crispr_stmt->execute($mge_id,$predictions->{$prefix}{'crispr'}{$prediction->{'sequence'}}[$crispr_index]{'id'});
-					}
-					foreach my $homology_index (@{$prediction->{'blast'}}){
-						$mge_homology_stmt->execute($mge_id,$predictions->{$prefix}{'blast'}{$prediction->{'sequence'}}[$homology_index]{'id'});
-					}
-					# TODO fix reblast insertion
-					# foreach my $rescreen_index (@{$prediction->{'reblast'}}){
-					# 	$mge_rescreen_stmt->execute($mge_id,$reblast_predictions->{$prefix}[$rescreen_index]{'id'});
-					# }
 				}
 			}
 		}
 	}
-	# Insert Clusters
-	VH_helpers::log("\tClusters...",1,0);
+	# Clusters
 	for(my $cluster=0; $cluster<scalar(@{$clusters}); $cluster++){
-		$cluster_stmt->execute($run_id,$cluster);
-		for(my $sequence=0; $sequence<scalar(@{$clusters->[$cluster]}); $sequence++){
-			my $mge = $binned_predictions->{$clusters->[$cluster][$sequence]{'prefix'}}[$clusters->[$cluster][$sequence]{'bin'}][$clusters->[$cluster][$sequence]{'index'}];
-			if(exists $mge->{'id'}){
-				my $mge_id = $mge->{'id'};
-				foreach my $core (@{$clusters->[$cluster][$sequence]{'core'}}){
-					if(not exists $core->{'stop'}){
-						print $cluster."\n".Dumper($clusters->[$cluster][$sequence]);
-					}
-					$cluster_core_stmt->execute($run_id,$cluster,$mge_id,$core->{'start'},$core->{'stop'});
-				}
+		print {$fh{'clusters'}} tsv_row($cluster);
+		foreach my $member (@{$clusters->[$cluster]}){
+			foreach my $core (@{$member->{'core'}}){
+				print {$fh{'cluster_core'}} tsv_row($cluster, $member->{'prefix'}, $member->{'bin'}.":".$member->{'index'}, $core->{'start'}, $core->{'stop'});
 			}
 		}
 	}
+	foreach my $table (keys %fh){
+		close $fh{$table};
+	}
 
+	# The password goes through the environment rather than the command line
+	local $ENV{'VICSIN_DATABASE_PASS'} = VICSIN::param('database_pass');
+	my $result = VH_helpers::run_cmd(VICSIN::param('database_loader')." $table_dir ".VICSIN::param('database_name')." -d ".VICSIN::param('database_backend')." --host '".VICSIN::param('database_host')."' --port ".VICSIN::param('database_port')." --user '".VICSIN::param('database_user')."'");
+	die "Database load failed (exit status ".($? >> 8)."):\n$result" if $? != 0;
+	VH_helpers::log($result,1);
 }
 
 1;
\ No newline at end of file
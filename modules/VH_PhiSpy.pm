@@ -9,6 +9,7 @@ package VH_PhiSpy;
 use File::Path qw(make_path);
 use VICSIN;
 use VH_helpers;
+use VH_Cache;
 
 no define CONVERTED_INPUT_DIR =>;
 use constant PHISPY_DIR => "PhiSpy_Runs";
@@ -18,36 +19,50 @@ sub run {
 
 	VH_helpers::log("Starting PhiSpy runs...");
 	foreach(@$prefixes) {
-		my $seed_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/_SEED_$_";
-		my $phispy_dir_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_";
-
-		my $tbl_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/prophage.tbl";
-		my $lock_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/${_}_PhiSpy_lock";
-		my $log_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/log.txt";
-		make_path($phispy_dir_name);
-
-		# Check for lockfile to determine if phispy already complete
-		if (-f $tbl_file_name and not -f $lock_file_name) {
-			VH_helpers::log("\t$_ PhiSpy already completed. Skipping.",1);
-		} else {
-			VH_helpers::log("\tRunning PhiSpy for $_... ",1);
-			# Create a lockfile to signify that the CRISPR run is in progress
-			open(my $lockfh, '>', $lock_file_name);
-			say $lockfh "$$";
-			close $lockfh;
-
-			VH_helpers::run_cmd("python ".VICSIN::param('phispy')." -i $seed_file_name -n ".VICSIN::param('phispy_threshold')." -o $phispy_dir_name -w ".VICSIN::param('phispy_windowsize')." 2>&1 >$log_file_name");
-
-			VH_helpers::clean_folder($phispy_dir_name,[$tbl_file_name,$log_file_name]);
-			if ($? == 0){
-			} else {
-				VH_helpers::log("PhiSpy returned an error on $_.");
-			}
-		}
+		run_one($_);
 	}
 	print "\n";
 }
 
+# Runs PhiSpy on a single genome
+sub run_one {
+	local $_ = shift;
+
+	my $seed_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/_SEED_$_";
+	my $phispy_dir_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_";
+
+	my $tbl_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/prophage.tbl";
+	my $lock_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/${_}_PhiSpy_lock";
+	my $log_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/log.txt";
+	my $key_file_name = VICSIN::param("output_path")."/".PHISPY_DIR."/$_/${_}_PhiSpy_key";
+	make_path($phispy_dir_name);
+
+	my $key = VH_Cache::key('phispy',[$seed_file_name],[VICSIN::param('phispy')],
+		{'phispy_threshold'=>VICSIN::param('phispy_threshold'),'phispy_windowsize'=>VICSIN::param('phispy_windowsize')});
+	my $prefix = $_;
+	my $result = VH_Cache::run('phispy',$prefix,$key,{'prophage.tbl'=>$tbl_file_name},$key_file_name,sub {
+		VH_helpers::log("\tRunning PhiSpy for $prefix... ",1);
+		# Create a lockfile to signify that the PhiSpy run is in progress
+		open(my $lockfh, '>', $lock_file_name);
+		say $lockfh "$$";
+		close $lockfh;
+
+		VH_helpers::run_cmd("python ".VICSIN::param('phispy')." -i $seed_file_name -n ".VICSIN::param('phispy_threshold')." -o $phispy_dir_name -w ".VICSIN::param('phispy_windowsize')." 2>&1 >$log_file_name");
+		my $status = $?;
+
+		VH_helpers::clean_folder($phispy_dir_name,[$tbl_file_name,$log_file_name,$key_file_name]);
+		if ($status != 0){
+			VH_helpers::log("PhiSpy returned an error on $prefix.");
+		}
+		return $status == 0;
+	});
+	if($result eq 'current'){
+		VH_helpers::log("\t$_ PhiSpy already completed. Skipping.",1);
+	} elsif($result eq 'hit'){
+		VH_helpers::log("\t$_ PhiSpy results found in cache.",1);
+	}
+}
+
 sub get_predictions {
 	my $prefix = shift(@_);
 
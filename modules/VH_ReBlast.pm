@@ -7,7 +7,6 @@
 package VH_ReBlast;
 
 use File::Path qw(make_path);
-use List::Util qw(reduce);
 use VICSIN;
 use VH_helpers;
 
@@ -16,6 +15,97 @@ use Data::Dumper;
 no define CONVERTED_INPUT_DIR =>;
 use constant REBLAST_DIR => "ReBlast_Runs";
 
+# Blasts the other genomes' predictions against one genome
+sub run_pairwise {
+	my $curprefix = shift;
+	my $prefixes = shift;
+	my $predictions = shift;
+	my $br_file_name = shift;
+
+	# Generate fasta file with predictions to query against
+	VH_helpers::log("\t\tGenerating fasta file for re-blast... ",2);
+	my $query_fasta_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-query.fna";
+	my $regions_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-query.regions";
+	open(my $regionsfh, '>', $regions_file_name) or die "Could not truncate query regions file.";
+	foreach my $prefix (@{$prefixes}){
+		if($curprefix ne $prefix){
+			my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$prefix.fna";
+			for (my $bin = 0; $bin < 2; $bin++) {
+				foreach my $prediction (@{$predictions->{$prefix}[$bin]}){
+					if ($prediction->{'end'}-$prediction->{'start'}>=VICSIN::param('reblast_min_contig_length')){
+						print $regionsfh join("\t",$fasta_file_name,$prediction->{'sequence'},$prediction->{'start'},$prediction->{'end'}-1,$prediction->{'name'})."\n";
+					}
+				}
+			}
+		}
+	}
+	close($regionsfh);
+	VH_helpers::run_cmd(VICSIN::param('fasta_index')." extract $regions_file_name $query_fasta_file_name -g");
+	unlink($regions_file_name);
+
+	# Re-blast predictions against all prefixes
+	my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$curprefix.fna";
+	
+	# Run blastn
+	VH_helpers::log("\t\tRunning blastn... ",2);
+	VH_helpers::run_cmd(VICSIN::param('blastn')." -query $query_fasta_file_name -subject $fasta_file_name -outfmt 6 -out $br_file_name");
+	
+	# Delete fasta file (it's huge)
+	unlink($query_fasta_file_name);
+}
+
+# Blasts every genome's predictions against a single database of all genomes, splitting the hits into
+#  one .br file per genome with each genome's own predictions left out.
+# The search runs with the combined length as -dbsize and an E-value cutoff loosened for the smallest genome; each hit's
+#  E-value is then rescaled to its own genome's length and cut at blastn's default of 10, as in pairwise mode.
+sub run_database {
+	my $prefixes = shift;
+	my $predictions = shift;
+
+	VH_helpers::log("\tGenerating fasta file and database for re-blast... ",1);
+	my $wdir = VICSIN::param("output_path")."/".REBLAST_DIR;
+	my $query_fasta_file_name = "$wdir/all-query.fna";
+	my $regions_file_name = "$wdir/all-query.regions";
+	my $query_map_file_name = "$wdir/all-query.map";
+	my $genomes_file_name = "$wdir/all-genomes.tbl";
+	my $combined_fasta_file_name = "$wdir/all-genomes.fna";
+	my $genome_map_file_name = "$wdir/all-genomes.map";
+	my $lengths_file_name = "$wdir/all-genomes.lengths";
+	my $db_name = "$wdir/all-genomes_db";
+	my $blast_file_name = "$wdir/all.br";
+	my $max_evalue = 10;
+
+	open(my $regionsfh, '>', $regions_file_name) or die "Could not truncate query regions file.";
+	open(my $querymapfh, '>', $query_map_file_name);
+	open(my $genomesfh, '>', $genomes_file_name);
+	foreach my $prefix (@{$prefixes}){
+		my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$prefix.fna";
+		print $genomesfh "$prefix\t$fasta_file_name\n";
+		for (my $bin = 0; $bin < 2; $bin++) {
+			foreach my $prediction (@{$predictions->{$prefix}[$bin]}){
+				if ($prediction->{'end'}-$prediction->{'start'}>=VICSIN::param('reblast_min_contig_length')){
+					print $regionsfh join("\t",$fasta_file_name,$prediction->{'sequence'},$prediction->{'start'},$prediction->{'end'}-1,$prediction->{'name'})."\n";
+					print $querymapfh $prediction->{'name'}."\t$prefix\n";
+				}
+			}
+		}
+	}
+	close($regionsfh);
+	close($querymapfh);
+	close($genomesfh);
+	VH_helpers::run_cmd(VICSIN::param('fasta_index')." extract $regions_file_name $query_fasta_file_name -g");
+	VH_helpers::run_cmd(VICSIN::param('genome_db')." build $genomes_file_name $combined_fasta_file_name $genome_map_file_name -l $lengths_file_name");
+	VH_helpers::run_cmd(VICSIN::param('makeblastdb')." -in $combined_fasta_file_name -parse_seqids -dbtype nucl -out $db_name");
+	my ($database_size, $smallest) = VH_helpers::genome_db_sizes($lengths_file_name);
+
+	VH_helpers::log("\tRunning blastn... ",1);
+	VH_helpers::run_cmd(VICSIN::param('blast_shards')." $query_fasta_file_name $db_name $blast_file_name -c ".VICSIN::param('num_threads')." -f $combined_fasta_file_name -b ".VICSIN::param('blastn').
+		" -- -max_target_seqs 1000000 -outfmt 6 -evalue ".($max_evalue*$database_size/$smallest)." -dbsize $database_size");
+	VH_helpers::run_cmd(VICSIN::param('genome_db')." split $blast_file_name $genome_map_file_name $query_map_file_name $wdir -s .br -l $lengths_file_name -z $database_size -e $max_evalue");
+
+	unlink($regions_file_name, $query_fasta_file_name, $combined_fasta_file_name, $genomes_file_name, $lengths_file_name);
+}
+
 sub run {
 	# TODO redo this function to do one prefix at a time, not all together
 	my $prefixes = shift;
@@ -28,74 +118,17 @@ sub run {
 
 	VH_helpers::log("Starting blastn against predictions...");
 	make_path(VICSIN::param("output_path")."/".REBLAST_DIR);
+	my $database_mode = (VICSIN::param('reblast_mode') eq 'database');
+	if($database_mode){
+		run_database($prefixes,$predictions);
+	}
 	foreach my $curprefix (@$prefixes){
 		VH_helpers::log("\tRunning re-blast for $curprefix...",1);
-		# Generate fasta file with predictions to query against
-		VH_helpers::log("\t\tGenerating fasta file for re-blast... ",2);
-		my $query_fasta_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-query.fna";
-		open(my $queryfh, '>', $query_fasta_file_name) or die "Could not truncate query file.";
-		my %query_lengths;
-		foreach my $prefix (@{$prefixes}){
-			if($curprefix ne $prefix){
-				my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$prefix.fna";
-				open(my $fastafh, '<', $fasta_file_name) or die "Could not open fasta file.";
-				my $seqname = "";
-				my $sequence = "";
-				
-				while (my $row = <$fastafh>) {
-					chomp $row;
-					if(substr($row,0,1) eq '>'){
-						if($seqname ne ""){
-							# Grab predictions from sequence
-							my $predCount = 1;
-							for (my $bin = 0; $bin < 2; $bin++) {
-								foreach my $prediction (@{$predictions->{$prefix}[$bin]}){
-									if ($seqname eq $prediction->{'sequence'} and $prediction->{'end'}-$prediction->{'start'}>=VICSIN::param('reblast_min_contig_length')){
-										print $queryfh '>'.$prediction->{'name'}."\n";
-										print $queryfh substr($sequence,$prediction->{'start'}-1,$prediction->{'end'}-$prediction->{'start'})."\n";
-										$query_lengths{$prediction->{'name'}} = $prediction->{'end'}-$prediction->{'start'}+1;
-										$predCount++;
-									}
-								}
-							}
-						}
-						$seqname = substr($row,1);
-						$sequence = "";
-					} else {
-						if($seqname ne ""){
-							$sequence .= $row;
-						}
-					}
-				}
-
-				# One more time to parse the final sequence
-				if($seqname ne ""){
-					# Grab predictions from sequence
-					my $predCount = 1;
-					for (my $bin = 0; $bin < 2; $bin++) {
-						foreach my $prediction (@{$predictions->{$prefix}[$bin]}){
-							if ($seqname eq $prediction->{'sequence'}){
-								print $queryfh '>'.$prediction->{'name'}."\n";
-								print $queryfh substr($sequence,$prediction->{'start'}-1,$prediction->{'end'}-$prediction->{'start'})."\n";
-								$query_lengths{$prediction->{'name'}} = $prediction->{'end'}-$prediction->{'start'}+1;
-								$predCount++;
-							}
-						}
-					}
-				}
-			}
-		}
-
-		# Re-blast predictions against all prefixes
-		my $fasta_file_name = VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$curprefix.fna";
+		VH_helpers::trace_context($curprefix);
 		my $br_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix.br";
-		
-		# Run blastn
-		VH_helpers::log("\t\tRunning blastn... ",2);
-		VH_helpers::run_cmd(VICSIN::param('blastn')." -query $query_fasta_file_name -subject $fasta_file_name -outfmt 6 -out $br_file_name");
-		
-		# Delete fasta file (it's huge)
-		unlink($query_fasta_file_name);
+		if(not $database_mode){
+			run_pairwise($curprefix,$prefixes,$predictions,$br_file_name);
+		}
 
 		# Parse Results
 		VH_helpers::log("\t\tParsing blast output... ",2);
@@ -127,55 +160,25 @@ sub run {
 		# Mask results w/ masking file
 		if(exists $masks->{$curprefix}){
 			VH_helpers::log("\t\tApplying mask file... ",2);
-			foreach my $sequence ( keys %{$masks->{$curprefix}} ){
-				foreach my $mask (@{$masks->{$curprefix}{$sequence}} ){
-					foreach my $prediction (@blast_predictions){
-						if($prediction->{'sequence'} eq $sequence){
-							if($mask->{'start'}<=$prediction->{'start'} and $mask->{'end'}>=$prediction->{'end'}){
-								# Prediction entirely contained within mask; ignore prediction
-								$prediction->{'masked'} = 1;
-							} elsif ($mask->{'start'}<=$prediction->{'start'} and $mask->{'end'}>=$prediction->{'start'}){
-								# Prediction's left side overlaps mask; trim left side
-								$prediction->{'start'} = $mask->{'end'}+1;
-							} elsif ($mask->{'start'}<=$prediction->{'end'} and $mask->{'end'}>=$prediction->{'end'}){
-								# Prediction's right side overlaps mask; trim right side
-								$prediction->{'end'} = $mask->{'start'}-1;
-							} elsif ($mask->{'start'}>$prediction->{'start'} and $mask->{'end'}<$prediction->{'end'} and not exists $prediction->{'masked'}){
-								# Prediction contains a masked area within it; set to ignore prediction
-								$prediction->{'masked'} = 1;
-							}
-						}
-					}
+			foreach my $prediction (@blast_predictions){
+				if(exists $masks->{$curprefix}{$prediction->{'sequence'}}){
+					VICSIN::mask_prediction($masks->{$curprefix}{$prediction->{'sequence'}},$prediction);
 				}
 			}
 		}
 
-
 		# Mask results w/ previous predictions
 		VH_helpers::log("\t\tMasking previous predictions... ",2);
-		foreach my $prefix ( @{$prefixes} ){
-			if($curprefix eq $prefix){
-				for (my $bin = 0; $bin < 4; $bin++) {
-					foreach my $mask (@{$predictions->{$prefix}[$bin]}){
-						foreach my $prediction (@blast_predictions){
-							if($prediction->{'sequence'} eq $mask->{'sequence'}){
-								if($mask->{'start'}<=$prediction->{'start'} and $mask->{'end'}>=$prediction->{'end'}){
-									# Prediction entirely contained within mask; ignore prediction
-									$prediction->{'masked'} = 1;
-								} elsif ($mask->{'start'}<=$prediction->{'start'} and $mask->{'end'}>=$prediction->{'start'}){
-									# Prediction's left side overlaps mask; trim left side
-									$prediction->{'start'} = $mask->{'end'}+1;
-								} elsif ($mask->{'start'}<=$prediction->{'end'} and $mask->{'end'}>=$prediction->{'end'}){
-									# Prediction's right side overlaps mask; trim right side
-									$prediction->{'end'} = $mask->{'start'}-1;
-								} elsif ($mask->{'start'}>$prediction->{'start'} and $mask->{'end'}<$prediction->{'end'} and not exists $prediction->{'masked'}){
-									# Prediction contains a masked area within it; set to ignore prediction
-									$prediction->{'masked'} = 1;
-								}
-							}
-						}
-					}
-				}
+		my %prediction_masks;
+		for (my $bin = 0; $bin < 4; $bin++) {
+			foreach my $mask (@{$predictions->{$curprefix}[$bin]}){
+				push @{$prediction_masks{$mask->{'sequence'}}}, {'start'=>$mask->{'start'},'end'=>$mask->{'end'}};
+			}
+		}
+		VICSIN::index_masks(\%prediction_masks);
+		foreach my $prediction (@blast_predictions){
+			if(not exists $prediction->{'masked'} and exists $prediction_masks{$prediction->{'sequence'}}){
+				VICSIN::mask_prediction($prediction_masks{$prediction->{'sequence'}},$prediction);
 			}
 		}
 
@@ -198,30 +201,29 @@ sub run {
 			}
 		}
 
+		# Save hits and contig lengths for the coverage and extension steps
+		my $hits_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-hits.tbl";
+		my $contigs_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-contigs.tbl";
+		open(my $hits_fh, '>', $hits_file_name);
+		foreach my $hit (@masked_predictions){
+			print $hits_fh join("\t",$hit->{'sequence'},$hit->{'start'},$hit->{'end'},$hit->{'perc_identity'})."\n";
+		}
+		close($hits_fh);
+		open(my $contigs_fh, '>', $contigs_file_name);
+		foreach my $contig (keys(%{$contigs->{$curprefix}})) {
+			print $contigs_fh join("\t",$contig,$contigs->{$curprefix}{$contig}{'length'})."\n";
+		}
+		close($contigs_fh);
+
 		# For each R hit
 		VH_helpers::log("\t\tChecking each contig for full coverage...",2);
-		foreach my $contig (keys(%{$contigs->{$curprefix}})) {
+		my $coverage_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-coverage.tbl";
+		VH_helpers::run_cmd(VICSIN::param('contig_coverage')." $hits_file_name $contigs_file_name $coverage_file_name");
+		open(my $coverage_fh, '<', $coverage_file_name);
+		while(my $row = <$coverage_fh>){
+			chomp $row;
+			my ($contig, $coverage) = split "\t", $row;
 			# If hits cover 90% of entire contig
-			my @histogram = [];
-			for(my $i=0; $i<$contigs->{$curprefix}{$contig}{'length'}; $i++){
-				$histogram[$i] = 0;
-			}
-			for (my $i=0; $i<scalar(@masked_predictions); $i++){
-				if($masked_predictions[$i]{'sequence'} eq $contig){
-					my $start, $end;
-					if($masked_predictions[$i]{'start'} < $masked_predictions[$i]{'end'}){
-						$start = $masked_predictions[$i]{'start'};
-						$end = $masked_predictions[$i]{'end'};
-					} else {
-						$start = $masked_predictions[$i]{'end'};
-						$end = $masked_predictions[$i]{'start'};
-					}
-					for(my $j=$start; $j<=$end; $j++){
-						$histogram[$j] = 1;
-					}
-				}
-			}
-			my $coverage = reduce {$a+$b} @histogram;
 			VH_helpers::log("\t\t\tContig $contig coverage: ".$coverage." out of ".($contigs->{$curprefix}{$contig}{'length'}),2);
 			if($coverage >= $contigs->{$curprefix}{$contig}{'length'} * 0.9 ) {
 				# Add entire contig as prediction to bin 2?3?
@@ -232,100 +234,38 @@ sub run {
 				$predCount{$contig}++;
 			}
 		}
+		close($coverage_fh);
+		unlink($coverage_file_name);
 
 		VH_helpers::log("\t\tChecking each existing consensus prediction for extension by ReBLAST hit...",2);
-		#For each prediction P:
+		# Extension and edge snapping are done by reblast_extend, which indexes the hits of each contig
+		my $extend_in_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-predictions.tbl";
+		my $extend_out_file_name = VICSIN::param("output_path")."/".REBLAST_DIR."/$curprefix-extended.tbl";
+		open(my $extend_in_fh, '>', $extend_in_file_name);
 		for (my $bin = 0; $bin <= 3; $bin++) {
-			foreach my $prediction (@{$predictions->{$curprefix}[$bin]}){
-				my $did_extend = 0;
-				my $set_method = (index($prediction->{'methods'}, 'R') != -1);
-				# Find any non end-adjacent overlapping hits
-				do {
-					my @overlaps = ();
-					# For each hit R:
-					for (my $i=0; $i<scalar(@masked_predictions); $i++){
-						# %id and %length must be above thresholds
-						if($masked_predictions[$i]{'sequence'} eq $prediction->{'sequence'}
-							and $masked_predictions[$i]{'perc_identity'} >= VICSIN::param('reblast_min_perc_id')
-							and abs($masked_predictions[$i]{'end'}-$masked_predictions[$i]{'start'})>=(VICSIN::param("reblast_min_perc_length")/100.0)*$query_lengths{$prediction->{'query_seq'}}){
-							# if R overlaps P, add R to list of extenders
-							my $start, $end;
-							if($masked_predictions[$i]{'start'} < $masked_predictions[$i]{'end'}){
-								$start = $masked_predictions[$i]{'start'};
-								$end = $masked_predictions[$i]{'end'};
-							} else {
-								$start = $masked_predictions[$i]{'end'};
-								$end = $masked_predictions[$i]{'start'};
-							}
-							# check for hit overlapping one or more ends, not totally contained
-							if( $end>$prediction->{'start'}-VICSIN::param('reblast_distance') 
-								and $start<$prediction->{'end'}+VICSIN::param('reblast_distance') 
-								and not ($start>=$prediction->{'start'}-VICSIN::param('reblast_distance') and $end<=$prediction->{'end'}+VICSIN::param('reblast_distance')) ){
-								push @overlaps, $masked_predictions[$i];
-							}
-						}
-					}
-					if(scalar(@overlaps)>0){
-						$did_extend = 1;
-						# Find largest extender
-						my $maxlength = 0;
-						my $largestextender;
-						for (my $i=0; $i<scalar(@overlaps); $i++){
-							if( abs($overlaps[$i]{'start'}-$overlaps[$i]{'end'})+1 >= $maxlength ){
-								$maxlength = abs($overlaps[$i]{'start'}-$overlaps[$i]{'end'});
-								$largestextender = $overlaps[$i];
-							}
-						}
-						# Extend P with largest extender
-						if($prediction->{'start'}>$largestextender->{'start'}){
-							$prediction->{'start'} = $largestextender->{'start'};
-						}
-						if($prediction->{'end'}<$largestextender->{'end'}){
-							$prediction->{'end'} = $largestextender->{'end'};
-						}
-						
-						if(not $set_method){
-							$prediction->{'methods'} = $prediction->{'methods'}.",R";
-							$set_method = 1;
-						}
-					} else {
-						$did_extend = 0;
-					}
-				} while ($did_extend); # While still something to extend with
+			for (my $pindex=0; $pindex<scalar(@{$predictions->{$curprefix}[$bin]}); $pindex++){
+				my $prediction = $predictions->{$curprefix}[$bin][$pindex];
+				print $extend_in_fh join("\t","$bin:$pindex",$prediction->{'sequence'},$prediction->{'start'},$prediction->{'end'})."\n";
+			}
+		}
+		close($extend_in_fh);
 
-				# One more pass to find edge-adjacent hits which overlap the now fully-extended prediction
-				for(my $i=0; $i<scalar(@masked_predictions); $i++){
-					# %id must be above threshold
-					if($masked_predictions[$i]{'sequence'} eq $prediction->{'sequence'}
-						and $masked_predictions[$i]{'perc_identity'} >= VICSIN::param('reblast_min_per_id')){
-						my $start, $end;
-						if($masked_predictions[$i]{'start'} < $masked_predictions[$i]{'end'}){
-							$start = $masked_predictions[$i]{'start'};
-							$end = $masked_predictions[$i]{'end'};
-						} else {
-							$start = $masked_predictions[$i]{'end'};
-							$end = $masked_predictions[$i]{'start'};
-						}
-						# Check if hit spans from prediction to contig end
-						if($start<$prediction->{'end'}+VICSIN::param('reblast_distance') and $end > $contigs->{$curprefix}{$masked_predictions[$i]{'sequence'}}{'length'} - VICSIN::param('reblast_edge_distance')){
-							$prediction->{'end'} = $contigs->{$curprefix}{$masked_predictions[$i]{'sequence'}}{'length'};
-							if(not $set_method){
-								$prediction->{'methods'} = $prediction->{'methods'}.",R";
-								$set_method = 1;
-							}
-						}
-						# Check if hit spans from prediction to contig start
-						if($end>$prediction->{'start'}-VICSIN::param('reblast_distance') and $start < 1 + VICSIN::param('reblast_edge_distance')){
-							$prediction->{'start'} = 1;
-							if(not $set_method){
-								$prediction->{'methods'} = $prediction->{'methods'}.",R";
-								$set_method = 1;
-							}
-						}
-					}
-				}
+		VH_helpers::run_cmd(VICSIN::param('reblast_extend')." $hits_file_name $contigs_file_name $extend_in_file_name $extend_out_file_name -p ".VICSIN::param('reblast_min_perc_id')." -d ".VICSIN::param('reblast_distance')." -e ".VICSIN::param('reblast_edge_distance'));
+
+		open(my $extend_out_fh, '<', $extend_out_file_name);
+		while(my $row = <$extend_out_fh>){
+			chomp $row;
+			my ($id, $start, $end, $changed) = split "\t", $row;
+			my ($bin, $pindex) = split ":", $id;
+			my $prediction = $predictions->{$curprefix}[$bin][$pindex];
+			$prediction->{'start'} = $start;
+			$prediction->{'end'} = $end;
+			if($changed and index($prediction->{'methods'}, 'R') == -1){
+				$prediction->{'methods'} = $prediction->{'methods'}.",R";
 			}
 		}
+		close($extend_out_fh);
+		unlink($hits_file_name, $contigs_file_name, $extend_in_file_name, $extend_out_file_name);
 	}
 	print "\n";
 	return $predictions;
@@ -0,0 +1,107 @@
+#!/usr/bin/perl
+
+# Task scheduler for VICSIN Pipeline
+# Copyright 2017 University of Illinois at Urbana-Champaign
+# Author: Joe Leigh <jleigh@illinois.edu>
+
+package VH_Scheduler;
+
+use strict;
+use IO::Handle;
+use POSIX qw(strftime);
+use Time::HiRes qw(time);
+use VICSIN;
+use VH_helpers;
+
+# Runs a list of tasks in forked children, keeping the cpus of the running tasks within max_cores.
+# Each task is a hash of:
+#  name: unique task name, e.g. "phispy:NC_004663"
+#  cpus: number of cores the task uses (capped at max_cores)
+#  depends: names of tasks that must finish successfully before this one starts
+#  run: code ref doing the work; a task fails if it dies
+# Tasks are started in list order as soon as their dependencies are done and enough cores are free.
+# Returns a hash of task name to 'done', 'failed' or 'skipped' (a dependency failed).
+sub run {
+	my $tasks = shift;
+	my $report_file_name = shift;
+
+	my $max_cores = VICSIN::param('max_cores');
+	$max_cores = 1 if $max_cores < 1;
+	my $free_cores = $max_cores;
+	my @pending = @$tasks;
+	my %running; # pid => task
+	my %status;
+	my %times;
+
+	while(scalar(@pending) > 0 or scalar(keys %running) > 0){
+		# Start every pending task that can run now
+		my @waiting;
+		foreach my $task (@pending){
+			my $cpus = $task->{'cpus'} > $max_cores ? $max_cores : $task->{'cpus'};
+			my @unfinished = grep { not exists $status{$_} or $status{$_} ne 'done' } @{$task->{'depends'}};
+			if(grep { exists $status{$_} } @unfinished){
+				# A dependency failed or was skipped
+				VH_helpers::log("\t$task->{'name'} skipped: dependency did not complete.");
+				$status{$task->{'name'}} = 'skipped';
+			} elsif(scalar(@unfinished) == 0 and $cpus <= $free_cores){
+				my $pid = fork();
+				die "Could not fork for $task->{'name'}" if not defined $pid;
+				if($pid == 0){
+					VH_helpers::trace_context($task->{'name'});
+					my $ok = eval { $task->{'run'}->(); 1; };
+					VH_helpers::log("\t$task->{'name'} failed: $@") if not $ok;
+					# _exit skips the parent's END blocks and destructors, so flush output by hand
+					STDOUT->flush();
+					STDERR->flush();
+					POSIX::_exit($ok ? 0 : 1);
+				}
+				VH_helpers::log("\tStarted $task->{'name'} ($cpus cpus)",2);
+				$running{$pid} = $task;
+				$times{$task->{'name'}} = {'cpus'=>$cpus,'start'=>time()};
+				$free_cores -= $cpus;
+			} else {
+				push @waiting, $task;
+			}
+		}
+		@pending = @waiting;
+
+		# Wait for a task to finish to free its cores
+		if(scalar(keys %running) > 0){
+			my $pid = waitpid(-1, 0);
+			next if not exists $running{$pid};
+			my $task = delete $running{$pid};
+			$status{$task->{'name'}} = ($? == 0) ? 'done' : 'failed';
+			$times{$task->{'name'}}{'end'} = time();
+			$free_cores += $times{$task->{'name'}}{'cpus'};
+			VH_helpers::log("\tFinished $task->{'name'} ($status{$task->{'name'}})",2);
+		} elsif(scalar(@pending) > 0){
+			# Nothing running and nothing startable; only unknown dependencies remain
+			foreach my $task (@pending){
+				VH_helpers::log("\t$task->{'name'} skipped: unknown dependency.");
+				$status{$task->{'name'}} = 'skipped';
+			}
+			@pending = ();
+		}
+	}
+
+	# Save per-task wall times
+	if(defined $report_file_name){
+		open(my $report_fh, '>', $report_file_name);
+		print $report_fh join("\t",'task','cpus','start','end','wall_seconds','status')."\n";
+		foreach my $task (@$tasks){
+			my $name = $task->{'name'};
+			if(exists $times{$name}){
+				print $report_fh join("\t",$name,$times{$name}{'cpus'},
+					strftime("%Y-%m-%d %H:%M:%S",localtime($times{$name}{'start'})),
+					strftime("%Y-%m-%d %H:%M:%S",localtime($times{$name}{'end'})),
+					sprintf("%.2f",$times{$name}{'end'}-$times{$name}{'start'}),$status{$name})."\n";
+			} else {
+				print $report_fh join("\t",$name,0,'','','',$status{$name})."\n";
+			}
+		}
+		close($report_fh);
+	}
+	return \%status;
+}
+
+1;
@@ -30,61 +30,84 @@ sub run {
 	# 	VICSIN::param("spine_core_file") = VICSIN::param("output_path")."/".SPINE_DIR."/output.backbone.fasta";
 	# 	print "\nSpine core file found. Skipping spine.\n";
 	} else {
-		VH_helpers::log("Starting Spine run... ");
-		my $spine_input_file = "spine_input.txt";
-		my $lock_file_name = VICSIN::param("output_path")."/".SPINE_DIR."/spine_lock";
-		make_path(VICSIN::param("output_path")."/".SPINE_DIR);
-		# Generate spine input file from prefixes
-		open(my $spinefh, '>', VICSIN::param('output_path')."/".SPINE_DIR."/".$spine_input_file);
-		foreach(@$prefixes){
-			my $fasta_file_name = File::Spec->rel2abs( VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna");
-			say $spinefh "$fasta_file_name\t$_\tfasta";
-		}
-		close $spinefh;
-		# Create a lockfile to signify that the Spine run is in progress
-		open(my $lockfh, '>', $lock_file_name);
-		say $lockfh "$$";
-		close $lockfh;
-		
-		# Run spine
-		my $wdir = VICSIN::param('output_path').'/'.SPINE_DIR;
-		my $log_file_path = VICSIN::param('output_path').'/'.SPINE_DIR."/log.txt";
-		VH_helpers::run_cmd("cd $wdir; perl ".VICSIN::param('spine')." -f $spine_input_file -p ".VICSIN::param('spine_agent_min_perc_id')." -s ".VICSIN::param('spine_agent_min_size_core')." -a ".VICSIN::param('spine_percent_input')." -g ".VICSIN::param('spine_max_distance')." -t ".VICSIN::param('num_threads')." 2>&1; cd -;");
-		
-		unlink $lock_file_name;
-		VICSIN::setParam("spine_core_file",VICSIN::param("output_path")."/".SPINE_DIR."/output.backbone.fasta");
-
-		print "Done.\n";
+		run_spine($prefixes);
+		VICSIN::setParam("spine_core_file",core_file_name());
 	}
 
 	# For each file:
 	VH_helpers::log("Starting AGEnt runs...");
 	foreach(@$prefixes){
-		my $fasta_file_name = File::Spec->rel2abs( VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna" );
-		my $core_file_name = File::Spec->rel2abs( VICSIN::param("spine_core_file") );
-		my $lock_file_name = VICSIN::param("output_path")."/".AGENT_DIR."/$_/${_}_agent_lock";
-		my $log_file_name = VICSIN::param("output_path")."/".AGENT_DIR."/$_/log.txt";
-		my $wdir = VICSIN::param("output_path")."/".AGENT_DIR."/$_";
-		make_path($wdir);
-
-		if( $core_file_given and -f VICSIN::param("output_path")."/".AGENT_DIR."/$_/AGENT_${_}.AGENT_${_}.accessory.fasta" and not -f $lock_file_name){
-			VH_helpers::log("$_ AGEnt already completed. Skipping.",1);
-		} else {
-			VH_helpers::log("\tRunning AGEnt for $_... ",1);
-			# Create a lockfile to signify that the AGEnt run is in progress
-			open(my $lockfh, '>', $lock_file_name);
-			say $lockfh "$$";
-			close $lockfh;
-			
-			# Run AGEnt
-			VH_helpers::run_cmd("cd $wdir; perl ".VICSIN::param('agent')." -Q F -q $fasta_file_name -R F -r $core_file_name -o AGENT_$_ -m ".VICSIN::param('spine_agent_min_perc_id')." -s ".VICSIN::param('spine_agent_min_size_core')." 2>&1; cd -;");
-
-			unlink $lock_file_name;
-		}
+		run_agent($_,$core_file_given);
 	}
 	print "\n";
 }
 
+# Path of the spine core file AGEnt runs against; the given one, or the one run_spine generates
+sub core_file_name {
+	if (VICSIN::param("spine_core_file") ne ""){
+		return VICSIN::param("spine_core_file");
+	}
+	return VICSIN::param("output_path")."/".SPINE_DIR."/output.backbone.fasta";
+}
+
+# Runs spine on all genomes to generate the core file
+sub run_spine {
+	my $prefixes = shift;
+
+	VH_helpers::log("Starting Spine run... ");
+	my $spine_input_file = "spine_input.txt";
+	my $lock_file_name = VICSIN::param("output_path")."/".SPINE_DIR."/spine_lock";
+	make_path(VICSIN::param("output_path")."/".SPINE_DIR);
+	# Generate spine input file from prefixes
+	open(my $spinefh, '>', VICSIN::param('output_path')."/".SPINE_DIR."/".$spine_input_file);
+	foreach(@$prefixes){
+		my $fasta_file_name = File::Spec->rel2abs( VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna");
+		say $spinefh "$fasta_file_name\t$_\tfasta";
+	}
+	close $spinefh;
+	# Create a lockfile to signify that the Spine run is in progress
+	open(my $lockfh, '>', $lock_file_name);
+	say $lockfh "$$";
+	close $lockfh;
+	
+	# Run spine
+	my $wdir = VICSIN::param('output_path').'/'.SPINE_DIR;
+	my $log_file_path = VICSIN::param('output_path').'/'.SPINE_DIR."/log.txt";
+	VH_helpers::run_cmd("cd $wdir; perl ".VICSIN::param('spine')." -f $spine_input_file -p ".VICSIN::param('spine_agent_min_perc_id')." -s ".VICSIN::param('spine_agent_min_size_core')." -a ".VICSIN::param('spine_percent_input')." -g ".VICSIN::param('spine_max_distance')." -t ".VICSIN::param('num_threads')." 2>&1; cd -;");
+	
+	unlink $lock_file_name;
+
+	print "Done.\n";
+}
+
+# Runs AGEnt on a single genome against the spine core file
+sub run_agent {
+	local $_ = shift;
+	my $core_file_given = shift;
+
+	my $fasta_file_name = File::Spec->rel2abs( VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna" );
+	my $core_file_name = File::Spec->rel2abs( core_file_name() );
+	my $lock_file_name = VICSIN::param("output_path")."/".AGENT_DIR."/$_/${_}_agent_lock";
+	my $log_file_name = VICSIN::param("output_path")."/".AGENT_DIR."/$_/log.txt";
+	my $wdir = VICSIN::param("output_path")."/".AGENT_DIR."/$_";
+	make_path($wdir);
+
+	if( $core_file_given and -f VICSIN::param("output_path")."/".AGENT_DIR."/$_/AGENT_${_}.AGENT_${_}.accessory.fasta" and not -f $lock_file_name){
+		VH_helpers::log("$_ AGEnt already completed. Skipping.",1);
+	} else {
+		VH_helpers::log("\tRunning AGEnt for $_... ",1);
+		# Create a lockfile to signify that the AGEnt run is in progress
+		open(my $lockfh, '>', $lock_file_name);
+		say $lockfh "$$";
+		close $lockfh;
+		
+		# Run AGEnt
+		VH_helpers::run_cmd("cd $wdir; perl ".VICSIN::param('agent')." -Q F -q $fasta_file_name -R F -r $core_file_name -o AGENT_$_ -m ".VICSIN::param('spine_agent_min_perc_id')." -s ".VICSIN::param('spine_agent_min_size_core')." 2>&1; cd -;");
+
+		unlink $lock_file_name;
+	}
+}
+
 sub get_predictions {
 	my $prefix = shift;
 
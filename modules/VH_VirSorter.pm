@@ -11,6 +11,7 @@ use File::Path qw(make_path);
 use File::Copy qw(mv);
 use VICSIN;
 use VH_helpers;
+use VH_Cache;
 use Data::Dumper;
 
 no define CONVERTED_INPUT_DIR =>;
@@ -21,37 +22,53 @@ sub run {
 
 	VH_helpers::log("Starting VirSorter runs...");
 	foreach(@$prefixes) {
-		my $fasta_file_name =  File::Spec->rel2abs( VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna" );
-		my $wdir = VICSIN::param("output_path")."/".VIRSORTER_DIR."/$_";
-		my $data_dir = VICSIN::param("virsorter_data_dir");
-
-		my $lock_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_VirSorter_lock";
-		my $csv_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_global-phage-signal.csv";
-		my $mga_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/fasta/${_}_mga_final.predict";
-		my $mga_dest_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_mga_final.predict";
-
-		# If the virsorter files exist but not the lock file, virsorter previously completed
-		if ( -f $csv_file_name and -f $mga_dest_file_name and not -f $lock_file_name ){ 
-			VH_helpers::log("\t$_ VirSorter already completed. Skipping.",1);
-		} else {
-			VH_helpers::log("\tRunning VirSorter for $_... ",1);
-			make_path($wdir);
-			# Create a lockfile to signify that the VirSorter run is in progress
-			open(my $lockfh, '>', $lock_file_name);
-			say $lockfh "$$";
-			close $lockfh;
-
-			VH_helpers::run_cmd("cd $wdir; ".VICSIN::param('virsorter')." -d $_ --fna $fasta_file_name --db ".VICSIN::param('virsorter_database')." --data-dir $data_dir --ncpu ".VICSIN::param('num_threads')." 2>&1; cd -;");
-			
-			# Move mga file to its final destination
-			mv($mga_file_name,$mga_dest_file_name);
-			unlink($lock_file_name);
-			VH_helpers::clean_folder($wdir,[$csv_file_name,$mga_dest_file_name,$wdir."/logs"]);
-		}
+		run_one($_);
 	}
 	print "\n";
 }
 
+# Runs VirSorter on a single genome
+sub run_one {
+	local $_ = shift;
+
+	my $fasta_file_name =  File::Spec->rel2abs( VICSIN::param("output_path")."/".CONVERTED_INPUT_DIR."/$_.fna" );
+	my $wdir = VICSIN::param("output_path")."/".VIRSORTER_DIR."/$_";
+	my $data_dir = VICSIN::param("virsorter_data_dir");
+
+	my $lock_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_VirSorter_lock";
+	my $csv_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_global-phage-signal.csv";
+	my $mga_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/fasta/${_}_mga_final.predict";
+	my $mga_dest_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_mga_final.predict";
+
+	my $key_file_name = VICSIN::param("output_path")."/".VIRSORTER_DIR."/${_}/${_}_VirSorter_key";
+	make_path($wdir);
+
+	# VirSorter names the sequences in its outputs after the dataset, so the prefix is part of the key
+	my $key = VH_Cache::key('virsorter',[$fasta_file_name],[VICSIN::param('virsorter')],
+		{'prefix'=>$_,'virsorter_database'=>VICSIN::param('virsorter_database'),'virsorter_data_dir'=>File::Spec->rel2abs($data_dir)});
+	my $prefix = $_;
+	my $result = VH_Cache::run('virsorter',$prefix,$key,{'global-phage-signal.csv'=>$csv_file_name,'mga_final.predict'=>$mga_dest_file_name},$key_file_name,sub {
+		VH_helpers::log("\tRunning VirSorter for $prefix... ",1);
+		# Create a lockfile to signify that the VirSorter run is in progress
+		open(my $lockfh, '>', $lock_file_name);
+		say $lockfh "$$";
+		close $lockfh;
+
+		VH_helpers::run_cmd("cd $wdir; ".VICSIN::param('virsorter')." -d $prefix --fna $fasta_file_name --db ".VICSIN::param('virsorter_database')." --data-dir $data_dir --ncpu ".VICSIN::param('num_threads')." 2>&1; cd -;");
+		
+		# Move mga file to its final destination
+		my $moved = mv($mga_file_name,$mga_dest_file_name);
+		unlink($lock_file_name);
+		VH_helpers::clean_folder($wdir,[$csv_file_name,$mga_dest_file_name,$wdir."/logs",$key_file_name]);
+		return $moved;
+	});
+	if($result eq 'current'){
+		VH_helpers::log("\t$_ VirSorter already completed. Skipping.",1);
+	} elsif($result eq 'hit'){
+		VH_helpers::log("\t$_ VirSorter results found in cache.",1);
+	}
+}
+
 sub get_predictions {
 	my $prefix = shift;
 
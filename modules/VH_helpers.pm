@@ -9,6 +9,10 @@ package VH_helpers;
 use strict;
 use POSIX qw(strftime);
 use File::Path qw(rmtree);
+use IO::Handle;
+use Time::HiRes qw(time);
+use JSON::PP;
+use File::Spec;
 use Data::Dumper;
 
 use VICSIN;
@@ -16,6 +20,11 @@ use VICSIN;
 my $log_name;
 my $log_fh;
 
+# Profiling trace (see vicsin_trace.py); off unless trace_init finds a trace file to write
+my $trace_file;
+my $trace_pid;
+my %stage;
+
 sub current_time {
 	return strftime("[%Y-%m-%d %H:%M:%S] ",localtime);
 }
@@ -62,6 +71,8 @@ sub log {
 		if(not defined $log_name){
 			$log_name = VICSIN::param('output_path').'/'."VICSIN-".strftime("%Y%m%d-%H%M",localtime).".txt";
 			open($log_fh, '>', $log_name);
+			# Scheduled tasks write to the log from forked processes
+			$log_fh->autoflush(1);
 		}
 		print VH_helpers::current_time()." ";
 		print $log_fh VH_helpers::current_time()." ";
@@ -80,9 +91,97 @@ sub log {
 sub run_cmd {
 	my $cmd = shift;
 	VH_helpers::log("\t\t$cmd",2);
+	if(defined $trace_file){
+		# vicsin_trace.py runs the command in a shell, passing its output and exit status through
+		(my $quoted = $cmd) =~ s/'/'\\''/g;
+		return `"@{[VICSIN::param('vicsin_trace')]}" run -- '$quoted'`;
+	}
 	return `$cmd`;
 }
 
+# Total and smallest genome length in a genome_db.py build lengths table: the -dbsize a combined database is searched
+#  with, and the genome the E-value cutoff of that search has to be loosened for
+sub genome_db_sizes {
+	my $lengths_file_name = shift;
+
+	my $total = 0;
+	my $smallest;
+	open(my $lengthsfh, '<', $lengths_file_name);
+	while(my $lengths_line = <$lengthsfh>){
+		chomp $lengths_line;
+		my ($genome, $length) = split("\t",$lengths_line);
+		$total += $length;
+		$smallest = $length if $length > 0 and (not defined $smallest or $length < $smallest);
+	}
+	close($lengthsfh);
+	$total = 1 if $total == 0;
+	$smallest = $total if not defined $smallest;
+	return ($total, $smallest);
+}
+
+# Starts tracing if the trace parameter or $VICSIN_TRACE names a trace file. Commands and Python helpers started
+#  from here on find it in $VICSIN_TRACE
+sub trace_init {
+	my $file_name = VICSIN::param('trace') ne '' ? VICSIN::param('trace') : $ENV{'VICSIN_TRACE'};
+	return if not defined $file_name or $file_name eq '';
+	$trace_file = File::Spec->rel2abs($file_name);
+	$trace_pid = $$;
+	$ENV{'VICSIN_TRACE'} = $trace_file;
+}
+
+sub trace_record {
+	my $record = shift;
+	return if not defined $trace_file;
+	my $line = JSON::PP->new->canonical->encode($record)."\n";
+	open(my $trace_fh, '>>', $trace_file) or return;
+	print $trace_fh $line;
+	close $trace_fh;
+}
+
+# Ends the current pipeline stage, if any, and starts timing the next one
+sub begin_stage {
+	my $name = shift;
+	return if not defined $trace_file;
+	end_stage();
+	my @cpu = times();
+	%stage = ('name'=>$name,'start'=>time(),'user'=>$cpu[0],'sys'=>$cpu[1]);
+	$ENV{'VICSIN_TRACE_STAGE'} = $name;
+	$ENV{'VICSIN_TRACE_CONTEXT'} = '';
+}
+
+sub end_stage {
+	return if not defined $trace_file or not exists $stage{'name'};
+	my @cpu = times();
+	# Peak memory of the driver so far
+	my $max_rss_kb = 0;
+	if(open(my $status_fh, '<', "/proc/$$/status")){
+		while(my $row = <$status_fh>){
+			$max_rss_kb = $1 if $row =~ /^VmHWM:\s+(\d+)/;
+		}
+		close $status_fh;
+	}
+	trace_record({'kind'=>'stage','name'=>$stage{'name'},'stage'=>$stage{'name'},'context'=>'','pid'=>$$,'start'=>$stage{'start'},
+		'wall'=>time()-$stage{'start'},'user'=>$cpu[0]-$stage{'user'},'sys'=>$cpu[1]-$stage{'sys'},'max_rss_kb'=>$max_rss_kb+0,
+		'inputs'=>{},'outputs'=>{},'status'=>0});
+	%stage = ();
+}
+
+# The genome, task or cluster the following commands work on
+sub trace_context {
+	my $context = shift;
+	$ENV{'VICSIN_TRACE_CONTEXT'} = $context if defined $trace_file;
+}
+
+END {
+	# Close the last stage and summarize the run, however the driver exits (forked tasks leave through _exit)
+	if(defined $trace_file and defined $trace_pid and $$ == $trace_pid){
+		my $status = $?;
+		end_stage();
+		system("\"".VICSIN::param('vicsin_trace')."\" summary \"$trace_file\" \"".VICSIN::param('output_path')."/trace_summary.txt\"");
+		$? = $status;
+	}
+}
+
 sub log_done {
 	my $level = shift;
 	if(not defined $level){
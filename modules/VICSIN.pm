@@ -20,6 +20,18 @@ my %params = (
 	"genbank_to_seed"=>"genbank_to_seed.py",
 	"genbank_to_fasta"=>"genbank_to_fasta.py",
 	"core_genome"=>"core_genome.py",
+	"fasta_index"=>"fasta_index.py",
+	"reblast_extend"=>"reblast_extend.py",
+	"contig_coverage"=>"contig_coverage.py",
+	"consensus"=>"consensus.py",
+	"genome_db"=>"genome_db.py",
+	"blast_shards"=>"blast_shards.py",
+	"cluster_workspace"=>"cluster_workspace.py",
+	"mcl_cluster"=>"mcl_cluster.py",
+	"database_loader"=>"database_loader.py",
+	"convert_inputs"=>"convert_inputs.py",
+	"vicsin_trace"=>"vicsin_trace.py",
+	"cluster_cores"=>"cluster_cores.py",
 	"gff_to_seed"=>"gff_to_seed.pl",
 	"prodigal"=>"prodigal",
 	"virsorter"=>"wrapper_phage_contigs_sorter_iPlant.pl",
@@ -33,7 +45,8 @@ my %params = (
 	"mcxload"=>"mcxload",
 	"mcl"=>"mcl",
 	"mcxdump"=>"mcxdump",
-	"blast_to_mcl"=>"Blast_to_MCL.1.py",
+	"blast_to_abc"=>"blast_to_abc.py",
+	"assign_small_predictions"=>"assign_small_predictions.py",
 	"mcldump2clusters"=>"MCLdump2clusters.pl",
 	"pamprotopatterngrab"=>"PAMProtoPatternGrab_full.py",
 	"phispy_windowsize"=>40,
@@ -45,10 +58,12 @@ my %params = (
 	"spine_core_file"=>"",
 	"spacer_fasta_file"=>"",
 	"crispr_match_threshold"=>0.9,
+	"crispr_mode"=>'genome',
 	"known_viral_types"=>"",
 	"virsorter_database"=>2,
 	"masking_file"=>"",
 	"mcl_inflation"=>2.0,
+	"mcl_engine"=>'mcl',
 	"overhang_threshold"=>100,
 	"merge_threshold"=>1500,
 	"clustering_parameter"=>"percent_length_aligned",
@@ -57,6 +72,7 @@ my %params = (
 	"reblast_edge_distance"=>5,
 	"reblast_distance"=>5,
 	"reblast_min_contig_length"=>10000,
+	"reblast_mode"=>'pairwise',
 	"cluster_core_congruence"=>0.66,
 	"percent_id_min_core"=>85,
 	"cluster_min_perc_length"=>0.5,
@@ -64,16 +80,22 @@ my %params = (
 	"cluster_min_bit_score"=>100.0,
 	"cluster_core_max_distance"=>10,
 	"cluster_size_threshold"=>12000,
+	"cluster_store"=>'',
+	"cache_dir"=>'',
+	"cache_max_size"=>100,
 	"use_database"=>'false',
+	"database_backend"=>'mysql',
 	"database_host"=>'',
 	"database_name"=>'',
 	"database_port"=>3306,
 	"database_user"=>'',
 	"database_pass"=>'',
+	"trace"=>'',
 	"verbosity"=>0,
 	"stop"=>'',
 	"skip"=>'',
-	"num_threads"=>1
+	"num_threads"=>1,
+	"max_cores"=>1
 );
 
 our @methods = (
@@ -102,6 +124,18 @@ sub parseParameters {
 				"genbank_to_seed=s"=>\$params{"genbank_to_seed"},
 				"genbank_to_fasta=s"=>\$params{"genbank_to_fasta"},
 				"core_genome=s"=>\$params{"core_genome"},
+				"fasta_index=s"=>\$params{"fasta_index"},
+				"reblast_extend=s"=>\$params{"reblast_extend"},
+				"contig_coverage=s"=>\$params{"contig_coverage"},
+				"consensus=s"=>\$params{"consensus"},
+				"genome_db=s"=>\$params{"genome_db"},
+				"blast_shards=s"=>\$params{"blast_shards"},
+				"cluster_workspace=s"=>\$params{"cluster_workspace"},
+				"mcl_cluster=s"=>\$params{"mcl_cluster"},
+				"database_loader=s"=>\$params{"database_loader"},
+				"convert_inputs=s"=>\$params{"convert_inputs"},
+				"vicsin_trace=s"=>\$params{"vicsin_trace"},
+				"cluster_cores=s"=>\$params{"cluster_cores"},
 				"gff_to_seed=s"=>\$params{"gff_to_seed"},
 				"prodigal=s"=>\$params{"prodigal"},
 				"virsorter=s"=>\$params{"virsorter"},
@@ -115,7 +149,8 @@ sub parseParameters {
 				"mcxload=s"=>\$params{"mcxload"},
 				"mcl=s"=>\$params{"mcl"},
 				"mcxdump=s"=>\$params{"mcxdump"},
-				"blast_to_mcl=s"=>\$params{"blast_to_mcl"},
+				"blast_to_abc=s"=>\$params{"blast_to_abc"},
+				"assign_small_predictions=s"=>\$params{"assign_small_predictions"},
 				"mcldump2clusters=s"=>\$params{"mcldump2clusters"},
 				"pamprotopatterngrab=s"=>\$params{"pamprotopatterngrab"},
 				"phispy_windowsize=i"=>\$params{"phispy_windowsize"},
@@ -127,10 +162,12 @@ sub parseParameters {
 				"spine_core_file=s"=>\$params{"spine_core_file"},
 				"spacer_fasta_file=s"=>\$params{"spacer_fasta_file"},
 				"crispr_match_threshold=f"=>\$params{"crispr_match_threshold"},
+				"crispr_mode=s"=>\$params{"crispr_mode"},
 				"known_viral_types=s"=>\$params{"known_viral_types"},
 				"virsorter_database=i"=>\$params{"virsorter_database"},
 				"masking_file=s"=>\$params{"masking_file"},
 				"mcl_inflation=f"=>\$params{"mcl_inflation"},
+				"mcl_engine=s"=>\$params{"mcl_engine"},
 				"overhang_threshold=i"=>\$params{"overhang_threshold"},
 				"merge_threshold=i"=>\$params{"merge_threshold"},
 				"clustering_parameter=s"=>\$params{"clustering_parameter"},
@@ -139,6 +176,7 @@ sub parseParameters {
 				"reblast_edge_distance=i"=>\$params{"reblast_edge_distance"},
 				"reblast_distance=i"=>\$params{"reblast_distance"},
 				"reblast_min_contig_length=i"=>\$params{"reblast_min_contig_length"},
+				"reblast_mode=s"=>\$params{"reblast_mode"},
 				"cluster_core_congruence=f"=>\$params{"cluster_core_congruence"},
 				"percent_id_min_core=i"=>\$params{"percent_id_min_core"},
 				"cluster_min_perc_length=f"=>\$params{"cluster_min_perc_length"},
@@ -146,16 +184,22 @@ sub parseParameters {
 				"cluster_min_bit_score=f"=>\$params{"cluster_min_bit_score"},
 				"cluster_core_max_distance=i"=>\$params{"cluster_core_max_distance"},
 				"cluster_size_threshold=i"=>\$params{"cluster_size_threshold"},
+				"cluster_store=s"=>\$params{"cluster_store"},
+				"cache_dir=s"=>\$params{"cache_dir"},
+				"cache_max_size=f"=>\$params{"cache_max_size"},
 				"use_database=s"=>\$params{"use_database"},
+				"database_backend=s"=>\$params{"database_backend"},
 				"database_host=s"=>\$params{"database_host"},
 				"database_name=s"=>\$params{"database_name"},
 				"database_port=i"=>\$params{"database_port"},
 				"database_user=s"=>\$params{"database_user"},
 				"database_pass=s"=>\$params{"database_pass"},
+				"trace=s"=>\$params{"trace"},
 				"verbosity=i"=>\$params{"verbosity"},
 				"stop=s"=>\$params{"stop"},
 				"skip=s"=>\$params{"skip"},
-				"num_threads=i"=>\$params{"num_threads"}
+				"num_threads=i"=>\$params{"num_threads"},
+				"max_cores=i"=>\$params{"max_cores"}
 				);
 }
 
@@ -182,225 +226,143 @@ sub setParam {
 }
 
 ##### Consensus processing functions #####
-# Finds overlaps between prediction a and list of predictions b; trims overhanging edges in b
-# TODO this function has way too many side effects
-sub overlap_exists {
-	my ($a,$b) = @_;
-	
-	my $found_overlap = 0;
-	my @predictions_to_add;
-	if( not exists $a->{'used'} and not exists $a->{'masked'} ){
-		foreach my $prediction (@$b){
-			my $this_prediction_hit = 0;
-			if(not (exists $prediction->{'used'} and $prediction->{'used'} == 1) and not exists $prediction->{'masked'} ){
+# Merges and bins the predictions of one genome with consensus.py; returns the five bins of consensus predictions.
+# Method predictions are updated the way the merge and overlap rules leave them: merged and trimmed coordinates,
+#  plus trimmed-off overhangs appended as new predictions
+sub consensus {
+	my $predictions = shift;
+	my $prefix = shift;
+	my $file_stem = shift;
 
-				if($a->{'start'}<=$prediction->{'start'} and $a->{'end'}>=$prediction->{'end'}){
-					# Prediction entirely contained within a
-					$found_overlap = 1;
-					$this_prediction_hit = 1;
-					$prediction->{'used'} = 1;
-				} elsif ($a->{'start'}<=$prediction->{'start'} and $a->{'end'}>=$prediction->{'start'}){
-					#Prediction overhangs right side of a
-					$found_overlap = 1;
-					$this_prediction_hit = 1;
-					if($prediction->{'end'}-$a->{'end'}>=VICSIN::param('overhang_threshold')){
-						push @predictions_to_add, {'start'=>$a->{'end'}+1,'end'=>$prediction->{'end'}};
-						$prediction->{'end'} = $a->{'end'};
-					}
-					$prediction->{'used'} = 1;
-				} elsif ($a->{'start'}<=$prediction->{'end'} and $a->{'end'}>=$prediction->{'end'}){
-					# Prediction overhangs left side of a
-					$found_overlap = 1;
-					$this_prediction_hit = 1;
-					if($a->{'start'}-$prediction->{'start'}>=VICSIN::param('overhang_threshold')){
-						push @predictions_to_add, {'start'=>$prediction->{'start'},'end'=>$a->{'start'}-1};
-						$prediction->{'start'} = $a->{'start'};
-					}
-					$prediction->{'used'} = 1;
-				} elsif ($a->{'start'}>$prediction->{'start'} and $a->{'end'}<$prediction->{'end'}){
-					# Prediction overhangs a on both sides
-					$found_overlap = 1;
-					$this_prediction_hit = 1;
-					if($a->{'start'}-$prediction->{'start'}>=VICSIN::param('overhang_threshold')){
-						push @predictions_to_add, {'start'=>$prediction->{'start'},'end'=>$a->{'start'}-1};
-						$prediction->{'start'} = $a->{'start'};
-					}
-					if($prediction->{'end'}-$a->{'end'}>=VICSIN::param('overhang_threshold')){
-						push @predictions_to_add, {'start'=>$a->{'end'}+1,'end'=>$prediction->{'end'}};
-						$prediction->{'end'} = $a->{'end'};
-					}
-					$prediction->{'used'} = 1;
-				}
-			}
-			if($this_prediction_hit == 1){
-				# Keep track of which hits are incorporated here
-				foreach my $method (@VICSIN::methods){
-					if(exists $prediction->{$method->{'key'}}){
-						if(not exists $a->{$method->{'key'}}){
-							$a->{$method->{'key'}} = [];
-						}
-						push @{$a->{$method->{'key'}}}, @{$prediction->{$method->{'key'}}};
-					}
-				}
+	my $predictions_file_name = "$file_stem.predictions.tbl";
+	my $consensus_file_name = "$file_stem.consensus.tbl";
+	my $updates_file_name = "$file_stem.updates.tbl";
+
+	# Save the method table and every method's predictions in array order
+	open(my $predictions_fh, '>', $predictions_file_name) or die "Could not write consensus predictions file.";
+	foreach my $method (@VICSIN::methods){
+		print $predictions_fh join("\t",'#method',$method->{'key'},$method->{'abbr'},$method->{'bin'},$method->{'extend'})."\n";
+	}
+	foreach my $method (@VICSIN::methods){
+		next if not exists $predictions->{$prefix}{$method->{'key'}};
+		foreach my $sequence (sort keys %{$predictions->{$prefix}{$method->{'key'}}}){
+			my $method_predictions = $predictions->{$prefix}{$method->{'key'}}{$sequence};
+			for(my $i = 0; $i < scalar(@$method_predictions); $i++){
+				print $predictions_fh join("\t",$method->{'key'},$sequence,$i,$method_predictions->[$i]{'start'},$method_predictions->[$i]{'end'},(exists $method_predictions->[$i]{'masked'})?1:0)."\n";
 			}
 		}
-		push @{$b},@predictions_to_add;
 	}
-	return $found_overlap;
-}
+	close($predictions_fh);
 
-# Merges the predictions in the given array as much as possible
-# TODO ignore masked-out predictions
-sub merge_predictions {
-	my $mergeable_predictions = shift;
+	VH_helpers::run_cmd(VICSIN::param('consensus')." $prefix $predictions_file_name $consensus_file_name $updates_file_name -m ".VICSIN::param('merge_threshold')." -o ".VICSIN::param('overhang_threshold'));
 
-	# Merge until there ain't no more to merge
-	my $found_merges;
-	my %merged_predictions;
-	foreach my $sequence (keys %{$mergeable_predictions}){
-		do {
-			$merged_predictions{$sequence} = [];
-			$found_merges = 0;
-			for (my $i = 0; $i < scalar(@{$mergeable_predictions->{$sequence}}); $i++){
-				if ( not (exists $mergeable_predictions->{$sequence}[$i]{'masked'} and $mergeable_predictions->{$sequence}[$i]{'masked'} == 1) ){ # Ignore masked out predictions
-					my $found_match = 0; 
-					for (my $j=0; $j < scalar(@{$merged_predictions{$sequence}}); $j++){
-						# If predictions overlap or are within merge_threshold of each other
-						if($found_match == 0 
-							and not (exists $merged_predictions{$sequence}[$j]{'masked'} and $merged_predictions{$sequence}[$j]{'masked'} == 1) # Ignore masked out predictions
-							and $mergeable_predictions->{$sequence}[$i]{'start'}<=$merged_predictions{$sequence}[$j]{'end'}+VICSIN::param('merge_threshold')
-							and $merged_predictions{$sequence}[$j]{'start'}<=$mergeable_predictions->{$sequence}[$i]{'end'}+VICSIN::param('merge_threshold')){
-
-							$found_match = 1;
-							$found_merges = 1;
-							# Expand bounds of j to contain i
-							if($mergeable_predictions->{$sequence}[$i]{'start'}<$merged_predictions{$sequence}[$j]{'start'}){
-								$merged_predictions{$sequence}[$j]{'start'} = $mergeable_predictions->{$sequence}[$i]{'start'};
-							}
-							if($mergeable_predictions->{$sequence}[$i]{'end'}>$merged_predictions{$sequence}[$j]{'end'}){
-								$merged_predictions{$sequence}[$j]{'end'} = $mergeable_predictions->{$sequence}[$i]{'end'};
-							}
-							# merge methods string
-							foreach my $method (@{$mergeable_predictions->{$sequence}[$i]{'methods'}}){
-								if(not grep(/^$method$/,@{$merged_predictions{$sequence}[$j]{'methods'}})){
-									push @{$merged_predictions{$sequence}[$j]{'methods'}}, $method;
-								}
-							}
+	# Apply merged/trimmed coordinates and overhang fragments to the method predictions
+	open(my $updates_fh, '<', $updates_file_name) or die "Could not open consensus updates file.";
+	while(my $line = <$updates_fh>){
+		chomp $line;
+		my ($key,$sequence,$index,$start,$end) = split "\t", $line;
+		my $method_predictions = $predictions->{$prefix}{$key}{$sequence};
+		if($index < scalar(@$method_predictions)){
+			$method_predictions->[$index]{'start'} = $start;
+			$method_predictions->[$index]{'end'} = $end;
+		} else {
+			push @$method_predictions, {'start'=>$start,'end'=>$end};
+		}
+	}
+	close($updates_fh);
 
-							# Keep track of which hits are incorporated here
-							foreach my $method (@VICSIN::methods){
-								if(exists $mergeable_predictions->{$sequence}[$i]{$method->{'key'}}){
-									if(not exists $merged_predictions{$sequence}[$j]{$method->{'key'}}){
-										$merged_predictions{$sequence}[$j]{$method->{'key'}} = [];
-									}
-									push @{$merged_predictions{$sequence}[$j]{$method->{'key'}}}, @{$mergeable_predictions->{$sequence}[$i]{$method->{'key'}}};
-								}
-							}
-						}
-					}
-					if($found_match == 0 ){
-						# If this prediction didn't overlap with any others, add it to the array
-						push @{$merged_predictions{$sequence}}, $mergeable_predictions->{$sequence}[$i];
-					}
-				}
-			}
-			$mergeable_predictions->{$sequence} = [];
-			push @{$mergeable_predictions->{$sequence}},@{$merged_predictions{$sequence}};
-		} while ($found_merges == 1);
+	# Read binned predictions; provenance lists the method predictions (by index) each one incorporates
+	my @binned_predictions = ([],[],[],[],[]);
+	open(my $consensus_fh, '<', $consensus_file_name) or die "Could not open consensus output file.";
+	while(my $line = <$consensus_fh>){
+		chomp $line;
+		my ($bin,$name,$sequence,$methods,$start,$end,$provenance) = split "\t", $line;
+		my %final_prediction = ('name'=>$name,'sequence'=>$sequence,'methods'=>$methods,'start'=>$start,'end'=>$end);
+		foreach my $source (split ';', (defined $provenance ? $provenance : '')){
+			my ($key,$indexes) = split ':', $source;
+			$final_prediction{$key} = [split ',', $indexes];
+		}
+		push @{$binned_predictions[$bin]}, \%final_prediction;
 	}
+	close($consensus_fh);
+	unlink($consensus_file_name, $updates_file_name);
 
-	return %merged_predictions;
+	return \@binned_predictions;
 }
 
-sub bin_predictions {
-	my $merged_predictions = shift;
-	my $predictions = shift;
-	my $prefix = shift;
-
-	my @binned_predictions = ([],[],[],[],[]);
-	# First pass: compare non-extending predictions with extending predictions
-	my %predCount;
-	foreach my $sequence (keys %{$merged_predictions}){
-		$predCount{$sequence} = 0;
-		for (my $j = 0; $j < scalar(@{$merged_predictions->{$sequence}}); $j++){
-			for(my $i=0; $i<scalar(@VICSIN::methods); $i++){
-				if($VICSIN::methods[$i]{'extend'} == 0){
-					if(exists $predictions->{$prefix}{$VICSIN::methods[$i]{'key'}}{$sequence}){
-						if(VICSIN::overlap_exists($merged_predictions->{$sequence}[$j],$predictions->{$prefix}{$VICSIN::methods[$i]{'key'}}{$sequence}) == 1){
-							push @{$merged_predictions->{$sequence}[$j]{'methods'}},$VICSIN::methods[$i]{'abbr'};
-						}
-					}
-				}
-			}
-			my $bin;
-			if(scalar(@{$merged_predictions->{$sequence}[$j]{'methods'}}) > 2 or join(",",@{$merged_predictions->{$sequence}[$j]{'methods'}}) eq "A,C"){  # 11/20 request that A,C also be included in bin 1
-				$bin = 0;
-			} elsif(scalar(@{$merged_predictions->{$sequence}[$j]{'methods'}}) == 2) {
-				$bin = 1;
-			} elsif (scalar(@{$merged_predictions->{$sequence}[$j]{'methods'}}) == 1){
-				for(my $k=0; $k<scalar(@VICSIN::methods); $k++){
-					if($VICSIN::methods[$k]{'abbr'} eq $merged_predictions->{$sequence}[$j]{'methods'}[0]){
-						$bin = $VICSIN::methods[$k]{'bin'};
-					}
-				}
-			}
+##### Masking functions #####
+# Turns one genome's masks (sequence => list of {start, end}) into a mask index, in place: each sequence's masks are
+#  sorted by start, with overlapping or adjacent masks merged
+sub index_masks {
+	my $masks = shift;
 
-			my %final_prediction = ('name'=>$prefix.'-'.$sequence.'-'.$predCount{$sequence},'sequence'=>$sequence,'methods'=>join(',',@{$merged_predictions->{$sequence}[$j]{'methods'}}),'start'=>$merged_predictions->{$sequence}[$j]{'start'},'end'=>$merged_predictions->{$sequence}[$j]{'end'});
-			$predCount{$sequence}++;
-			foreach my $method (@VICSIN::methods){
-				if(exists $merged_predictions->{$sequence}[$j]{$method->{'key'}}){
-					$final_prediction{$method->{'key'}} = $merged_predictions->{$sequence}[$j]{$method->{'key'}};
+	foreach my $sequence (keys %{$masks}){
+		my @merged;
+		foreach my $mask (sort { $a->{'start'} <=> $b->{'start'} } @{$masks->{$sequence}}){
+			if(scalar(@merged) > 0 and $mask->{'start'} <= $merged[-1]{'end'}+1){
+				if($mask->{'end'} > $merged[-1]{'end'}){
+					$merged[-1]{'end'} = $mask->{'end'};
 				}
+			} else {
+				push @merged, {'start'=>$mask->{'start'},'end'=>$mask->{'end'}};
 			}
-			push @{$binned_predictions[$bin]}, \%final_prediction;
 		}
+		$masks->{$sequence} = \@merged;
 	}
+	return $masks;
+}
 
-	# Second pass: compare non-extending predictions amongst themselves
-	for(my $i=0;$i<scalar @VICSIN::methods; $i++) {
-		if($VICSIN::methods[$i]{'extend'}==0){ # Only compare methods we haven't already merged
-			foreach my $sequence (keys %{ $predictions->{$prefix}{$VICSIN::methods[$i]{'key'}}}){
-				if (not exists $predCount{$sequence}){
-					$predCount{$sequence} = 0;
-				}
-				foreach my $prediction ( @{ $predictions->{$prefix}{$VICSIN::methods[$i]{'key'}}{$sequence} }){
-					if(not exists $prediction->{'used'} and $prediction->{'start'}>0 and $prediction->{'end'}>0){ 
-						my $used_methods = $VICSIN::methods[$i]{'abbr'};
-						my $matches = 1;
-						for(my $j=$i+1; $j<scalar @VICSIN::methods; $j++){
-							if($VICSIN::methods[$j]{'extend'}==0){
-								if(exists $predictions->{$prefix}{$VICSIN::methods[$j]{'key'}}{$sequence}){
-									if(VICSIN::overlap_exists($prediction,$predictions->{$prefix}{$VICSIN::methods[$j]{'key'}}{$sequence}) == 1){
-										$matches++;
-										$used_methods .= ",".$VICSIN::methods[$j]{'abbr'};
-									}
-								}
-							}
-						}
-						my $bin;
-						if($matches > 2){
-							$bin = 0;
-						} elsif($matches == 2){
-							$bin = 1;
-						} elsif($matches == 1){
-							$bin = $VICSIN::methods[$i]{'bin'};
-						}
+# Index of the last mask starting at or before position in a sorted mask list, or -1
+sub last_mask_before {
+	my ($masks, $position) = @_;
 
-						my %final_prediction = ('name'=>$prefix.'-'.$sequence.'-'.$predCount{$sequence},'sequence'=>$sequence,'methods'=>$used_methods,'start'=>$prediction->{'start'},'end'=>$prediction->{'end'});
-						$predCount{$sequence}++;
-						foreach my $method (@VICSIN::methods){
-							if(exists $prediction->{$method->{'key'}}){
-								$final_prediction{$method->{'key'}} = $prediction->{$method->{'key'}};
-							}
-						}
-						push @{$binned_predictions[$bin]}, \%final_prediction;
-					}
-				}
-			}
+	my ($low, $high) = (0, scalar(@{$masks}));
+	while($low < $high){
+		my $mid = int(($low+$high)/2);
+		if($masks->[$mid]{'start'} <= $position){
+			$low = $mid+1;
+		} else {
+			$high = $mid;
 		}
 	}
+	return $low-1;
+}
 
-	return \@binned_predictions;
+# Resolves start..end against one sequence's indexed masks; returns the trimmed start and end, or an empty list if
+#  the interval is entirely masked or contains a masked area
+sub mask_interval {
+	my ($masks, $start, $end) = @_;
+
+	my $i = last_mask_before($masks,$start);
+	if($i >= 0 and $masks->[$i]{'end'} >= $start){
+		# Interval entirely contained within mask
+		return () if $masks->[$i]{'end'} >= $end;
+		# Left side overlaps mask; trim left side
+		$start = $masks->[$i]{'end'}+1;
+	}
+	my $j = last_mask_before($masks,$end);
+	if($j >= 0 and $masks->[$j]{'end'} >= $end){
+		# Right side overlaps mask; trim right side
+		$end = $masks->[$j]{'start'}-1;
+		$j--;
+	}
+	# Interval contains a masked area within it
+	return () if $j >= 0 and $masks->[$j]{'end'} >= $start;
+	return ($start,$end);
+}
+
+# Trims a prediction against one sequence's indexed masks, marking it masked if it is masked out; returns 1 if masked
+sub mask_prediction {
+	my ($masks, $prediction) = @_;
+
+	my ($start,$end) = mask_interval($masks,$prediction->{'start'},$prediction->{'end'});
+	if(not defined $start){
+		$prediction->{'masked'} = 1;
+		return 1;
+	}
+	$prediction->{'start'} = $start;
+	$prediction->{'end'} = $end;
+	return 0;
 }
 
 sub apply_mask {
@@ -410,34 +372,15 @@ sub apply_mask {
 
 	if(exists $masks->{$prefix}){
 		VH_helpers::log("\t\tApplying mask... ",1);
-		foreach my $sequence ( keys %{$masks->{$prefix}} ){
-			foreach my $mask ( @{$masks->{$prefix}{$sequence}} ){
-				foreach my $method ( keys %{$predictions->{$prefix}} ){
-					if(exists $predictions->{$prefix}{$method}{$sequence}){
-						my @predictions_to_add;
-						foreach my $prediction (@{$predictions->{$prefix}{$method}{$sequence}}){
-							if($mask->{'start'}<=$prediction->{'start'} and $mask->{'end'}>=$prediction->{'end'}){
-								# Prediction entirely contained within mask; set to ignore prediction
-								$prediction->{'start'} = -1; # Ignoring is _much_ easier than removing from the array
-								$prediction->{'end'} = -1;
-								$prediction->{'masked'} = 1;
-							} elsif ($mask->{'start'}<=$prediction->{'start'} and $mask->{'end'}>=$prediction->{'start'}) {
-								# Prediction's left side overlaps mask; trim left side
-								$prediction->{'start'} = $mask->{'end'}+1;
-							} elsif ($mask->{'start'}<=$prediction->{'end'} and $mask->{'end'}>=$prediction->{'end'}) {
-								# Prediction's right side overlaps mask; trim right side
-								$prediction->{'end'} = $mask->{'start'}-1;
-							} elsif ($mask->{'start'}>$prediction->{'start'} and $mask->{'end'}<$prediction->{'end'} and not exists $prediction->{'used'}) {
-								# Prediction contains a masked area within it; set to ignore prediction
-								$prediction->{'start'} = -1; # Ignoring is _much_ easier than removing from the array
-								$prediction->{'end'} = -1;
-								$prediction->{'masked'} = 1;
-								# Prediction contains a masked area within it; split into two predictions. Don't split ignored predictions.
-								# push @predictions_to_add, {'start'=>$mask->{'end'}+1,'end'=>$prediction->{'end'}};
-								# $prediction->{'end'} = $mask->{'start'}-1;
-							}
+		foreach my $method ( keys %{$predictions->{$prefix}} ){
+			foreach my $sequence ( keys %{$predictions->{$prefix}{$method}} ){
+				if(exists $masks->{$prefix}{$sequence}){
+					foreach my $prediction (@{$predictions->{$prefix}{$method}{$sequence}}){
+						if(not exists $prediction->{'masked'} and mask_prediction($masks->{$prefix}{$sequence},$prediction)){
+							# Ignoring is _much_ easier than removing from the array
+							$prediction->{'start'} = -1;
+							$prediction->{'end'} = -1;
 						}
-						push @{$predictions->{$prefix}{$method}{$sequence}}, @predictions_to_add;
 					}
 				}
 			}
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#reblast_extend.py <hits> <contigs> <predictions> <output> [options]
+#Extends consensus predictions with the reBLAST hits on their contig (VH_ReBlast extension step).
+#hits: tab delimited contig, start, end, percent identity, in the order VH_ReBlast parsed them
+#contigs: tab delimited contig, length
+#predictions: tab delimited id, contig, start, end
+#output: tab delimited id, start, end, 1 if reBLAST hits changed the prediction (else 0)
+#Hits are kept in a per-contig interval tree, so each extension round only visits the hits that cross a prediction's ends.
+from __future__ import print_function
+import argparse
+import sys
+
+
+class IntervalTree(object):
+    """centered interval tree over (start, end, index) hits, answering which hits strictly straddle a point"""
+
+    def __init__(self, intervals):
+        self.center = None
+        if not intervals:
+            return
+        points = sorted(p for start, end, index in intervals for p in (start, end))
+        self.center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: -interval[1])
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def straddling(self, point, found):
+        """adds the index of every hit with start < point < end to found"""
+        node = self
+        while node is not None and node.center is not None:
+            if point <= node.center:
+                # every hit here ends at or after the center
+                for start, end, index in node.by_start:
+                    if start >= point:
+                        break
+                    if end > point:
+                        found.add(index)
+                if point == node.center:
+                    return found
+                node = node.left
+            else:
+                # every hit here starts at or before the center
+                for start, end, index in node.by_end:
+                    if end <= point:
+                        break
+                    found.add(index)
+                node = node.right
+        return found
+
+
+class ContigHits(object):
+    """the reBLAST hits of one contig, indexed for the extension and edge snapping rules"""
+
+    def __init__(self, hits, length, min_perc_id, edge_distance):
+        self.hits = hits
+        self.tree = IntervalTree([(start, end, i) for i, (start, end, perc_id) in enumerate(hits) if perc_id >= min_perc_id])
+        # hits reaching within edge_distance of the contig end / start, for snapping predictions to the edges
+        self.length = length
+        self.right_edge_start = min([start for start, end, perc_id in hits if end > length - edge_distance] or [None]) if length is not None else None
+        self.left_edge_end = max([end for start, end, perc_id in hits if start < 1 + edge_distance] or [None])
+
+    def extenders(self, start, end, distance):
+        """hits reaching past either end of the prediction (by more than distance), in their original order"""
+        found = set()
+        self.tree.straddling(start - distance, found)
+        self.tree.straddling(end + distance, found)
+        return sorted(found)
+
+
+def extend(prediction_start, prediction_end, contig_hits, distance):
+    """applies the VH_ReBlast extension rules to one prediction; returns start, end, and whether it changed"""
+    start, end = prediction_start, prediction_end
+    changed = False
+    while True:
+        overlaps = contig_hits.extenders(start, end, distance)
+        if not overlaps:
+            break
+        changed = True
+        # the largest extender, where a later hit wins ties (and near ties) as in the Perl implementation
+        maxlength = 0
+        largest = None
+        for i in overlaps:
+            hit_start, hit_end, perc_id = contig_hits.hits[i]
+            if hit_end - hit_start + 1 >= maxlength:
+                maxlength = hit_end - hit_start
+                largest = (hit_start, hit_end)
+        start = min(start, largest[0])
+        end = max(end, largest[1])
+    # snap to the contig ends when a hit spans from the prediction to the edge
+    if contig_hits.right_edge_start is not None and contig_hits.right_edge_start < end + distance:
+        end = contig_hits.length
+        changed = True
+    if contig_hits.left_edge_end is not None and contig_hits.left_edge_end > start - distance:
+        start = 1
+        changed = True
+    return start, end, changed
+
+
+def read_hits(hits_file):
+    hits = {}
+    with open(hits_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                contig, start, end, perc_id = line.rstrip('\n').split('\t')[:4]
+                start, end = int(start), int(end)
+                hits.setdefault(contig, []).append((min(start, end), max(start, end), float(perc_id)))
+    return hits
+
+
+def read_contigs(contigs_file):
+    lengths = {}
+    with open(contigs_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                contig, length = line.rstrip('\n').split('\t')[:2]
+                lengths[contig] = int(length)
+    return lengths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extend predictions with reBLAST hits.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('hits', help='tab delimited contig, start, end, percent identity')
+    parser.add_argument('contigs', help='tab delimited contig, length')
+    parser.add_argument('predictions', help='tab delimited id, contig, start, end')
+    parser.add_argument('output', help='tab delimited id, start, end, changed')
+    parser.add_argument('-p', '--min_perc_id', type=float, help='minimum percent identity of an extending hit', default=90)
+    parser.add_argument('-d', '--distance', type=int, help='hits within this distance of a prediction extend it', default=5)
+    parser.add_argument('-e', '--edge_distance', type=int, help='hits within this distance of a contig edge snap to it', default=5)
+    args = parser.parse_args()
+
+    hits = read_hits(args.hits)
+    lengths = read_contigs(args.contigs)
+    indexes = {}
+    with open(args.predictions, 'r') as predictions, open(args.output, 'w') as out:
+        for line in predictions:
+            if not line.strip():
+                continue
+            name, contig, start, end = line.rstrip('\n').split('\t')[:4]
+            start, end = int(start), int(end)
+            changed = False
+            if contig in hits:
+                if contig not in indexes:
+                    indexes[contig] = ContigHits(hits[contig], lengths.get(contig), args.min_perc_id, args.edge_distance)
+                start, end, changed = extend(start, end, indexes[contig], args.distance)
+            out.write('%s\t%d\t%d\t%d\n' % (name, start, end, 1 if changed else 0))
+
+    sys.exit(0)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#vicsin_trace.py run [options] -- <command>
+#vicsin_trace.py summary <trace> <output>
+#Profiling trace for VICSIN. Every record is one JSON line appended to the trace file named by $VICSIN_TRACE:
+#  kind (stage, command or span), name, stage, context (genome, task or cluster), pid, start (epoch seconds),
+#  wall, user and sys seconds, max_rss_kb, inputs and outputs ({file: bytes}), status
+#run: runs a shell command as VH_helpers::run_cmd did (output passes through, and the exit status is the command's),
+#  and records its wall time, CPU time and peak memory (from wait4) and the sizes of the files named on its command line:
+#  files that existed and were unchanged are inputs, new or modified ones are outputs
+#summary: writes a per-stage table, then a per-program table, of the records in a trace
+#Python helpers record their own phases with span(); it does nothing when $VICSIN_TRACE is not set.
+from __future__ import print_function
+import argparse
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+TRACE_VARIABLE = 'VICSIN_TRACE'
+CONTEXT_VARIABLE = 'VICSIN_TRACE_CONTEXT'
+STAGE_VARIABLE = 'VICSIN_TRACE_STAGE'
+
+
+def write_record(record, trace_file=None):
+    """appends one record to the trace; a single write per line keeps lines whole between processes"""
+    trace_file = trace_file or os.environ.get(TRACE_VARIABLE)
+    if not trace_file:
+        return
+    line = (json.dumps(record, sort_keys=True) + '\n').encode()
+    descriptor = os.open(trace_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+def file_sizes(paths):
+    sizes = {}
+    for path in paths:
+        if path and os.path.isfile(path):
+            sizes[path] = os.path.getsize(path)
+    return sizes
+
+
+class Span(object):
+    """records the wall and CPU time of a block of Python code, and the sizes of its input and output files; use it as
+    a context manager, or call end() where the block stops. CPU time of the programs the block runs and waits for
+    counts as well."""
+
+    def __init__(self, name, context=None, inputs=(), outputs=()):
+        self.active = bool(os.environ.get(TRACE_VARIABLE))
+        if not self.active:
+            return
+        self.name = name
+        self.context = context if context is not None else os.environ.get(CONTEXT_VARIABLE, '')
+        self.inputs = inputs
+        self.outputs = outputs
+        self.start = time.time()
+        self.before = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+
+    def end(self, status=0):
+        if not self.active:
+            return
+        self.active = False
+        after = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+        write_record({'kind': 'span', 'name': self.name, 'stage': os.environ.get(STAGE_VARIABLE, ''), 'context': self.context,
+            'pid': os.getpid(), 'start': self.start, 'wall': time.time() - self.start,
+            'user': sum(a.ru_utime - b.ru_utime for a, b in zip(after, self.before)),
+            'sys': sum(a.ru_stime - b.ru_stime for a, b in zip(after, self.before)),
+            'max_rss_kb': max(usage.ru_maxrss for usage in after), 'inputs': file_sizes(self.inputs), 'outputs': file_sizes(self.outputs),
+            'status': status})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.end(0 if kind is None else 1)
+        return False
+
+
+span = Span
+
+
+def command_files(command):
+    """existing files and candidate output paths named on a command line, with their (size, mtime) beforehand"""
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        words = command.split()
+    paths = set()
+    for word in words:
+        # -out=file and >file style arguments
+        word = word.rstrip(';&|')
+        for candidate in (word, word.split('=', 1)[-1], word.lstrip('<>')):
+            if candidate and not candidate.startswith('-') and (os.path.sep in candidate or '.' in candidate):
+                paths.add(candidate)
+    return dict((path, (os.path.getsize(path), os.path.getmtime(path)) if os.path.isfile(path) else None) for path in paths)
+
+
+def run(command, name, stage, context):
+    before = command_files(command)
+    start = time.time()
+    process = subprocess.Popen(['/bin/sh', '-c', command])
+    status, usage = os.wait4(process.pid, 0)[1:]
+    wall = time.time() - start
+    inputs, outputs = {}, {}
+    for path, previous in before.items():
+        if os.path.isfile(path):
+            current = (os.path.getsize(path), os.path.getmtime(path))
+            (inputs if current == previous else outputs)[path] = current[0]
+    exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+    write_record({'kind': 'command', 'name': name or program_name(command), 'stage': stage, 'context': context, 'pid': process.pid,
+        'start': start, 'wall': wall, 'user': usage.ru_utime, 'sys': usage.ru_stime, 'max_rss_kb': usage.ru_maxrss,
+        'inputs': inputs, 'outputs': outputs, 'status': exit_status, 'command': command})
+    return exit_status
+
+
+def program_name(command):
+    """the program a command line runs, skipping an interpreter"""
+    words = command.split()
+    for word in words:
+        base = os.path.basename(word.strip('"\''))
+        if base not in ('python', 'python2', 'python3', 'perl', 'env', 'sh', 'bash') and '=' not in base:
+            return base
+    return os.path.basename(words[0]) if words else ''
+
+
+def read_trace(trace_file):
+    with open(trace_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a line cut short by a killed run
+                    continue
+
+
+def summarize(records, key):
+    """totals per key(record): count, wall, user, sys, largest max_rss_kb, input and output bytes"""
+    table = OrderedDict()
+    for record in records:
+        row = table.setdefault(key(record), [0, 0.0, 0.0, 0.0, 0, 0, 0])
+        row[0] += 1
+        row[1] += record.get('wall', 0)
+        row[2] += record.get('user', 0)
+        row[3] += record.get('sys', 0)
+        row[4] = max(row[4], record.get('max_rss_kb', 0))
+        row[5] += sum(record.get('inputs', {}).values())
+        row[6] += sum(record.get('outputs', {}).values())
+    return table
+
+
+def write_summary(trace_file, output_file):
+    records = sorted(read_trace(trace_file), key=lambda record: record.get('start', 0))
+    columns = ['count', 'wall_seconds', 'user_seconds', 'sys_seconds', 'max_rss_mb', 'input_mb', 'output_mb']
+
+    def format_row(name, row):
+        return '\t'.join([name, str(row[0])] + ['%.2f' % value for value in row[1:4]] + ['%.1f' % (row[4] / 1024.0)] +
+            ['%.1f' % (value / 1048576.0) for value in row[5:7]])
+
+    with open(output_file, 'w') as out:
+        # Stages are timed as a whole by the driver; their CPU time is the driver's own
+        out.write('\t'.join(['stage'] + columns + ['commands', 'command_wall_seconds', 'command_cpu_seconds']) + '\n')
+        stages = summarize([record for record in records if record.get('kind') == 'stage'], lambda record: record.get('name', ''))
+        # helper spans run inside commands, so only the commands are added up here
+        commands = summarize([record for record in records if record.get('kind') == 'command'], lambda record: record.get('stage', ''))
+        for stage in list(stages) + [stage for stage in commands if stage not in stages]:
+            row = stages.get(stage, [0, 0.0, 0.0, 0.0, 0, 0, 0])
+            command_row = commands.get(stage, [0, 0.0, 0.0, 0.0, 0, 0, 0])
+            out.write('%s\t%d\t%.2f\t%.2f\n' % (format_row(stage, row), command_row[0], command_row[1], command_row[2] + command_row[3]))
+        out.write('\n' + '\t'.join(['program'] + columns) + '\n')
+        programs = summarize([record for record in records if record.get('kind') != 'stage'], lambda record: record.get('name', ''))
+        for name, row in sorted(programs.items(), key=lambda item: -item[1][1]):
+            out.write(format_row(name, row) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record and summarize a VICSIN profiling trace.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='action')
+    run_parser = subparsers.add_parser('run', help='run a shell command and record it; the command follows --')
+    run_parser.add_argument('-t', '--trace', help='trace file (default: $VICSIN_TRACE)')
+    run_parser.add_argument('-n', '--name', help='name of the record (default: the program run)')
+    run_parser.add_argument('-s', '--stage', help='pipeline stage (default: $VICSIN_TRACE_STAGE)')
+    run_parser.add_argument('-c', '--context', help='genome, task or cluster (default: $VICSIN_TRACE_CONTEXT)')
+    summary_parser = subparsers.add_parser('summary', help='write the per-stage and per-program tables of a trace')
+    summary_parser.add_argument('trace', help='trace file')
+    summary_parser.add_argument('output', help='tab delimited summary')
+    # the command follows --, and is left to the shell
+    argv = sys.argv[1:]
+    split = argv.index('--') if '--' in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+
+    if args.action == 'run':
+        if args.trace:
+            os.environ[TRACE_VARIABLE] = args.trace
+        sys.exit(run(' '.join(argv[split + 1:]), args.name, args.stage or os.environ.get(STAGE_VARIABLE, ''),
+            args.context or os.environ.get(CONTEXT_VARIABLE, '')))
+    elif args.action == 'summary':
+        write_summary(args.trace, args.output)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    sys.exit(0)